@@ -0,0 +1,3 @@
+"""
+Benchmarks for the stitchers - see the runner module.
+"""
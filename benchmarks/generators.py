@@ -0,0 +1,164 @@
+"""
+Generators for synthetic containers, requests & conditions.
+"""
+
+import random
+
+import networkx as nx
+
+import stitcher
+
+# attribute name -> distribution of the values.
+ATTRIBUTES = {'rank': ('int', 0, 10),
+              'group': ('choice', ['x', 'y', 'z'])}
+
+
+def _value(rnd, distribution):
+    """
+    Draw a value from a distribution - ('int', low, high), ('float', low,
+    high), ('normal', mean, sigma) or ('choice', values).
+    """
+    kind = distribution[0]
+    if kind == 'int':
+        return rnd.randint(distribution[1], distribution[2])
+    if kind == 'float':
+        return rnd.uniform(distribution[1], distribution[2])
+    if kind == 'normal':
+        return rnd.gauss(distribution[1], distribution[2])
+    if kind == 'choice':
+        return rnd.choice(distribution[1])
+    raise ValueError('Unknown distribution: %s' % kind)
+
+
+def rels(types):
+    """
+    The stitches needed - request type 'x<i>' maps to container type 't<i>'.
+    """
+    return dict(('x%s' % i, 't%s' % i) for i in range(types))
+
+
+def container(size, types=3, degree=2, attributes=None, seed=None):
+    """
+    Create a connected container graph.
+
+    :param size: Number of nodes.
+    :param types: Number of node types - 't0', 't1', ...
+    :param degree: Number of edges per node (on average).
+    :param attributes: dictionary of attribute name -> distribution (default
+        ATTRIBUTES).
+    :param seed: Seed for the random number generator.
+    :return: The graph.
+    """
+    rnd = random.Random(seed)
+    attributes = ATTRIBUTES if attributes is None else attributes
+    graph = nx.DiGraph()
+    for i in range(size):
+        attrs = dict((attrn, _value(rnd, distribution))
+                     for attrn, distribution in attributes.items())
+        # every type is present - as long as there are enough nodes.
+        attrs[stitcher.TYPE_ATTR] = 't%s' % (i % types)
+        graph.add_node('c%s' % i, **attrs)
+    for i in range(1, size):
+        # spanning tree first - so the graph is connected.
+        graph.add_edge('c%s' % rnd.randrange(i), 'c%s' % i)
+    for _ in range(max(0, size * degree - (size - 1))):
+        src, trg = rnd.randrange(size), rnd.randrange(size)
+        if src != trg:
+            graph.add_edge('c%s' % src, 'c%s' % trg)
+    return graph
+
+
+def request(size, types=3, seed=None):
+    """
+    Create a request graph - a random tree.
+
+    :param size: Number of nodes.
+    :param types: Number of node types - 'x0', 'x1', ...
+    :param seed: Seed for the random number generator.
+    :return: The graph.
+    """
+    rnd = random.Random(seed)
+    graph = nx.DiGraph()
+    for i in range(size):
+        graph.add_node('r%s' % i, **{stitcher.TYPE_ATTR: 'x%s' % (i % types)})
+    for i in range(1, size):
+        graph.add_edge('r%s' % rnd.randrange(i), 'r%s' % i)
+    return graph
+
+
+def conditions(request_graph, mix, attributes=None, seed=None):
+    """
+    Create conditions for the nodes of a request.
+
+    :param request_graph: The request.
+    :param mix: dictionary of condition name -> number of conditions - e.g.
+        {'lt': 1, 'diff': 2, 'share': 1}.
+    :param attributes: dictionary of attribute name -> distribution the
+        container was generated with (default ATTRIBUTES).
+    :param seed: Seed for the random number generator.
+    :return: dictionary containing the conditions.
+    """
+    rnd = random.Random(seed)
+    attributes = ATTRIBUTES if attributes is None else attributes
+    numeric = [attrn for attrn, distribution in sorted(attributes.items())
+               if distribution[0] != 'choice']
+    strings = [attrn for attrn, distribution in sorted(attributes.items())
+               if distribution[0] == 'choice']
+    nodes = list(request_graph.nodes())
+    res = {}
+    for cond in sorted(mix):
+        for _ in range(mix[cond]):
+            if cond in ['same', 'diff']:
+                item = (cond, tuple(rnd.sample(nodes, 2)))
+                res.setdefault('compositions', []).append(item)
+            elif cond in ['share', 'nshare']:
+                attrn = rnd.choice(sorted(attributes))
+                members = rnd.sample(nodes, min(len(nodes), 2))
+                item = (cond, (attrn, members))
+                res.setdefault('compositions', []).append(item)
+            else:
+                pool = sorted(attributes)
+                if cond in ['lg', 'lt', 'gt']:
+                    pool = numeric
+                elif cond == 'regex':
+                    pool = strings
+                attrn = rnd.choice(pool)
+                attrv = _value(rnd, attributes[attrn])
+                if cond == 'regex':
+                    attrv = '^%s' % attrv
+                item = (cond, (rnd.choice(nodes), (attrn, attrv)))
+                res.setdefault('attributes', []).append(item)
+    return res
+
+
+def scenario(container_size, request_size, types=3, degree=2, mix=None,
+             attributes=None, seed=0):
+    """
+    Create a benchmark scenario.
+
+    :param container_size: Number of container nodes.
+    :param request_size: Number of request nodes.
+    :param types: Number of node types.
+    :param degree: Number of edges per container node (on average).
+    :param mix: dictionary of condition name -> number of conditions.
+    :param attributes: dictionary of attribute name -> distribution.
+    :param seed: Seed for the random number generator.
+    :return: dictionary with the parameters, container, request, rels &
+        conditions.
+    """
+    tmp = request(request_size, types, seed=seed)
+    name = 'c%s-r%s-t%s' % (container_size, request_size, types)
+    for cond in sorted(mix or {}):
+        name += '-%s%s' % (cond, mix[cond])
+    return {'name': name,
+            'params': {'container_size': container_size,
+                       'request_size': request_size,
+                       'types': types,
+                       'degree': degree,
+                       'mix': mix or {},
+                       'seed': seed},
+            'container': container(container_size, types, degree,
+                                   attributes, seed=seed),
+            'request': tmp,
+            'rels': rels(types),
+            'conditions': conditions(tmp, mix or {}, attributes, seed=seed)}
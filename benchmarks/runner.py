@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+
+"""
+Runs the stitchers on generated scenarios & reports wall time, peak memory,
+the size of the search space, the number of candidates explored and the
+quality of the results. Results can be saved as JSON & compared to those of
+an earlier run:
+
+    $ python3 -m benchmarks.runner -o new.json -b old.json
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import random
+import sys
+import time
+import tracemalloc
+
+import stitcher
+
+from benchmarks import generators
+from stitcher import bidding
+from stitcher import evolutionary
+from stitcher import exact
+from stitcher import iterative_repair
+from stitcher import profiling
+from stitcher import stitch
+from stitcher import validators
+
+ALGORITHMS = {
+    'global': lambda rels: stitch.GlobalStitcher(rels, view=True),
+    'backtrack': lambda rels: stitch.GlobalStitcher(rels, backtrack=True,
+                                                    view=True),
+    'evolutionary': lambda rels: evolutionary.EvolutionarySticher(
+        rels, max_iter=30, fit_goal=0.0, view=True),
+    'bidding': lambda rels: bidding.BiddingStitcher(rels, view=True),
+    'repair': lambda rels: iterative_repair.IterativeRepairStitcher(
+        rels, view=True),
+    'exact': lambda rels: exact.ExactStitcher(rels, view=True)
+}
+
+# these return all stitches - skipped for too large search spaces.
+EXHAUSTIVE = ['global', 'backtrack']
+
+# the count (see profiling.Stats) reported as the number of candidates
+# explored.
+EXPLORED = {'global': 'candidates',
+            'backtrack': 'candidates',
+            'evolutionary': 'fitness',
+            'bidding': 'messages',
+            'repair': 'steps',
+            'exact': 'nodes'}
+
+SUITE = [(20, 3, None),
+         (40, 4, {'lt': 1, 'diff': 1}),
+         (100, 5, {'lg': 1, 'share': 1}),
+         (400, 6, {'diff': 2, 'nshare': 1})]
+
+
+def search_space(scenario):
+    """
+    Number of possible stitches - the product of the number of possible
+    targets per request node.
+    """
+    res = 1
+    for _, attrs in scenario['request'].nodes(data=True):
+        tzpe = scenario['rels'].get(attrs[stitcher.TYPE_ATTR])
+        res *= len([node for node, tmp in
+                    scenario['container'].nodes(data=True)
+                    if tmp[stitcher.TYPE_ATTR] == tzpe])
+    return res
+
+
+def quality(scenario, graphs):
+    """
+    Check the results: the number of valid ones - all request nodes stitched
+    to a node of the right type, adhering the conditions - and the lowest
+    cost (sum of the ranks of the targets) of those.
+    """
+    container = scenario['container']
+    request = scenario['request']
+    valid = 0
+    cost = None
+    for graph in graphs:
+        edges = validators.stitches_of(graph, container, request)
+        targets = dict(edges)
+        if set(targets) != set(request.nodes()) or any(
+                container.nodes[trg][stitcher.TYPE_ATTR] !=
+                scenario['rels'][request.nodes[src][stitcher.TYPE_ATTR]]
+                for src, trg in targets.items()):
+            continue
+        edges = [(node, targets[node]) for node in request]
+        if not stitch.my_filter(container, {'tmp': edges},
+                                scenario['conditions']):
+            continue
+        valid += 1
+        tmp = sum(stitch.rank_cost(container, src, trg)
+                  for src, trg in edges)
+        cost = tmp if cost is None else min(cost, tmp)
+    return valid, cost
+
+
+def measure(name, scenario, repeat=1):
+    """
+    Run an algorithm on a scenario. The wall time is the best of the runs;
+    the peak memory & the stats are determined in an extra run (tracing
+    slows it down).
+
+    :param name: Name of the algorithm.
+    :param scenario: The scenario - see generators.scenario.
+    :param repeat: Number of runs.
+    :return: dictionary with the measurements.
+    """
+    sticher = ALGORITHMS[name](scenario['rels'])
+    seed = scenario['params']['seed']
+
+    def once(stats=None):
+        # the heuristics use the random module.
+        random.seed(seed)
+        return sticher.stitch(scenario['container'], scenario['request'],
+                              conditions=scenario['conditions'], stats=stats)
+
+    wall = float('inf')
+    graphs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        graphs = once()
+        wall = min(wall, time.perf_counter() - start)
+    stats = profiling.Stats()
+    tracemalloc.start()
+    try:
+        once(stats)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    valid, cost = quality(scenario, graphs)
+    return {'time': wall,
+            'peak_memory': peak,
+            'explored': stats.counts.get(EXPLORED.get(name), 0),
+            'stats': stats.as_dict(),
+            'results': len(graphs),
+            'valid': valid,
+            'cost': cost}
+
+
+def _measure(conn, name, scenario, repeat):
+    """
+    Run measure() in a separate process - sends the measurements or the
+    error.
+    """
+    try:
+        conn.send(measure(name, scenario, repeat))
+    except Exception as err:  # pylint: disable=broad-except
+        conn.send(err)
+    conn.close()
+
+
+def measure_timed(name, scenario, repeat=1, timeout=None):
+    """
+    Same as measure() - but in a separate process which is terminated if it
+    does not finish in time.
+
+    :param name: Name of the algorithm.
+    :param scenario: The scenario - see generators.scenario.
+    :param repeat: Number of runs.
+    :param timeout: Maximum number of seconds for all runs.
+    :return: dictionary with the measurements.
+    """
+    conn, child = multiprocessing.Pipe(duplex=False)
+    proc = multiprocessing.Process(target=_measure,
+                                   args=(child, name, scenario, repeat))
+    proc.start()
+    child.close()
+    try:
+        if not conn.poll(timeout):
+            raise TimeoutError('no result within %ss' % timeout)
+        res = conn.recv()
+    finally:
+        proc.terminate()
+        proc.join()
+        conn.close()
+    if isinstance(res, Exception):
+        raise res
+    return res
+
+
+def run(scenarios, algorithms=None, repeat=1, max_space=10 ** 6,
+        timeout=None):
+    """
+    Run the algorithms on the scenarios.
+
+    :param scenarios: List of scenarios - see generators.scenario.
+    :param algorithms: Names of the algorithms (default: all).
+    :param repeat: Number of runs per algorithm & scenario.
+    :param max_space: Exhaustive algorithms are skipped if the search space
+        is larger than this.
+    :param timeout: Optional maximum number of seconds per algorithm &
+        scenario - if it takes longer it is recorded as error.
+    :return: List of dictionaries with the measurements.
+    """
+    res = []
+    for scenario in scenarios:
+        space = search_space(scenario)
+        for name in algorithms or sorted(ALGORITHMS):
+            item = {'scenario': scenario['name'],
+                    'params': scenario['params'],
+                    'algorithm': name,
+                    'search_space': space}
+            if name in EXHAUSTIVE and space > max_space:
+                item['skipped'] = True
+                res.append(item)
+                continue
+            try:
+                if timeout is None:
+                    item.update(measure(name, scenario, repeat))
+                else:
+                    item.update(measure_timed(name, scenario, repeat,
+                                              timeout))
+            except Exception as err:  # pylint: disable=broad-except
+                # a failing algorithm should not stop the others.
+                item['error'] = '%s: %s' % (err.__class__.__name__, err)
+            res.append(item)
+    return res
+
+
+def compare(baseline, results, tolerance=0.25):
+    """
+    Compare results to those of an earlier run.
+
+    :param baseline: The earlier results.
+    :param results: The new results.
+    :param tolerance: Relative slow down which is accepted.
+    :return: List of messages describing the regressions.
+    """
+    old = dict(((item['scenario'], item['algorithm']), item)
+               for item in baseline)
+    res = []
+    for item in results:
+        key = (item['scenario'], item['algorithm'])
+        if key not in old or 'time' not in old[key]:
+            continue
+        before = old[key]
+        if 'error' in item:
+            res.append('%s on %s: %s' % (key[1], key[0], item['error']))
+            continue
+        if 'time' not in item:
+            continue
+        if item['time'] > before['time'] * (1 + tolerance):
+            res.append('%s on %s: %.4fs -> %.4fs' % (key[1], key[0],
+                                                     before['time'],
+                                                     item['time']))
+        if item['valid'] < before['valid']:
+            res.append('%s on %s: %s -> %s valid results' %
+                       (key[1], key[0], before['valid'], item['valid']))
+        if before['cost'] is not None and item['cost'] is not None and \
+                item['cost'] > before['cost']:
+            res.append('%s on %s: cost %s -> %s' % (key[1], key[0],
+                                                    before['cost'],
+                                                    item['cost']))
+    return res
+
+
+def report(results):
+    """
+    Format the results as a table.
+    """
+    lines = ['%-28s %-13s %12s %10s %12s %10s %8s %6s %6s' %
+             ('scenario', 'algorithm', 'space', 'time [s]', 'memory [kB]',
+              'explored', 'results', 'valid', 'cost')]
+    for item in results:
+        if item.get('skipped') or 'error' in item:
+            lines.append('%-28s %-13s %12.3g %s' %
+                         (item['scenario'], item['algorithm'],
+                          item['search_space'],
+                          item.get('error', 'skipped')))
+            continue
+        lines.append('%-28s %-13s %12.3g %10.4f %12.1f %10d %8d %6d %6s' %
+                     (item['scenario'], item['algorithm'],
+                      item['search_space'], item['time'],
+                      item['peak_memory'] / 1024.0, item.get('explored', 0),
+                      item['results'], item['valid'], item['cost']))
+    return '\n'.join(lines)
+
+
+def _mix(value):
+    """
+    Parse a condition mix - e.g. 'lt=1,diff=2'.
+    """
+    res = {}
+    for item in value.split(','):
+        if item:
+            cond, count = item.split('=')
+            res[cond] = int(count)
+    return res
+
+
+def main(argv):
+    """
+    Run the benchmarks.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the stitchers.')
+    parser.add_argument('-s', '--sizes', nargs='*',
+                        help='Scenarios as <container size>x<request size> '
+                             '- default a suite of scenarios.')
+    parser.add_argument('-t', '--types', type=int, default=3,
+                        help='Number of node types.')
+    parser.add_argument('-m', '--mix', type=_mix, default={},
+                        help='Conditions per scenario - e.g. lt=1,diff=2.')
+    parser.add_argument('-a', '--algorithms', nargs='*',
+                        choices=sorted(ALGORITHMS),
+                        help='Algorithms to run - default all.')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Number of runs - the best one counts.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-space', type=float, default=1e6,
+                        help='Skip exhaustive algorithms for larger search '
+                             'spaces.')
+    parser.add_argument('--timeout', type=float, default=60,
+                        help='Maximum number of seconds per algorithm & '
+                             'scenario.')
+    parser.add_argument('-o', '--output', help='Save the results as JSON.')
+    parser.add_argument('-b', '--baseline',
+                        help='Compare to the results of an earlier run.')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Accepted relative slow down.')
+    args = parser.parse_args(argv)
+
+    if args.sizes:
+        suite = [tuple(int(item) for item in size.split('x')) + (args.mix,)
+                 for size in args.sizes]
+    else:
+        suite = SUITE
+    scenarios = [generators.scenario(container_size, request_size,
+                                     types=args.types, mix=mix,
+                                     seed=args.seed)
+                 for container_size, request_size, mix in suite]
+    results = run(scenarios, args.algorithms, args.repeat, args.max_space,
+                  args.timeout)
+    print(report(results))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as tmp:
+            json.dump(results, tmp, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as tmp:
+            regressions = compare(json.load(tmp), results, args.tolerance)
+        for item in regressions:
+            print('Regression: %s' % item)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    logging.disable(logging.WARNING)
+    sys.exit(main(sys.argv[1:]))
@@ -11,6 +11,8 @@ import logging
 
 from networkx.readwrite import json_graph
 
+import stitcher
+
 from stitcher import bidding
 from stitcher import evolutionary
 from stitcher import iterative_repair
@@ -20,7 +22,6 @@ from stitcher import vis
 
 FORMAT = "%(asctime)s - %(filename)s - %(lineno)s - " \
          "%(levelname)s - %(message)s"
-logging.basicConfig(format=FORMAT, level=logging.DEBUG)
 
 
 def main(algo):
@@ -37,18 +38,18 @@ def main(algo):
     if algo == 'evolutionary':
         # to show the true power of this :-)
         conditions = {'compositions': [('diff', ('k', 'l'))]}
-        stitcher = evolutionary.EvolutionarySticher(rels)
+        sticher = evolutionary.EvolutionarySticher(rels)
     elif algo == 'bidding':
         # to show the true power of this :-)
         conditions = {'attributes': [('lt', ('l', ('rank', 9)))]}
-        stitcher = bidding.BiddingStitcher(rels)
+        sticher = bidding.BiddingStitcher(rels)
     elif algo == 'repair':
         # to show the true power of this :-)
         conditions = {'attributes': [('eq', ('k', ('rank', 5)))]}
-        stitcher = iterative_repair.IterativeRepairStitcher(rels)
+        sticher = iterative_repair.IterativeRepairStitcher(rels)
     else:
-        stitcher = stitch.GlobalStitcher(rels)
-    graphs = stitcher.stitch(container, request, conditions=conditions)
+        sticher = stitch.GlobalStitcher(rels)
+    graphs = sticher.stitch(container, request, conditions=conditions)
 
     if graphs:
         results = validators.validate_incoming_edges(graphs, {'b': 5})
@@ -61,5 +62,11 @@ if __name__ == '__main__':
     PARSER = argparse.ArgumentParser()
     PARSER.add_argument('-a', choices=OPT, default='global',
                         help='Select the stitching algorithm.')
-    ALGO = PARSER.parse_args(sys.argv[1:]).a
-    main(ALGO)
+    PARSER.add_argument('-v', '--verbose', action='count', default=0,
+                        help='More output: -v info, -vv debug, -vvv the '
+                             'structured trace.')
+    ARGS = PARSER.parse_args(sys.argv[1:])
+    LEVELS = [logging.WARNING, logging.INFO, logging.DEBUG, stitcher.TRACE]
+    logging.basicConfig(format=FORMAT,
+                        level=LEVELS[min(ARGS.verbose, len(LEVELS) - 1)])
+    main(ARGS.a)
@@ -2,22 +2,51 @@
 Module implementing the graph stitcher.
 """
 
+import logging
+
+import networkx as nx
+
+from stitcher import overlay
+
 TYPE_ATTR = 'type'
 
+# log level of the structured trace - below DEBUG, so it needs to be enabled
+# explicitly: logging.getLogger('stitcher').setLevel(stitcher.TRACE).
+TRACE = 5
+logging.addLevelName(TRACE, 'TRACE')
+
+
+def trace(logger, event, **fields):
+    """
+    Log a structured trace record - the event & its fields are available to
+    handlers as the record's event & fields attributes. Only if the trace is
+    enabled the record is created.
+
+    :param logger: The logger to use.
+    :param event: Name of the event - e.g. 'message'.
+    :param fields: Data of the event.
+    """
+    if logger.isEnabledFor(TRACE):
+        logger.log(TRACE, '%s: %s', event, fields,
+                   extra={'event': event, 'fields': fields})
+
 
 class Stitcher:
     """
     A stitcher.
     """
 
-    def __init__(self, rels):
+    def __init__(self, rels, view=False):
         """
         Initiate the stitcher.
 
         ;:param rels: A dictionary defining what type of nodes in the request
             must be stitched to what type of nodes in the container.
+        :param view: If True the resulting graphs are read-only views which
+            reference the container & request instead of copies of them.
         """
         self.rels = rels
+        self.view = view
 
     def stitch(self, container, request, conditions=None):
         """
@@ -32,3 +61,19 @@ class Stitcher:
         :return: List of resulting graphs(s).
         """
         raise NotImplementedError('Not implemented yet.')
+
+    def _result(self, container, request, stitches):
+        """
+        Create a resulting graph: the union of container & request plus the
+        stitches - or a view on the same.
+
+        :param container: A graph describing the existing container.
+        :param request: A graph describing the request.
+        :param stitches: List of (source, target) tuples.
+        :return: The resulting graph.
+        """
+        if self.view:
+            return overlay.StitchView(container, request, stitches)
+        graph = nx.union(container, request)
+        graph.add_edges_from(stitches)
+        return graph
@@ -2,19 +2,36 @@
 Implements stitching, and filtering functions based on a bidding concept.
 """
 
-import copy
+import asyncio
+import collections
 import logging
-import re
 
 import networkx as nx
 
 import stitcher
 
+from stitcher import compiler
+from stitcher import indexing
+from stitcher import profiling
+
+LOG = logging.getLogger(__name__)
+
 TMP = {}
 
 FACTOR_1 = 1.25
 FACTOR_2 = 1.5
 
+# graph attribute holding the name -> entity map of a container.
+ENTITIES = 'entities'
+# graph attribute holding the number of messages send in a bidding round.
+MESSAGES = 'messages'
+# graph attribute holding the keys of the sub stitches of a bidding round.
+SUB_STITCHES = 'sub_stitches'
+
+# default maximum number of messages send in a bidding round - per pair of
+# container nodes, as each change of a bid is passed on to all entities.
+MESSAGES_PER_PAIR = 4
+
 
 def _other_bids(all_bids):
     """
@@ -27,35 +44,48 @@ def _other_bids(all_bids):
     return res
 
 
-def _attribute_condy(condy, my_bids, param, node_attr):
+def _lg_condy(check, my_bids, node_attr):
     """
-    Basic rules to deal with attribute conditions.
+    Huge delta -> high bid.
     """
-    node = param[0]
-    attrn = param[1][0]
-    attrv = param[1][1]
-    if node not in my_bids:
-        # I'm not bidding on this node - so no need to do sth.
-        return
+    my_bids[check.node] = node_attr[check.attrn] - check.attrv + \
+        my_bids[check.node]
+
+
+def _lt_condy(check, my_bids, node_attr):
+    """
+    Huge delta -> high bid.
+    """
+    my_bids[check.node] = check.attrv - node_attr[check.attrn] + \
+        my_bids[check.node]
+
+
+def _drop_condy(check, my_bids, node_attr):
+    """
+    Attr not present or not satisfying the condition -> drop bid.
+    """
+    if check.test(node_attr) != compiler.OK:
+        my_bids.pop(check.node)
+
+
+def _regex_condy(check, my_bids, node_attr):
+    """
+    Attr present and regex does not match -> drop bid.
+    """
+    if check.test(node_attr) == compiler.MISMATCH:
+        my_bids.pop(check.node)
+
 
-    if condy == 'lg':
-        # huge delta -> high bid.
-        my_bids[node] = node_attr[attrn] - attrv + my_bids[node]
-    elif condy == 'lt':
-        # huge delta -> high bid.
-        my_bids[node] = attrv - node_attr[attrn] + my_bids[node]
-    elif condy == 'eq':
-        # attr not present or not equal -> drop bid.
-        if attrn not in node_attr or attrv != node_attr[attrn]:
-            my_bids.pop(node)
-    elif condy == 'neq':
-        # attr present and equal -> drop bid.
-        if attrn in node_attr and attrv == node_attr[attrn]:
-            my_bids.pop(node)
-    elif condy == 'regex':
-        # attr present and reges does not match -> drop bid.
-        if attrn in node_attr and not re.search(attrv, node_attr[attrn]):
-            my_bids.pop(node)
+def _attribute_condy(func):
+    """
+    Basic rules to deal with attribute conditions.
+    """
+    def condy(entity, check, my_bids, _):
+        if check.node not in my_bids:
+            # I'm not bidding on this node - so no need to do sth.
+            return
+        func(check, my_bids, entity.container.nodes[entity])
+    return condy
 
 
 def _same_condy(my_bids, param):
@@ -81,17 +111,21 @@ def _diff_condy(my_bids, param, assigned, all_bids):
     # if other entity has the others - I can increase my bid for the greater
     # good.
     for item in param:
+        if item not in my_bids:
+            # I'm not bidding on this node - so no need to do sth.
+            continue
         if set(param) - set(assigned.keys()) == {item}:
             # if others assigned increase by factor 2
             my_bids[item] = my_bids[item] * FACTOR_2
         elif set(param) - set(_other_bids(all_bids)) == {item}:
             # if others are bid on increase by factor 1
             my_bids[item] = my_bids[item] * FACTOR_1
-        elif len(set(param) - set(_other_bids(all_bids))) == 0 \
-                and item in my_bids:
+        elif len(set(param) - set(_other_bids(all_bids))) == 0:
             # bids out for all - increase by factor 1
             my_bids[item] = my_bids[item] * FACTOR_1
 
+    if not my_bids:
+        return
     # keep highest bid - remove rest.
     keeper = max(my_bids,
                  key=lambda k: my_bids[k] if k in param else float('-inf'))
@@ -100,41 +134,215 @@ def _diff_condy(my_bids, param, assigned, all_bids):
             my_bids.pop(item)
 
 
+def _entity(container, name):
+    """
+    Look up an entity of the container by name. Uses the name -> entity map
+    of the container graph - which is (re)build if the name is not in it.
+    """
+    entities = container.graph.setdefault(ENTITIES, {})
+    if name not in entities:
+        entities.clear()
+        entities.update((node.name, node) for node in container)
+    return entities[name]
+
+
 def _nshare_condy(my_bids, param, assigned, node, container):
     attrn = param[0]
     attrv_assigned = None
     nodes = param[1]
     for item in nodes:
         if item in assigned and attrv_assigned is None:
-            tmp = [n for n in container.nodes if n.name == assigned[item][0]]
-            attrv_assigned = container.nodes[tmp[0]][attrn]
+            tmp = _entity(container, assigned[item][0])
+            attrv_assigned = container.nodes[tmp][attrn]
         elif attrv_assigned is not None and item in my_bids \
                 and container.nodes[node][attrn] != attrv_assigned:
             my_bids[item] = my_bids[item] * FACTOR_2
 
 
-CACHE = {}
+_CONDITIONS = {
+    'lg': _attribute_condy(_lg_condy),
+    'lt': _attribute_condy(_lt_condy),
+    'eq': _attribute_condy(_drop_condy),
+    'neq': _attribute_condy(_drop_condy),
+    'gt': _attribute_condy(_drop_condy),
+    'regex': _attribute_condy(_regex_condy),
+    'same': lambda entity, check, my_bids, _: _same_condy(my_bids,
+                                                          check.nodes),
+    'diff': lambda entity, check, my_bids, assigned: _diff_condy(
+        my_bids, check.nodes, assigned, entity.bids),
+    'share': lambda entity, check, my_bids, assigned: entity._share_condy(
+        check, my_bids, assigned),
+    'nshare': lambda entity, check, my_bids, assigned: _nshare_condy(
+        my_bids, (check.attrn, check.nodes), assigned, entity,
+        entity.container)
+}
+
+MODES = ['recursive', 'queue', 'async']
+
+
+class SubStitchCache:
+    """
+    Least recently used cache of the outcome of sub stitches (used by the
+    share condition). Keyed by a fingerprint of the sub-container, the
+    request, the mapping & the conditions - so it can be shared
+    between stitches.
+    """
+
+    def __init__(self, maxsize=128):
+        """
+        Initiate the cache.
 
+        :param maxsize: Maximum number of outcomes to keep.
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
 
-def _sub_stitch(container, request, mapping, condy):
-    if (container, request) not in CACHE:
-        opt_graph = nx.DiGraph()
+    def get(self, key):
+        """
+        Return the cached outcome (or None) - counts the hits & misses.
+        """
+        if key in self._data:
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        """
+        Add an outcome - drops the least recently used one if full.
+        """
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        """
+        Drop all outcomes and reset the counters.
+        """
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+CACHE = SubStitchCache()
+
+
+def _fingerprint(container, request, mapping, condy, mode, delta,
+                 max_messages=None):
+    """
+    Canonical key of a sub stitch - based on the names & attributes of the
+    nodes of the container & request, not on the identity of the graphs.
+    """
+    return (_graph_key(container), _graph_key(request),
+            repr(sorted(mapping.items())),
+            repr(sorted(condy.conditions.items())), mode, delta,
+            max_messages)
+
+
+def _graph_key(graph):
+    """
+    Canonical key of a graph - its nodes with their attributes & its edges.
+    """
+    nodes = tuple(sorted((str(node), repr(sorted(attr.items())))
+                         for node, attr in graph.nodes(data=True)))
+    edges = tuple(sorted((str(src), str(trg)) for src, trg in graph.edges()))
+    return nodes, edges
+
+
+def _entries(msg):
+    """
+    The (entity, version, bids) entries of a message - see Entity._message.
+    """
+    if 'changed' in msg:
+        return [(item, version, bid)
+                for item, (version, bid) in msg['changed'].items()]
+    versions = msg.get('versions', {})
+    return [(item, versions.get(item, 0), msg['bids'][item])
+            for item in msg['bids']]
+
+
+def _coalesce(old, new):
+    """
+    Merge two messages of the same sender - the bids of the newer one win.
+    """
+    if 'changed' not in new:
+        # all bids of the sender - the newer message has all I need.
+        return new
+    changed = dict(old['changed'])
+    changed.update(new['changed'])
+    return {'changed': changed, 'assigned': new['assigned']}
+
+
+def _kick_off(entity, src):
+    """
+    Start the bidding using the entity's mode.
+
+    :return: Tuple of the assignments & bids - or None if the bidding was
+        stopped.
+    """
+    msg = {'bids': [], 'assigned': {}}
+    if entity.mode == 'queue':
+        res = entity.run(msg, src)
+    elif entity.mode == 'async':
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            res = asyncio.run(entity.run_async(msg, src))
+        else:
+            raise RuntimeError('Cannot run the bidding within a running '
+                               'event loop - use stitch_async().')
+    else:
+        res = entity.trigger(msg, src)
+    return None if _stopped(entity) else res
+
+
+def _stopped(entity):
+    """
+    Check if the bidding round of an entity ran out of messages - the
+    assignments are incomplete then.
+    """
+    return entity.max_messages is not None and \
+        entity.container.graph.get(MESSAGES, 0) > entity.max_messages
+
+
+def _sub_stitch(container, request, mapping, condy, mode='recursive',
+                delta=False, max_messages=None, key=None):
+    if key is None:
+        key = _fingerprint(container, request, mapping, condy, mode, delta,
+                           max_messages)
+    assign = CACHE.get(key)
+    if assign is None:
+        opt_graph = nx.DiGraph(**{ENTITIES: {}})
         tmp = {}
-        for node, attr in container.nodes(data=True):
+        # sorted - the order of the nodes of a subgraph view is arbitrary,
+        # but the outcome of the bidding depends on it.
+        for node, attr in sorted(container.nodes(data=True),
+                                 key=lambda item: str(item[0])):
             tmp[node] = Entity(str(node), mapping, request, opt_graph,
-                               conditions=condy)
+                               conditions=condy, mode=mode, delta=delta,
+                               max_messages=max_messages)
             opt_graph.add_node(tmp[node], **attr)
-        for src, trg, attr in container.edges(data=True):
+            opt_graph.graph[ENTITIES][tmp[node].name] = tmp[node]
+        for src, trg, attr in sorted(container.edges(data=True),
+                                     key=lambda item: (str(item[0]),
+                                                       str(item[1]))):
             opt_graph.add_edge(tmp[src], tmp[trg], **attr)
 
         start_node = list(tmp.values())[0]
 
-        # kick off
-        assign, _ = start_node.trigger({'bids': [], 'assigned': {}},
-                                       'sub-init')
-        CACHE[container, request] = assign
+        # kick off - no outcome if the bidding was stopped.
+        res = _kick_off(start_node, 'sub-init')
+        assign = {} if res is None else res[0]
+        CACHE.put(key, assign)
 
-    return CACHE[(container, request)]
+    return assign
 
 
 class Entity:
@@ -142,21 +350,41 @@ class Entity:
     A node in a graph that can bid on nodes of the request graph.
     """
 
-    def __init__(self, name, mapping, request, container, conditions=None):
+    def __init__(self, name, mapping, request, container, conditions=None,
+                 targets=None, mode='recursive', delta=False, stats=None,
+                 max_messages=None):
         self.name = name
         self.container = container
         self.request = request
         self.mapping = mapping
         self.bids = {}
-        self.conditions = conditions or {}
-
-    def _share_condy(self, condy, param, my_bids, assigned):
+        # version of the bids per entity - an entity counts up the version of
+        # its own bids when they change; the bids of others are only taken
+        # over if they are newer than the ones I know of.
+        self.versions = {}
+        self.conditions = compiler.compile_conditions(conditions)
+        # request nodes this entity can bid on - determined if not given.
+        self.targets = targets
+        # how messages are passed on - see MODES.
+        self.mode = mode
+        # if True only changed bids are send - see _message.
+        self.delta = delta
+        # per neighbour the versions of the bids it is known to have & the
+        # entities whose bids changed since - which it does not know of yet.
+        self._peers = {}
+        self._pending = {}
+        # optional profiling.Stats - counts the messages processed.
+        self.stats = profiling.get(stats)
+        # maximum number of messages send in a bidding round (or None).
+        self.max_messages = max_messages
+
+    def _share_condy(self, check, my_bids, assigned):
         """
         If I know that mine and surrounding bids are lower than what another
         combo can offer - drop bids & assignments!
         """
-        attrn = param[0]
-        nodes = param[1]
+        attrn = check.attrn
+        nodes = list(check.nodes)
         if attrn not in self.container.nodes[self]:
             for item in nodes:
                 if item in my_bids:
@@ -167,8 +395,8 @@ class Entity:
 
         cache = {}
         # step 1) find possible groups that I know of.
-        for item in bids:
-            tmp = [n for n in self.container.nodes() if n.name == item][0]
+        for item in sorted(bids):
+            tmp = _entity(self.container, item)
             if attrn in self.container.nodes[tmp]:
                 attrv = self.container.nodes[tmp][attrn]
                 if attrv not in cache:
@@ -177,14 +405,28 @@ class Entity:
                     cache[attrv].append(tmp)
 
         options = {}
+        sub_request = nx.subgraph(self.request, nodes)
+        sub_condy = self.conditions.without(check.condition)
+        # sub stitches run within the turn of an entity - so no async.
+        mode = 'queue' if self.mode == 'async' else self.mode
+        # the container, request & conditions do not change during the
+        # bidding - so the key of a group's sub stitch is only calculated
+        # once.
+        keys = self.container.graph.setdefault(SUB_STITCHES, {})
         # step 2) figure out what the groups are worth.
         for item in cache:
             sub_container = nx.subgraph(self.container, cache[item])
-            sub_request = nx.subgraph(self.request, nodes)
-            sub_condy = copy.deepcopy(self.conditions)
-            sub_condy['compositions'].remove(condy)
+            group = (check.operator, attrn, check.nodes,
+                     frozenset(tmp.name for tmp in cache[item]))
+            if group not in keys:
+                keys[group] = _fingerprint(sub_container, sub_request,
+                                           self.mapping, sub_condy, mode,
+                                           self.delta, self.max_messages)
+            self.stats.count('sub_stitches')
             assign = _sub_stitch(sub_container, sub_request, self.mapping,
-                                 sub_condy)
+                                 sub_condy, mode=mode, delta=self.delta,
+                                 max_messages=self.max_messages,
+                                 key=keys[group])
             # set() so 2,1 == 1,2 in py 3.
             if set(assign.keys()) == set(nodes):
                 # is complete
@@ -211,84 +453,254 @@ class Entity:
         """
         Alter bids based on conditions.
         """
-        if 'attributes' in self.conditions:
-            for item in self.conditions['attributes']:
-                condy = item[0]
-                param = item[1]
-                node_attr = self.container.nodes[self]
-                _attribute_condy(condy, my_bids, param, node_attr)
-        if 'compositions' in self.conditions:
-            for item in self.conditions['compositions']:
-                condy = item[0]
-                param = item[1]
-                if condy == 'same':
-                    _same_condy(my_bids, param)
-                elif condy == 'diff':
-                    _diff_condy(my_bids, param, assigned, self.bids)
-                elif condy == 'share':
-                    self._share_condy(item, param, my_bids, assigned)
-                elif condy == 'nshare':
-                    _nshare_condy(my_bids, param, assigned,
-                                  self,
-                                  self.container)
+        for check, func in self.conditions.bind(_CONDITIONS):
+            func(self, check, my_bids, assigned)
         return my_bids
 
     def _calc_credits(self, assigned):
         tmp = {}
-        for node, attr in self.request.nodes(data=True):
-            if self.mapping[attr[stitcher.TYPE_ATTR]] == \
-                    self.container.nodes[self][stitcher.TYPE_ATTR]:
+        if self.targets is not None:
+            for node in self.targets:
                 tmp[node] = 1.0
+        else:
+            for node, attr in self.request.nodes(data=True):
+                if self.mapping[attr[stitcher.TYPE_ATTR]] == \
+                        self.container.nodes[self][stitcher.TYPE_ATTR]:
+                    tmp[node] = 1.0
         if tmp:
-            self.bids[self.name] = self._apply_conditions(tmp, assigned)
-        logging.info(self.name + ': current bids ' + repr(self.bids))
-
-    def trigger(self, msg, src):
+            tmp = self._apply_conditions(tmp, assigned)
+            if tmp != self.bids.get(self.name):
+                self._update(self.name, self.versions.get(self.name, 0) + 1,
+                             tmp)
+        stitcher.trace(LOG, 'bids', entity=self.name,
+                       bids=self.bids.get(self.name))
+
+    def _update(self, item, version, bid):
         """
-        Triggers a bidding round on this entity.
+        Change the bids of an entity & remember the change for the
+        neighbours which do not know of it.
+        """
+        self.bids[item] = bid
+        self.versions[item] = version
+        for neighbour in nx.all_neighbors(self.container, self):
+            if version > self._peers.get(neighbour.name, {}).get(item, 0):
+                self._pending.setdefault(neighbour.name, {})[item] = None
 
-        :param msg: dict containing the message from other entity.
-        :param src: str indicating the src of where the message comes from.
+    def _receive(self, msg, src):
         """
-        logging.info('%s -> %s msg: %s', str(src), str(self.name), str(msg))
+        Process a message: learn the newer bids of others, calculate my bids &
+        update the assignments where mine are better. Only the bids in the
+        message are looked at.
 
-        # let's add those I didn't know of
-        mod = msg['bids'] == self.bids
-        for item in msg['bids']:
-            # each entity controls own bids!
-            self.bids[item] = msg['bids'][item]
+        :return: Tuple of the assignments & a flag indicating if the message
+            contained no bids newer than the ones I knew of already.
+        """
+        stitcher.trace(LOG, 'message', src=src, dst=self.name, msg=msg)
+        self.stats.count('messages')
+
+        # the first message makes me join in - so I inform my neighbours.
+        mod = bool(self._peers)
+        peer = self._peers.setdefault(src, {})
+        pending = self._pending.setdefault(src, {})
+        for item, version, bid in _entries(msg):
+            if version > peer.get(item, 0):
+                peer[item] = version
+            # each entity controls own bids - the newest version wins.
+            if version > self.versions.get(item, 0):
+                self._update(item, version, bid)
+                mod = False
+            if peer[item] >= self.versions[item]:
+                pending.pop(item, None)
 
         assigned = msg['assigned']
         self._calc_credits(assigned)
-        # assign and optimize were needed.
+        self._assign(assigned)
+        return assigned, mod
+
+    def _assign(self, assigned):
+        """
+        Assign and optimize were needed.
+        """
         if self.name in self.bids:
             for bid in self.bids[self.name]:
                 rq_n = bid  # request node
                 crd = self.bids[self.name][bid]  # bid 'credits'.
                 if rq_n not in assigned:
-                    logging.info('Assigning: ' + rq_n + ' -> ' + self.name)
+                    LOG.debug('Assigning: %s -> %s', rq_n, self.name)
                     assigned[rq_n] = (self.name, crd)
                 else:
                     if assigned[rq_n][1] < crd:
                         # my bid is better.
-                        logging.info('Updated assignment: ' + rq_n + ' -> ' +
-                                     self.name)
+                        LOG.debug('Updated assignment: %s -> %s', rq_n,
+                                  self.name)
                         assigned[rq_n] = (self.name, crd)
 
-        # communicate
-        # XXX: enable async.
+    def _news(self, name):
+        """
+        The entities whose bids a neighbour does not know of yet. So the cost
+        depends on the number of changes, not on the number of bids.
+        """
+        peer = self._peers.get(name, {})
+        return [item for item in self._pending.get(name, {})
+                if self.versions[item] > peer.get(item, 0)]
+
+    def _send_to(self, neighbour, src, mod):
+        """
+        Decide if a neighbour needs to be informed about my bids.
+        """
+        if neighbour.name != src and not mod:
+            # only update neighbour when there is an update to be send.
+            return True
+        # only call my caller back when he doesn't know my bids.
+        return bool(self._news(src))
+
+    def _message(self, neighbour, assigned):
+        """
+        Create the message for a neighbour - in delta mode only with the
+        bids it does not know of yet (with their versions).
+        """
+        news = self._news(neighbour.name)
+        peer = self._peers.setdefault(neighbour.name, {})
+        for item in news:
+            peer[item] = self.versions[item]
+        self._pending[neighbour.name] = {}
+        if self.delta:
+            return {'changed': dict((item, (self.versions[item],
+                                            self.bids[item]))
+                                    for item in news),
+                    'assigned': assigned}
+        # a copy - the neighbour needs to know what I told it, not what I
+        # know by the time it processes the message.
+        peer.update(self.versions)
+        return {'bids': dict(self.bids), 'versions': dict(self.versions),
+                'assigned': assigned}
+
+    def _spend(self):
+        """
+        Count a message against the budget of the bidding round.
+
+        :return: False if the budget is used up.
+        """
+        sent = self.container.graph.get(MESSAGES, 0)
+        if self.max_messages is not None and sent >= self.max_messages:
+            if sent == self.max_messages:
+                LOG.warning('Stopped bidding after %s messages - the '
+                            'assignments are incomplete.', sent)
+                self.container.graph[MESSAGES] = sent + 1
+            return False
+        self.container.graph[MESSAGES] = sent + 1
+        return True
+
+    def _steps(self, msg, src):
+        """
+        Process a message & yield the neighbours which need to be informed
+        about my bids - with the message for each. Whether the next
+        neighbour needs to be informed depends on what happened while the
+        previous one was informed; so the caller has to deliver the message
+        before asking for the next one.
+
+        :param msg: dict containing the message from other entity.
+        :param src: str indicating the src of where the message comes from.
+        """
+        assigned, mod = self._receive(msg, src)
         for neighbour in nx.all_neighbors(self.container, self):
-            if neighbour.name != src and not mod:
-                # only update neighbour when there is an update to be send.
-                neighbour.trigger(src=self.name,
-                                  msg={'bids': self.bids,
-                                       'assigned': assigned})
-            elif msg is not None and msg['bids'] != self.bids:
-                # only call my caller back when he didn't knew me.
-                neighbour.trigger(src=self.name,
-                                  msg={'bids': self.bids,
-                                       'assigned': assigned})
-        return assigned, self.bids
+            if self._send_to(neighbour, src, mod):
+                if not self._spend():
+                    return
+                yield neighbour, self._message(neighbour, assigned)
+
+    def trigger(self, msg, src):
+        """
+        Triggers a bidding round on this entity - the neighbours are
+        triggered recursively.
+
+        :param msg: dict containing the message from other entity.
+        :param src: str indicating the src of where the message comes from.
+        """
+        for neighbour, tmp in self._steps(msg, src):
+            neighbour.trigger(src=self.name, msg=tmp)
+        return msg['assigned'], self.bids
+
+    def run(self, msg, src):
+        """
+        Triggers a bidding round on this entity - the messages are processed
+        iteratively using a stack instead of recursively. The outcome of the
+        bidding depends on the order of the messages, so they are processed
+        in the same order as in trigger(); but the size of the container is
+        not limited by the depth of the call stack.
+
+        :param msg: dict containing the message from other entity.
+        :param src: str indicating the src of where the message comes from.
+        """
+        stack = [(self, self._steps(msg, src))]
+        while stack:
+            entity, steps = stack[-1]
+            try:
+                neighbour, tmp = next(steps)
+            except StopIteration:
+                stack.pop()
+                continue
+            stack.append((neighbour, neighbour._steps(tmp, entity.name)))
+            self.stats.peak('queue', len(stack))
+        return msg['assigned'], self.bids
+
+    async def run_async(self, msg, src):
+        """
+        Triggers a bidding round on this entity - all entities of the
+        container run as concurrent tasks, each with a mailbox for the
+        messages from its neighbours. Messages are send without waiting for
+        the receiver; a message which is still pending in the mailbox is
+        replaced by a newer one from the same sender (with the newer bids).
+        The round is over when no messages are pending and all entities are
+        idle. As the messages are processed in another order, the results can
+        differ from the ones of trigger().
+
+        :param msg: dict containing the message from other entity.
+        :param src: str indicating the src of where the message comes from.
+        """
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+        # per entity the senders in order of arrival & their messages.
+        inboxes = dict((entity, asyncio.Queue()) for entity in self.container)
+        mails = dict((entity, {}) for entity in self.container)
+        pending = [0]
+
+        def send(entity, msg, src):
+            if src in mails[entity]:
+                mails[entity][src] = _coalesce(mails[entity][src], msg)
+                return
+            mails[entity][src] = msg
+            inboxes[entity].put_nowait(src)
+            pending[0] += 1
+            self.stats.peak('queue', pending[0])
+
+        async def agent(entity):
+            while True:
+                src = await inboxes[entity].get()
+                msg = mails[entity].pop(src)
+                try:
+                    for neighbour, tmp in entity._steps(msg, src):
+                        send(neighbour, tmp, entity.name)
+                except Exception as err:
+                    if not done.done():
+                        done.set_exception(err)
+                    return
+                pending[0] -= 1
+                if not pending[0] and not done.done():
+                    # quiescence - nothing left to do for anyone.
+                    done.set_result(None)
+                # let the others process their messages.
+                await asyncio.sleep(0)
+
+        tasks = [asyncio.ensure_future(agent(entity)) for entity in inboxes]
+        send(self, msg, src)
+        try:
+            await done
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return msg['assigned'], self.bids
 
     def __repr__(self):
         return self.name
@@ -300,27 +712,139 @@ class BiddingStitcher(stitcher.Stitcher):
     from the request graph.
     """
 
-    def stitch(self, container, request, conditions=None, start=None):
-        condy = conditions or {}
-        opt_graph = nx.DiGraph()
+    def __init__(self, rels, view=False, mode='recursive', delta=False,
+                 max_messages='auto'):
+        """
+        Initiate the stitcher.
+
+        :param rels: A dictionary defining what type of nodes in the request
+            must be stitched to what type of nodes in the container.
+        :param view: If True the resulting graphs are read-only views which
+            reference the container & request instead of copies of them.
+        :param mode: How the entities pass on messages - 'recursive' (each
+            entity directly triggers its neighbours), 'queue' (messages are
+            processed iteratively in the same order; for large containers)
+            or 'async' (each entity is an asyncio task with a mailbox).
+        :param delta: If True the entities only send the bids which changed
+            since they last informed a neighbour - instead of all bids.
+        :param max_messages: Maximum number of messages send in a bidding
+            round - the bidding stops & no stitch is returned when reached.
+            'auto' for MESSAGES_PER_PAIR times the squared number of
+            container nodes; None for no limit.
+        """
+        super(BiddingStitcher, self).__init__(rels, view=view)
+        if mode not in MODES:
+            raise ValueError('Unknown mode: %s' % mode)
+        self.mode = mode
+        self.delta = delta
+        self.max_messages = max_messages
+
+    def stitch(self, container, request, conditions=None, start=None,
+               index=None, stats=None):
+        """
+        Stitch a request graph into an existing graph container. Returns a
+        list with the outcome of the bidding - empty if the bidding was
+        stopped after max_messages messages. In recursive mode the bidding
+        is repeated using a queue if the container is too deep. In async mode
+        the event loop is run by this method - so it cannot be called within
+        a running event loop; use stitch_async() there.
+
+        :param container: A graph describing the existing container with
+            ranks.
+        :param request: A graph describing the request.
+        :param conditions: Dictionary with conditions - e.g. node a & b need
+            to be related to node c.
+        :param start: Optional container node which starts the bidding.
+        :param index: Optional ContainerIndex of the container - build it
+            once & reuse it when stitching many requests into one container.
+        :param stats: Optional profiling.Stats recording the time spend per
+            phase & the number of messages processed.
+        :return: List of resulting graphs(s).
+        """
+        stats = profiling.get(stats)
+        with stats.timer('entities'):
+            start_node = self._entities(container, request, conditions, start,
+                                        index, stats=stats)
+
+        # kick off
+        with stats.timer('bidding'):
+            try:
+                res = _kick_off(start_node, 'init')
+            except RecursionError:
+                # same outcome when the messages are processed using a stack.
+                LOG.warning('Container too deep to trigger the entities '
+                            'recursively - using a queue.')
+                start_node = self._entities(container, request, conditions,
+                                            start, index, mode='queue',
+                                            stats=stats)
+                res = _kick_off(start_node, 'init')
+        if res is None:
+            return []
+        assign = res[0]
+        stitches = [(item, assign[item][0]) for item in assign]
+        return [self._result(container, request, stitches)]
+
+    async def stitch_async(self, container, request, conditions=None,
+                           start=None, index=None, stats=None):
+        """
+        Same as stitch() - but to be awaited within a running event loop. The
+        entities run as concurrent tasks (see Entity.run_async) whatever the
+        mode of this stitcher is.
+
+        :param container: A graph describing the existing container with
+            ranks.
+        :param request: A graph describing the request.
+        :param conditions: Dictionary with conditions - e.g. node a & b need
+            to be related to node c.
+        :param start: Optional container node which starts the bidding.
+        :param index: Optional ContainerIndex of the container.
+        :param stats: Optional profiling.Stats.
+        :return: List of resulting graphs(s).
+        """
+        stats = profiling.get(stats)
+        with stats.timer('entities'):
+            start_node = self._entities(container, request, conditions, start,
+                                        index, mode='async', stats=stats)
+        with stats.timer('bidding'):
+            assign, _ = await start_node.run_async(
+                {'bids': [], 'assigned': {}}, 'init')
+        if _stopped(start_node):
+            return []
+        stitches = [(item, assign[item][0]) for item in assign]
+        return [self._result(container, request, stitches)]
+
+    def _entities(self, container, request, conditions, start, index,
+                  mode=None, stats=None):
+        """
+        Create an entity per container node - returns the one which starts
+        the bidding.
+        """
+        condy = compiler.compile_conditions(conditions)
+        if index is None:
+            index = indexing.ContainerIndex(container)
+        # which container nodes can bid on which request nodes.
+        targets = {}
+        for node, attr in request.nodes(data=True):
+            for trg in index.nodes(self.rels[attr[stitcher.TYPE_ATTR]]):
+                targets.setdefault(trg, []).append(node)
+
+        max_messages = self.max_messages
+        if max_messages == 'auto':
+            max_messages = MESSAGES_PER_PAIR * len(container) ** 2
+
+        opt_graph = nx.DiGraph(**{ENTITIES: {}})
         tmp = {}
         for node, attr in container.nodes(data=True):
             tmp[node] = Entity(str(node), self.rels, request, opt_graph,
-                               conditions=condy)
+                               conditions=condy,
+                               targets=targets.get(node, []),
+                               mode=mode or self.mode, delta=self.delta,
+                               stats=stats, max_messages=max_messages)
             opt_graph.add_node(tmp[node], **attr)
+            opt_graph.graph[ENTITIES][tmp[node].name] = tmp[node]
         for src, trg, attr in container.edges(data=True):
             opt_graph.add_edge(tmp[src], tmp[trg], **attr)
 
-        start_node = list(tmp.values())[0]
         if start is not None:
-            start_node = tmp[start]
-
-        # kick off
-        assign, _ = start_node.trigger({'bids': [], 'assigned': {}}, 'init')
-        tmp_graph = nx.union(container, request)
-        for item in assign:
-            src = item
-            trg = assign[item][0]
-            tmp_graph.add_edge(src, trg)
-
-        return [tmp_graph]
+            return tmp[start]
+        return list(tmp.values())[0]
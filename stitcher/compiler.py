@@ -0,0 +1,222 @@
+"""
+Compiles the conditions into plans of prebound checks used by the stitchers.
+"""
+
+import re
+
+# outcome of a check on the attributes of a target node.
+OK = 0
+MISSING = 1
+MISMATCH = 2
+
+ATTRIBUTE_CONDITIONS = ['eq', 'neq', 'lg', 'lt', 'gt', 'regex']
+COMPOSITION_CONDITIONS = ['same', 'diff', 'share', 'nshare']
+
+
+def attribute_test(cond, attrn, attrv):
+    """
+    Create a function which checks the attributes of a target node against an
+    attribute condition. The function returns OK, MISSING (attribute not
+    present) or MISMATCH (value does not satisfy the condition).
+
+    Following conditions are available: eq - equal, neq - not equal (a
+    missing attribute is OK), lg - larger than, lt - less or equal than, gt -
+    larger or equal than and regex - matches the regular expression.
+
+    :param cond: Name of the condition.
+    :param attrn: Name of the attribute.
+    :param attrv: Value (or regular expression) to compare to.
+    :return: The function or None if the condition is not known.
+    """
+    if cond == 'eq':
+        def test(attrs):
+            if attrn not in attrs:
+                return MISSING
+            return MISMATCH if attrv != attrs[attrn] else OK
+    elif cond == 'neq':
+        def test(attrs):
+            if attrn in attrs and attrv == attrs[attrn]:
+                return MISMATCH
+            return OK
+    elif cond == 'lg':
+        def test(attrs):
+            if attrn not in attrs:
+                return MISSING
+            return MISMATCH if attrs[attrn] <= attrv else OK
+    elif cond == 'lt':
+        def test(attrs):
+            if attrn not in attrs:
+                return MISSING
+            return MISMATCH if attrv < attrs[attrn] else OK
+    elif cond == 'gt':
+        def test(attrs):
+            if attrn not in attrs:
+                return MISSING
+            return MISMATCH if attrs[attrn] < attrv else OK
+    elif cond == 'regex':
+        pattern = re.compile(attrv)
+
+        def test(attrs):
+            if attrn not in attrs:
+                return MISSING
+            return OK if pattern.search(attrs[attrn]) else MISMATCH
+    else:
+        return None
+    return test
+
+
+def share_test(cond, attrn, members):
+    """
+    Create a function which checks the attributes of the stitched targets
+    against a share or nshare condition. All targets need to have the
+    attribute; the targets of the members are compared to the first value
+    other than '' found (in the order of the stitches) - for share they need
+    to have the same value, for nshare another one. The function returns OK,
+    MISSING or MISMATCH.
+
+    :param cond: Name of the condition.
+    :param attrn: Name of the attribute.
+    :param members: The request nodes which need to (not) share the value.
+    :return: The function or None if the condition is not known. It takes a
+        list of (request node, attributes of the target) tuples.
+    """
+    if cond not in ['share', 'nshare']:
+        return None
+    share = cond == 'share'
+
+    def test(stitches):
+        attrv = ''
+        res = OK
+        for src, attrs in stitches:
+            if attrn not in attrs:
+                return MISSING
+            if src not in members:
+                continue
+            if attrv == '':
+                attrv = attrs[attrn]
+            elif (attrs[attrn] == attrv) != share:
+                res = MISMATCH
+        return res
+    return test
+
+
+class AttributeCheck:
+    """
+    An attribute condition - the target of a request node needs to have a
+    certain attribute.
+    """
+
+    def __init__(self, condition):
+        self.condition = condition
+        self.operator = condition[0]
+        self.node = condition[1][0]
+        self.attrn = condition[1][1][0]
+        self.attrv = condition[1][1][1]
+        self.nodes = (self.node,)
+        self.members = frozenset(self.nodes)
+        self.test = attribute_test(self.operator, self.attrn, self.attrv)
+
+
+class CompositionCheck:
+    """
+    A composition condition - the targets of a set of request nodes need to
+    be the same/different or (not) share an attribute value.
+    """
+
+    def __init__(self, condition):
+        self.condition = condition
+        self.operator = condition[0]
+        if self.operator in ['same', 'diff']:
+            self.attrn = None
+            self.nodes = tuple(condition[1])
+        else:
+            self.attrn = condition[1][0]
+            self.nodes = tuple(condition[1][1])
+        self.members = frozenset(self.nodes)
+        self.test = share_test(self.operator, self.attrn, self.members)
+
+
+class Plan:
+    """
+    The compiled conditions. Conditions which are not known are dropped.
+    """
+
+    def __init__(self, conditions):
+        """
+        Compile the conditions.
+
+        :param conditions: dictionary containing the conditions.
+        """
+        self.conditions = conditions
+        self.attributes = [AttributeCheck(item)
+                           for item in conditions.get('attributes', [])
+                           if item[0] in ATTRIBUTE_CONDITIONS]
+        self.compositions = [CompositionCheck(item)
+                             for item in conditions.get('compositions', [])
+                             if item[0] in COMPOSITION_CONDITIONS]
+        self.by_node = {}
+        for check in self.attributes + self.compositions:
+            for node in check.members:
+                self.by_node.setdefault(node, []).append(check)
+        # all stitched targets need the attribute to (not) share - so these
+        # depend on the targets of all request nodes.
+        self.shares = [check for check in self.compositions
+                       if check.test is not None]
+        self._bound = {}
+
+    def bind(self, evaluators):
+        """
+        Pair the checks with the functions a stitcher uses to evaluate them.
+        Checks without a function are dropped. The result is cached per
+        dictionary of functions - so pass in a module level dictionary.
+
+        :param evaluators: dictionary of condition name -> function.
+        :return: List of (check, function) tuples.
+        """
+        key = id(evaluators)
+        if key not in self._bound:
+            self._bound[key] = [(check, evaluators[check.operator])
+                                for check in self.attributes +
+                                self.compositions
+                                if check.operator in evaluators]
+        return self._bound[key]
+
+    def without(self, condition):
+        """
+        Return a new plan without the given composition condition.
+        """
+        tmp = dict(self.conditions)
+        tmp['compositions'] = [item for item in
+                               self.conditions.get('compositions', [])
+                               if item != condition]
+        return Plan(tmp)
+
+
+def evaluators(attribute, same, diff, share, nshare):
+    """
+    Create the dictionary of condition name -> function a stitcher uses to
+    evaluate the conditions (see Plan.bind).
+
+    :param attribute: Function for all attribute conditions.
+    :param same: Function for the same condition.
+    :param diff: Function for the diff condition.
+    :param share: Function for the share condition.
+    :param nshare: Function for the nshare condition.
+    :return: The dictionary.
+    """
+    res = dict((cond, attribute) for cond in ATTRIBUTE_CONDITIONS)
+    res.update({'same': same, 'diff': diff, 'share': share,
+                'nshare': nshare})
+    return res
+
+
+def compile_conditions(conditions):
+    """
+    Compile the conditions into a plan - plans are returned as they are.
+
+    :param conditions: dictionary containing the conditions (or None).
+    :return: The plan.
+    """
+    if isinstance(conditions, Plan):
+        return conditions
+    return Plan(conditions or {})
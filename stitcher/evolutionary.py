@@ -3,173 +3,71 @@ Implements stitching, and filtering functions based on evolutionary algorithm.
 """
 
 import logging
+import multiprocessing
 import random
-import re
-import networkx as nx
 
 import stitcher
 
-LOG = logging.getLogger()
+from stitcher import compiler
+from stitcher import indexing
+from stitcher import profiling
+from stitcher import validators
 
-
-def _eq_attr(node, attr, gens, container):
-    """
-    Calcs fitness based on the fact that node need target node to have an attr
-    with a certain value.
-    """
-    trg_nd = container.nodes[gens[node]]
-    if attr[0] not in trg_nd:
-        return 10.1
-    if attr[1] != trg_nd[attr[0]]:
-        return 10.2
-    return 0.0
-
-
-def _neq_attr(node, attr, gens, container):
-    """
-    Calcs fitness based on the fact that node's target shall not have an attr
-    with a certain value.
-    """
-    trg_nd = container.nodes[gens[node]]
-    if attr[0] in trg_nd and attr[1] == trg_nd[attr[0]]:
-        return 10.1
-    return 0.0
-
-
-def _lg_attr(node, attr, gens, container):
-    """
-    Calcs fitness based on the fact that node's target node shall have an attr
-    with a value larger than the given one.
-    """
-    trg_nd = container.nodes[gens[node]]
-    if attr[0] not in trg_nd:
-        return 10.1
-    if attr[1] >= trg_nd[attr[0]]:
-        return 10.2
-    return 0.0
+LOG = logging.getLogger(__name__)
 
 
-def _lt_attr(node, attr, gens, container):
+def _attr_fitness(check, gens, container):
     """
-    Calcs fitness based on the fact that node's target node shall have an attr
-    with a value smaller than the given one.
+    Calcs fitness based on the fact that node's target node needs to have an
+    attr satisfying the condition (e.g. with a certain value, or with a value
+    larger/smaller than the given one).
     """
-    trg_nd = container.nodes[gens[node]]
-    if attr[0] not in trg_nd:
+    status = check.test(container.nodes[gens[check.node]])
+    if status == compiler.OK:
+        return 0.0
+    if status == compiler.MISSING or check.operator == 'neq':
         return 10.1
-    if attr[1] < trg_nd[attr[0]]:
-        return 10.2
-    return 0.0
+    return 10.2
 
 
-def _regex_attr(node, attr, gens, container):
-    """
-    Calcs fitness based on the fact that node's target node shall have an attr
-    with a value smaller than the given one.
-    """
-    trg_nd = container.nodes[gens[node]]
-    if attr[0] not in trg_nd:
-        return 10.1
-    if not re.search(attr[1], trg_nd[attr[0]]):
-        return 10.2
-    return 0.0
-
-
-def _same_target(node1, node2, gens):
+def _same_target(check, gens, _):
     """
     Calcs fitness based on the fact that two nodes should share same target.
     """
-    shared_tg = None
-    for src in gens:
-        if shared_tg is None and src in [node1, node2]:
-            shared_tg = gens[src]
-        elif shared_tg is not None and gens[src] != shared_tg:
-            return 10.0
+    node1, node2 = check.nodes[:2]
+    if node1 in gens and node2 in gens and gens[node1] != gens[node2]:
+        return 10.0
     return 0.0
 
 
-def _diff_target(node1, node2, gens):
+def _diff_target(check, gens, _):
     """
     Calc fitness based on the fact that two nodes should not share same target.
     """
-    shared_tg = None
-    for src in gens:
-        if shared_tg is None and src in [node1, node2]:
-            shared_tg = gens[src]
-        elif shared_tg is not None and gens[src] == shared_tg:
-            return 10.0
+    node1, node2 = check.nodes[:2]
+    if node1 != node2 and node1 in gens and node2 in gens \
+            and gens[node1] == gens[node2]:
+        return 10.0
     return 0.0
 
 
-def _share_attr(attrn, node_list, gens, container):
+def _share_attr(check, gens, container):
     """
-    Calcs fitness based on the fact that two nodes from the request should be
-    stitched to two nodes in the container which share the same attribute
-    value.
+    Calcs fitness based on the fact that the nodes from the request should be
+    stitched to nodes in the container which (do not) share the same
+    attribute value - see compiler.share_test.
     """
-    attrv = None
-    for node in node_list:
-        trg = gens[node]
-        if attrn not in container.nodes[trg]:
-            return 10.1
-        if attrv is None:
-            attrv = container.nodes[trg][attrn]
-        elif attrv != container.nodes[trg][attrn]:
-            return 10.2
-    return 0.0
-
-
-def _nshare_attr(attrn, node_list, gens, container):
-    """
-    Calcs fitness based on the fact that two nodes from the request should be
-    stitched to two nodes in the container which do not share the same
-    attribute value.
-    """
-    attrv = None
-    for node in node_list:
-        trg = gens[node]
-        if attrn not in container.nodes[trg]:
-            return 10.1
-        if attrv is None:
-            attrv = container.nodes[trg][attrn]
-        elif attrv == container.nodes[trg][attrn]:
-            return 10.2
-    return 0.0
+    status = check.test([(src, container.nodes[trg])
+                         for src, trg in gens.items()])
+    if status == compiler.OK:
+        return 0.0
+    if status == compiler.MISSING:
+        return 10.1
+    return 10.2
 
 
-def _my_filter(conditions, gens, container):
-    """
-    Apply filters.
-    """
-    res = 0.0
-    if conditions is not None:
-        if 'attributes' in conditions:
-            for condition in conditions['attributes']:
-                para1 = condition[1][0]
-                para2 = condition[1][1]
-                if condition[0] == 'eq':
-                    res += _eq_attr(para1, para2, gens, container)
-                elif condition[0] == 'neq':
-                    res += _neq_attr(para1, para2, gens, container)
-                elif condition[0] == 'lg':
-                    res += _lg_attr(para1, para2, gens, container)
-                elif condition[0] == 'lt':
-                    res += _lt_attr(para1, para2, gens, container)
-                elif condition[0] == 'regex':
-                    res += _regex_attr(para1, para2, gens, container)
-        if 'compositions' in conditions:
-            for condition in conditions['compositions']:
-                para1 = condition[1][0]
-                para2 = condition[1][1]
-                if condition[0] == 'same':
-                    res += _same_target(para1, para2, gens)
-                elif condition[0] == 'diff':
-                    res += _diff_target(para1, para2, gens)
-                elif condition[0] == 'share':
-                    res += _share_attr(para1, para2, gens, container)
-                elif condition[0] == 'nshare':
-                    res += _nshare_attr(para1, para2, gens, container)
-    return res
+_FITNESS = compiler.evaluators(_attr_fitness, _same_target, _diff_target,
+                               _share_attr, _share_attr)
 
 
 class Candidate:
@@ -212,35 +110,108 @@ class GraphCandidate(Candidate):
     """
     Candidate within a population. The DNA of this candidate is defined by a
     dictionary of source to target stitches.
+
+    The fitness is cached - and updated for the conditions touching a gene
+    when mutate() changes it. Do not alter the genes directly.
+
+    Stitching more request nodes to a container node than its capacity (see
+    validators.capacity) allows is penalized as well.
+
+    The number of (full & incremental) fitness evaluations is counted in the
+    optional profiling.Stats.
     """
 
     def __init__(self, gen, stitch, conditions, mutation_list, request,
-                 container):
+                 container, index=None, capacity=None, stats=None):
         super(GraphCandidate, self).__init__(gen)
         self.stitch = stitch
-        self.conditions = conditions
+        self.conditions = compiler.compile_conditions(conditions)
         self.mutation_list = mutation_list
         self.request = request
         self.container = container
+        self.index = index
+        self.capacity = capacity or {}
+        self.stats = profiling.get(stats)
+        self._fitness = None
+        # fitness values per gene (stitch) and per condition (check).
+        self._stitch_fit = {}
+        self._condition_fit = {}
+        # stitches per target & the penalty for exceeding the capacity.
+        self._loads = {}
+        self._limit_fit = 0.0
+
+    def _gene_fitness(self, src):
+        """
+        Fitness of a single stitch - the target needs to have the right type.
+        """
+        trg = self.gen[src]
+        if self.container.nodes[trg][stitcher.TYPE_ATTR] != \
+                self.stitch[self.request.nodes[src][stitcher.TYPE_ATTR]]:
+            return 100
+        return 0
 
-    def fitness(self):
-        fit = 0.0
-
-        # 1. stitch
-        for src in self.gen:
-            trg = self.gen[src]
-            if self.container.nodes[trg][stitcher.TYPE_ATTR] != \
-                    self.stitch[self.request.nodes[src][stitcher.TYPE_ATTR]]:
-                fit += 100
-
-        # 2. conditions
-        fit += _my_filter(self.conditions, self.gen, self.container)
+    def _overload(self, trg):
+        """
+        Number of stitches to a target exceeding its capacity.
+        """
+        if trg not in self.capacity:
+            return 0
+        return max(0, self._loads.get(trg, 0) - self.capacity[trg])
 
-        return fit
+    def fitness(self):
+        if self._fitness is None:
+            self.stats.count('fitness')
+            # 1. stitch
+            self._stitch_fit = dict((src, self._gene_fitness(src))
+                                    for src in self.gen)
+            # 2. conditions
+            self._condition_fit = dict(
+                (check, func(check, self.gen, self.container))
+                for check, func in self.conditions.bind(_FITNESS))
+            # 3. validators
+            self._loads = {}
+            for trg in self.gen.values():
+                self._loads[trg] = self._loads.get(trg, 0) + 1
+            self._limit_fit = 10.0 * sum(self._overload(trg)
+                                         for trg in self._loads)
+            self._fitness = sum(self._stitch_fit.values()) + \
+                sum(self._condition_fit.values()) + self._limit_fit
+        return self._fitness
+
+    def _set_gene(self, src, trg):
+        """
+        Change a gene - only the conditions touching it are re-evaluated.
+        """
+        old = self.gen.get(src)
+        self.gen[src] = trg
+        if self._fitness is None:
+            return
+        self.stats.count('fitness_updates')
+        self._stitch_fit[src] = self._gene_fitness(src)
+        for check in self.conditions.by_node.get(src, []) + [
+                item for item in self.conditions.shares
+                if src not in item.members]:
+            if check in self._condition_fit:
+                self._condition_fit[check] = _FITNESS[check.operator](
+                    check, self.gen, self.container)
+        if old != trg:
+            before = self._overload(old) + self._overload(trg)
+            self._loads[old] -= 1
+            self._loads[trg] = self._loads.get(trg, 0) + 1
+            self._limit_fit += 10.0 * (self._overload(old) +
+                                       self._overload(trg) - before)
+        self._fitness = sum(self._stitch_fit.values()) + \
+            sum(self._condition_fit.values()) + self._limit_fit
 
     def mutate(self):
         # let's mutate to an option outside of the shortlisted candidate list.
         src = random.choice(list(self.gen.keys()))
+        if self.index is not None:
+            nd_trg = self.index.random_node(
+                self.stitch[self.request.nodes[src][stitcher.TYPE_ATTR]])
+            if nd_trg is not None:
+                self._set_gene(src, nd_trg)
+            return
 
         done = False
         cutoff = len(self.gen)
@@ -252,7 +223,7 @@ class GraphCandidate(Candidate):
             if self.container.nodes[nd_trg][stitcher.TYPE_ATTR] == \
                     self.stitch[self.request.nodes[src][stitcher.TYPE_ATTR]]:
                 done = True
-                self.gen[src] = nd_trg
+                self._set_gene(src, nd_trg)
             i += 1
 
     def crossover(self, partner):
@@ -277,7 +248,9 @@ class GraphCandidate(Candidate):
                 tmp[src] = self.gen[src]
 
         return self.__class__(tmp, self.stitch, self.conditions,
-                              self.mutation_list, self.request, self.container)
+                              self.mutation_list, self.request, self.container,
+                              index=self.index, capacity=self.capacity,
+                              stats=self.stats)
 
     def __repr__(self):
         return 'f: ' + str(self.fitness()) + ' - ' + repr(self.gen)
@@ -338,10 +311,11 @@ class BasicEvolution:
             i = random.randint(len_new_pop, len_pop - 1)
             new_population[i].mutate()
 
-        LOG.debug('New population length: %s', str(len(new_population)))
+        LOG.debug('New population length: %s', len(new_population))
         return new_population
 
-    def run(self, population, max_runs, fitness_goal=0.0, stabilizer=False):
+    def run(self, population, max_runs, fitness_goal=0.0, stabilizer=False,
+            stats=None):
         """
         Play the game of life.
 
@@ -351,20 +325,28 @@ class BasicEvolution:
         :param stabilizer: If True iteration will break off after population
             stabilizes - comes with a slight performance penalty. Note: only
             useful when the population has a stable length (growth=1.0) :-).
+        :param stats: Optional profiling.Stats recording the number of
+            generations & the size of the population.
         :return: Number of iterations used and the final population.
         """
+        stats = profiling.get(stats)
         # evolve till max iter, 0.0 (goal) or all death
         iteration = 0
         fitness_sum = 0.0
         population.sort(key=lambda candidate: candidate.fitness())
         while iteration <= max_runs:
-            LOG.debug('Iteration: %s', str(iteration))
+            LOG.debug('Iteration: %s', iteration)
 
             population = self._darwin(population)
             population.sort(key=lambda candidate: candidate.fitness())
+            stats.count('generations')
+            stats.peak('population', len(population))
+            stitcher.trace(LOG, 'generation', iteration=iteration,
+                           size=len(population),
+                           best=population[0].fitness())
 
             if population[0].fitness() == fitness_goal:
-                LOG.info('Found solution in iteration: %s', str(iteration))
+                LOG.info('Found solution in iteration: %s', iteration)
                 break
 
             if stabilizer:
@@ -373,7 +355,7 @@ class BasicEvolution:
                 if new_fitness_sum == fitness_sum:
                     # in the last solution all died...
                     LOG.info('Population stabilized after iteration: %s',
-                             str(iteration - 1))
+                             iteration - 1)
                     break
                 fitness_sum = new_fitness_sum
 
@@ -382,17 +364,57 @@ class BasicEvolution:
         # show results
         if iteration >= max_runs:
             LOG.warning('Maximum number of iterations reached')
-        LOG.info('Final population: %s', repr(population))
+        # the population is only formatted if debugging is enabled.
+        LOG.debug('Final population: %s', population)
         return iteration, population
 
 
+def _island(conn, sticher, container, request, conditions, seed):
+    """
+    Evolve one population (island) - runs in a process of its own. After each
+    epoch the genes of the best candidates are send through the connection;
+    the reply contains the genes of the immigrants or None to stop - the
+    island then sends the genes of its final population.
+    """
+    random.seed(seed)
+    index = indexing.ContainerIndex(container)
+    conditions = compiler.compile_conditions(conditions)
+    capacity = validators.capacity(container, request, sticher.limits)
+    evo = sticher.evolution()
+    population = sticher.population(container, request, conditions, index,
+                                    capacity)
+    population.sort(key=lambda candidate: candidate.fitness())
+    while True:
+        for _ in range(sticher.migration):
+            population = evo._darwin(population)
+            population.sort(key=lambda candidate: candidate.fitness())
+            if population[0].fitness() == sticher.fit_goal:
+                break
+        conn.send((population[0].fitness(),
+                   [candidate.gen for candidate in
+                    population[:sticher.migrants]]))
+        immigrants = conn.recv()
+        if immigrants is None:
+            break
+        # immigrants replace the weakest candidates.
+        for i, gen in enumerate(immigrants):
+            population[-1 - i] = GraphCandidate(dict(gen), sticher.rels,
+                                                conditions, [], request,
+                                                container, index=index,
+                                                capacity=capacity)
+        population.sort(key=lambda candidate: candidate.fitness())
+    conn.send([candidate.gen for candidate in population])
+    conn.close()
+
+
 class EvolutionarySticher(stitcher.Stitcher):
     """
     Stitcher which uses an evolutionary algorithm.
     """
 
     def __init__(self, rels, max_iter=10, fit_goal=-1.0, cutoff=0.9,
-                 mutate=0.0, candidates=10):
+                 mutate=0.0, candidates=10, view=False, islands=None,
+                 migration=5, migrants=1, limits=None):
         """
         Initializes this stitcher.
 
@@ -404,42 +426,152 @@ class EvolutionarySticher(stitcher.Stitcher):
         :param mutate: Percentage of population that mutates (default None).
         :param candidates: Number of candidates to randomly generate
             (default 10).
+        :param view: If True the resulting graphs are read-only views which
+            reference the container & request instead of copies of them.
+        :param islands: Number of populations which evolve in parallel - each
+            in a process of its own (default None: one population evolving
+            in this process).
+        :param migration: Number of iterations between the migrations of the
+            best candidates from one island to the next (default 5).
+        :param migrants: Number of candidates which migrate (default 1).
+        :param limits: List of (validator, param) tuples - e.g.
+            [('incoming_edges', {'b': 5})]. Candidates the validators would
+            determine as bad stitches get a fitness penalty.
         """
-        super(EvolutionarySticher, self).__init__(rels)
+        super(EvolutionarySticher, self).__init__(rels, view=view)
         self.max_iter = max_iter
         self.fit_goal = fit_goal
         self.cutoff = cutoff
         self.mutate = mutate
         self.candidates = candidates
+        self.islands = islands
+        self.migration = migration
+        self.migrants = migrants
+        self.limits = limits
 
-    def stitch(self, container, request, conditions=None):
-        evo = BasicEvolution(percent_cutoff=self.cutoff,
-                             percent_mutate=self.mutate)
-        conditions = {} or conditions
+    def evolution(self):
+        """
+        Return the evolutionary algorithm to use.
+        """
+        return BasicEvolution(percent_cutoff=self.cutoff,
+                              percent_mutate=self.mutate)
 
-        # initial population
+    def population(self, container, request, conditions, index,
+                   capacity=None, stats=None):
+        """
+        Create an initial population - of targets with the right type if
+        possible.
+        """
         population = []
         for _ in range(self.candidates):
             tmp = {}
-            for item in request.nodes():
-                trg_cand = random.choice(list(container.nodes().keys()))
+            for item, attr in request.nodes(data=True):
+                trg_cand = index.random_node(
+                    self.rels.get(attr[stitcher.TYPE_ATTR]))
+                if trg_cand is None:
+                    trg_cand = index.random_node()
                 tmp[item] = trg_cand
             population.append(GraphCandidate(tmp, self.rels, conditions, [],
-                                             request, container))
+                                             request, container, index=index,
+                                             capacity=capacity, stats=stats))
+        return population
 
-        _, population = evo.run(population,
-                                self.max_iter,
-                                fitness_goal=self.fit_goal)
+    def _islands(self, container, request, conditions, index,
+                 capacity=None):
+        """
+        Evolve multiple populations in parallel. The islands are arranged in
+        a ring: the best candidates of an island migrate to the next one. All
+        islands stop as soon as one reaches the fitness goal.
+        """
+        # as many iterations as BasicEvolution.run would do.
+        epochs = -(-(self.max_iter + 1) // self.migration)
+        conns = []
+        procs = []
+        try:
+            for _ in range(self.islands):
+                conn, child = multiprocessing.Pipe()
+                proc = multiprocessing.Process(
+                    target=_island,
+                    args=(child, self, container, request,
+                          conditions.conditions, random.getrandbits(32)))
+                proc.start()
+                child.close()
+                conns.append(conn)
+                procs.append(proc)
+
+            for epoch in range(epochs):
+                reports = [conn.recv() for conn in conns]
+                done = epoch == epochs - 1 or \
+                    any(item[0] == self.fit_goal for item in reports)
+                for i, conn in enumerate(conns):
+                    conn.send(None if done else reports[i - 1][1])
+                if done:
+                    break
+
+            population = []
+            for conn in conns:
+                for gen in conn.recv():
+                    population.append(GraphCandidate(gen, self.rels,
+                                                     conditions, [], request,
+                                                     container, index=index,
+                                                     capacity=capacity))
+        except BaseException:
+            for proc in procs:
+                proc.terminate()
+            raise
+        finally:
+            for proc in procs:
+                proc.join()
+        population.sort(key=lambda candidate: candidate.fitness())
+        return population
+
+    def stitch(self, container, request, conditions=None, index=None,
+               stats=None):
+        """
+        Stitch a request graph into an existing graph container. Returns the
+        candidates of the final population which satisfy all conditions.
+
+        :param container: A graph describing the existing container with
+            ranks.
+        :param request: A graph describing the request.
+        :param conditions: Dictionary with conditions - e.g. node a & b need
+            to be related to node c.
+        :param index: Optional ContainerIndex of the container - build it
+            once & reuse it when stitching many requests into one container.
+        :param stats: Optional profiling.Stats recording the time spend per
+            phase & the number of generations and fitness evaluations - the
+            islands are only timed as a whole.
+        :return: List of resulting graphs(s).
+        """
+        stats = profiling.get(stats)
+        with stats.timer('initial'):
+            conditions = compiler.compile_conditions(conditions)
+            if index is None:
+                index = indexing.ContainerIndex(container)
+            capacity = validators.capacity(container, request, self.limits)
+            if capacity is None:
+                LOG.warning('No stitch can pass the validators')
+                return []
+            if not self.islands:
+                population = self.population(container, request, conditions,
+                                             index, capacity, stats)
+
+        with stats.timer('evolution'):
+            if self.islands:
+                population = self._islands(container, request, conditions,
+                                           index, capacity)
+            else:
+                _, population = self.evolution().run(
+                    population, self.max_iter, fitness_goal=self.fit_goal,
+                    stats=stats)
 
         if population[0].fitness() != 0.0:
-            logging.warning('Please rerun - did not find a viable solution')
+            LOG.warning('Please rerun - did not find a viable solution')
             return []
 
         graphs = []
         for candidate in population:
             if candidate.fitness() == 0.0:
-                tmp_graph = nx.union(container, request)
-                for item in candidate.gen:
-                    tmp_graph.add_edge(item, candidate.gen[item])
-                graphs.append(tmp_graph)
+                graphs.append(self._result(container, request,
+                                           candidate.gen.items()))
         return graphs
@@ -0,0 +1,454 @@
+"""
+Implements stitching as a 0/1 assignment problem solved to optimality.
+
+Every possible stitch (request node, container node) is a binary variable.
+The conditions become linear constraints on the variables, the cost of the
+stitches the objective. The problem is solved by an embedded branch & bound
+solver - or by PuLP (using CBC) if installed and asked for.
+"""
+
+import logging
+
+import stitcher
+
+from stitcher import compiler
+from stitcher import indexing
+from stitcher import profiling
+from stitcher import stitch
+from stitcher import validators
+
+LOG = logging.getLogger(__name__)
+
+EPSILON = 1e-9
+
+
+class Model:
+    """
+    A 0/1 integer linear program: minimize the objective subject to rows of
+    the form sum(coefficient * variable) <= bound.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+        self.costs = []
+        self.rows = []
+        # groups of variables of which exactly one needs to be 1.
+        self.groups = []
+
+    def add_variable(self, name, cost):
+        """
+        Add a binary variable.
+
+        :param name: Name of the variable.
+        :param cost: Coefficient in the objective.
+        :return: Id of the variable.
+        """
+        self.ids[name] = len(self.names)
+        self.names.append(name)
+        self.costs.append(cost)
+        return self.ids[name]
+
+    def add_constraint(self, coefficients, sense, bound):
+        """
+        Add a linear constraint.
+
+        :param coefficients: List of (variable id, coefficient) tuples.
+        :param sense: '<=', '>=' or '=='.
+        :param bound: Right hand side.
+        """
+        if sense in ['<=', '==']:
+            self.rows.append((coefficients, bound))
+        if sense in ['>=', '==']:
+            self.rows.append(([(var, -coef) for var, coef in coefficients],
+                              -bound))
+
+    def add_group(self, variables):
+        """
+        Add a constraint that exactly one of the variables is 1.
+        """
+        self.groups.append(list(variables))
+        self.add_constraint([(var, 1) for var in variables], '==', 1)
+
+
+def formulate(container, request, rels, conditions=None, cost=None,
+              index=None, capacity=None):
+    """
+    Encode the stitching problem as a 0/1 assignment problem. Request nodes
+    are stitched to a container node of the type given by rels; attribute
+    conditions fix variables to 0; same, diff, share & nshare become linear
+    constraints - with the same meaning as in stitch.my_filter.
+
+    :param container: A graph describing the existing container.
+    :param request: A graph describing the request.
+    :param rels: A dictionary defining what type of nodes in the request must
+        be stitched to what type of nodes in the container.
+    :param conditions: dictionary containing the conditions (or a compiled
+        plan of the same).
+    :param cost: Function returning the cost of a stitch given the container,
+        the request node & the target node (default: rank of the target).
+    :param index: Optional ContainerIndex of the container.
+    :param capacity: Optional dictionary of container node -> # of stitches
+        it can take (see validators.capacity).
+    :return: The model & the request nodes to stitch - variables are named
+        by (request node, container node) tuples.
+    """
+    cost = cost or stitch.rank_cost
+    index = index or indexing.ContainerIndex(container)
+    plan = compiler.compile_conditions(conditions)
+    keys = []
+    domains = []
+    for node, attrs in request.nodes(data=True):
+        if attrs[stitcher.TYPE_ATTR] in rels:
+            tmp = index.nodes(rels[attrs[stitcher.TYPE_ATTR]])
+            if tmp:
+                keys.append(node)
+                domains.append(list(tmp))
+    # variable fixing: only targets which pass the attribute conditions -
+    # and have the attributes to (not) share.
+    attrns = [check.attrn for check in plan.shares]
+    for i, key in enumerate(keys):
+        checks = [check for check in plan.attributes if check.node == key]
+        domains[i] = [trg for trg in domains[i]
+                      if all(check.test(container.nodes[trg]) == compiler.OK
+                             for check in checks) and
+                      all(attrn in container.nodes[trg] for attrn in attrns)]
+
+    model = Model()
+    for key, domain in zip(keys, domains):
+        model.add_group([model.add_variable((key, trg),
+                                            cost(container, key, trg))
+                         for trg in domain])
+    for check in plan.compositions:
+        _COMPOSITIONS[check.operator](model, container, keys, domains, check)
+    for trg, tmp in (capacity or {}).items():
+        coefficients = [(model.ids[key, trg], 1) for key in keys
+                        if (key, trg) in model.ids]
+        if coefficients:
+            model.add_constraint(coefficients, '<=', tmp)
+    return model, keys
+
+
+def _same(model, _, keys, domains, check):
+    """
+    Targets of the two request nodes need to be the same.
+    """
+    node1, node2 = check.nodes[:2]
+    if node1 == node2 or node1 not in keys or node2 not in keys:
+        return
+    ids = model.ids
+    for trg in dict.fromkeys(domains[keys.index(node1)] +
+                             domains[keys.index(node2)]):
+        model.add_constraint([(ids[item], coef) for item, coef in
+                              [((node1, trg), 1), ((node2, trg), -1)]
+                              if item in ids], '==', 0)
+
+
+def _diff(model, _, keys, __, check):
+    """
+    Targets of the two request nodes need to be different.
+    """
+    node1, node2 = check.nodes[:2]
+    if node1 == node2 or node1 not in keys or node2 not in keys:
+        return
+    for name, var in list(model.ids.items()):
+        if name[0] == node1 and (node2, name[1]) in model.ids:
+            model.add_constraint([(var, 1),
+                                  (model.ids[node2, name[1]], 1)], '<=', 1)
+
+
+def _values(model, container, keys, domains, check):
+    """
+    Group the variables of the members by the attribute value of the target.
+    Returns per member (in the order of the keys) a list of (value,
+    variables) tuples - values need not be hashable.
+    """
+    res = []
+    for key, domain in zip(keys, domains):
+        if key not in check.members:
+            continue
+        tmp = []
+        for trg in domain:
+            attrv = container.nodes[trg][check.attrn]
+            for value, variables in tmp:
+                if value == attrv:
+                    variables.append(model.ids[key, trg])
+                    break
+            else:
+                tmp.append((attrv, [model.ids[key, trg]]))
+        res.append(tmp)
+    return res
+
+
+def _share(model, container, keys, domains, check):
+    """
+    Once a member got a target with a value other than '' all later members
+    need targets with the same value.
+    """
+    members = _values(model, container, keys, domains, check)
+    for i, first in enumerate(members):
+        for attrv, variables in first:
+            if attrv == '':
+                continue
+            for later in members[i + 1:]:
+                model.add_constraint(
+                    [(var, 1) for var in variables] +
+                    [(var, 1) for value, tmp in later if value != attrv
+                     for var in tmp], '<=', 1)
+
+
+def _nshare(model, container, keys, domains, check):
+    """
+    The first member with a target value other than '' determines the value
+    - the targets of the later members need a different one.
+    """
+    members = _values(model, container, keys, domains, check)
+    for i, first in enumerate(members):
+        # the variables which have an empty value for the earlier members.
+        empty = [(var, 1) for earlier in members[:i]
+                 for value, tmp in earlier if value == '' for var in tmp]
+        for attrv, variables in first:
+            if attrv == '':
+                continue
+            for later in members[i + 1:]:
+                model.add_constraint(
+                    [(var, 1) for var in variables] +
+                    [(var, 1) for value, tmp in later if value == attrv
+                     for var in tmp] + empty, '<=', 1 + i)
+
+
+_COMPOSITIONS = {'same': _same,
+                 'diff': _diff,
+                 'share': _share,
+                 'nshare': _nshare}
+
+
+def solve(model, stats=profiling.DISABLED):
+    """
+    Solve the model using a depth first branch & bound search. Branches on
+    the group with the fewest free variables and tries the cheapest variable
+    first - variables not part of a group come last. The constraints are
+    propagated after every assignment.
+
+    :param model: The model.
+    :param stats: Optional profiling.Stats - counts the nodes searched.
+    :return: List of ids of the variables which are 1 in an optimal solution
+        or None if there is none.
+    """
+    values = [None] * len(model.names)
+    # per value of a variable: the rows & how it changes their smallest
+    # possible left hand side - rows which do not change are left out.
+    watches = [([], []) for _ in model.names]
+    minimum = []
+    largest = []
+    for i, (coefficients, _) in enumerate(model.rows):
+        for var, coef in coefficients:
+            if coef > 0:
+                watches[var][1].append((i, coef))
+            elif coef < 0:
+                watches[var][0].append((i, -coef))
+        minimum.append(sum(min(coef, 0) for _, coef in coefficients))
+        largest.append(max([abs(coef) for _, coef in coefficients] or [0]))
+    # rows waiting to be propagated - all of them to begin with.
+    pending = [True] * len(model.rows)
+    # the lower bound takes the cheapest variable of disjoint groups & all
+    # other variables only if they lower the cost.
+    bounded = []
+    grouped = set()
+    for group in model.groups:
+        if grouped.isdisjoint(group):
+            bounded.append(group)
+            grouped.update(group)
+    disjoint = len(bounded) == len(model.groups)
+    loose = [var for var in range(len(model.names)) if var not in grouped]
+    trail = []
+    best = [float('inf'), None]
+
+    def assign(var, value, queue):
+        if values[var] is not None:
+            return values[var] == value
+        values[var] = value
+        trail.append(var)
+        for i, delta in watches[var][value]:
+            minimum[i] += delta
+            if not pending[i]:
+                pending[i] = True
+                queue.append(i)
+        return True
+
+    def propagate(queue):
+        while queue:
+            i = queue.pop()
+            pending[i] = False
+            bound = model.rows[i][1] + EPSILON
+            if minimum[i] > bound:
+                return False
+            if minimum[i] + largest[i] <= bound:
+                # no variable is forced.
+                continue
+            for var, coef in model.rows[i][0]:
+                if values[var] is None and minimum[i] + abs(coef) > bound:
+                    if not assign(var, 0 if coef > 0 else 1, queue):
+                        return False
+        return True
+
+    def fix(var, value):
+        queue = []
+        res = assign(var, value, queue) and propagate(queue)
+        for i in queue:
+            pending[i] = False
+        return res
+
+    def undo(size):
+        while len(trail) > size:
+            var = trail.pop()
+            for i, delta in watches[var][values[var]]:
+                minimum[i] -= delta
+            values[var] = None
+
+    def search():
+        stats.count('nodes')
+        lower = sum(model.costs[var] for var in trail if values[var]) + \
+            sum(min(model.costs[var], 0) for var in loose
+                if values[var] is None)
+        for group in bounded:
+            if not any(values[var] for var in group):
+                lower += min(model.costs[var] for var in group
+                             if values[var] is None)
+        if lower >= best[0]:
+            return
+        branch = None
+        for group in model.groups:
+            if any(values[var] for var in group):
+                continue
+            free = [var for var in group if values[var] is None]
+            if branch is None or len(free) < len(branch):
+                branch = free
+        if branch is None:
+            var = next((var for var in range(len(model.names))
+                        if values[var] is None), None)
+            if var is None:
+                best[:] = [lower, [var for var in trail if values[var]]]
+                return
+            for value in [1, 0] if model.costs[var] < 0 else [0, 1]:
+                tmp = len(trail)
+                if fix(var, value):
+                    search()
+                undo(tmp)
+            return
+        size = len(trail)
+        branch.sort(key=lambda item: model.costs[item])
+        lower -= model.costs[branch[0]]
+        for var in branch:
+            if disjoint and lower + model.costs[var] >= best[0]:
+                # the remaining variables are not cheaper.
+                break
+            tmp = len(trail)
+            if fix(var, 1):
+                search()
+            undo(tmp)
+            if not fix(var, 0):
+                break
+        undo(size)
+
+    if propagate(list(range(len(model.rows)))):
+        search()
+    if best[1] is None:
+        return None
+    return sorted(best[1])
+
+
+def solve_pulp(model, _=profiling.DISABLED):
+    """
+    Solve the model using PuLP & its default solver (CBC). Takes the
+    profiling.Stats like solve() - but CBC does not report the nodes it
+    searched.
+
+    :param model: The model.
+    :return: List of ids of the variables which are 1 in an optimal solution
+        or None if there is none.
+    """
+    import pulp
+
+    problem = pulp.LpProblem('stitch', pulp.LpMinimize)
+    variables = [pulp.LpVariable('x%d' % i, cat='Binary')
+                 for i in range(len(model.names))]
+    problem += pulp.lpSum(cost * var
+                          for cost, var in zip(model.costs, variables))
+    for coefficients, bound in model.rows:
+        problem += pulp.lpSum(coef * variables[var]
+                              for var, coef in coefficients) <= bound
+    problem.solve(pulp.PULP_CBC_CMD(msg=False))
+    if pulp.LpStatus[problem.status] != 'Optimal':
+        return None
+    return [i for i, var in enumerate(variables) if var.value() > 0.5]
+
+
+SOLVERS = {'builtin': solve,
+           'pulp': solve_pulp}
+
+
+class ExactStitcher(stitcher.Stitcher):
+    """
+    Stitcher which determines the cheapest stitch satisfying all conditions.
+    """
+
+    def __init__(self, rels, cost=stitch.rank_cost, solver='builtin',
+                 view=False, limits=None):
+        """
+        Initiate the stitcher.
+
+        :param rels: A dictionary defining what type of nodes in the request
+            must be stitched to what type of nodes in the container.
+        :param cost: Function returning the cost of a stitch given the
+            container, the request node & the target node (default: rank of
+            the target).
+        :param solver: Name of the solver - 'builtin' or 'pulp' (needs PuLP
+            to be installed).
+        :param view: If True the resulting graphs are read-only views which
+            reference the container & request instead of copies of them.
+        :param limits: List of (validator, param) tuples - e.g.
+            [('incoming_edges', {'b': 5})] - the stitch needs to pass.
+        """
+        super(ExactStitcher, self).__init__(rels, view=view)
+        if solver not in SOLVERS:
+            raise ValueError('Unknown solver: %s' % solver)
+        self.cost = cost
+        self.solver = solver
+        self.limits = limits
+
+    def stitch(self, container, request, conditions=None, index=None,
+               stats=None):
+        """
+        Stitch a request graph into an existing graph container. Returns the
+        optimal option - or none if the conditions can not be satisfied.
+
+        :param container: A graph describing the existing container with
+            ranks.
+        :param request: A graph describing the request.
+        :param conditions: Dictionary with conditions - e.g. node a & b need
+            to be related to node c.
+        :param index: Optional ContainerIndex of the container.
+        :param stats: Optional profiling.Stats recording the time spend per
+            phase, the size of the model & the nodes searched.
+        :return: List with the resulting graph (or an empty list).
+        """
+        stats = profiling.get(stats)
+        with stats.timer('formulate'):
+            capacity = validators.capacity(container, request, self.limits)
+            if capacity is None:
+                LOG.warning('No stitch can pass the validators')
+                return []
+            model, keys = formulate(container, request, self.rels,
+                                    conditions, self.cost, index, capacity)
+        stats.peak('variables', len(model.names))
+        stats.peak('constraints', len(model.rows))
+        if not keys:
+            return []
+        with stats.timer('solve'):
+            res = SOLVERS[self.solver](model, stats)
+        if res is None:
+            LOG.info('Conditions can not be satisfied')
+            return []
+        return [self._result(container, request,
+                             [model.names[var] for var in res])]
@@ -0,0 +1,158 @@
+"""
+Index on the nodes of a container graph.
+"""
+
+import bisect
+import numbers
+import random
+
+import numpy as np
+
+import stitcher
+
+
+def is_number(value):
+    """
+    Check if a value is a number - booleans do not count.
+    """
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+class ContainerIndex:
+    """
+    Index of the container nodes by type and attribute values. Containers are
+    usually long-lived while requests come & go - so build the index once and
+    pass it to the stitch() calls of the stitchers.
+
+    The index is not updated automatically - rebuild it when the container
+    changes.
+    """
+
+    def __init__(self, container):
+        """
+        Build the index.
+
+        :param container: A graph describing the existing container.
+        """
+        self.container = container
+        self.all = []
+        self.ids = {}
+        self.types = {}
+        self.values = {}
+        self.ranges = {}
+        self._columns = {}
+        self._codes = {}
+        numeric = {}
+        unhashable = set()
+        unsortable = set()
+        for node, attrs in container.nodes(data=True):
+            self.ids[node] = len(self.all)
+            self.all.append(node)
+            self.types.setdefault(attrs[stitcher.TYPE_ATTR], []).append(node)
+            for attrn, attrv in attrs.items():
+                try:
+                    self.values.setdefault(attrn, {}).setdefault(
+                        attrv, []).append(node)
+                except TypeError:
+                    unhashable.add(attrn)
+                if is_number(attrv):
+                    numeric.setdefault(attrn, []).append((attrv, node))
+                else:
+                    unsortable.add(attrn)
+        for attrn in unhashable:
+            # can only look these up by scanning the nodes.
+            self.values.pop(attrn, None)
+        for attrn, items in numeric.items():
+            if attrn in unsortable:
+                continue
+            items.sort(key=lambda item: item[0])
+            self.ranges[attrn] = ([item[0] for item in items],
+                                  [item[1] for item in items])
+
+    def nodes(self, tzpe):
+        """
+        Return the nodes of a given type - in the order of the container.
+        """
+        return self.types.get(tzpe, [])
+
+    def random_node(self, tzpe=None):
+        """
+        Randomly pick a node of a given type (or any node if no type is
+        given). Returns None if there is no such node.
+        """
+        nodes = self.all if tzpe is None else self.types.get(tzpe)
+        if not nodes:
+            return None
+        return random.choice(nodes)
+
+    def select(self, cond, attrn, attrv):
+        """
+        Return the set of nodes which satisfy an attribute condition ('eq' -
+        equal to, 'lg' - larger than, 'lt' - less than or equal to the given
+        value). Returns None if the index can not answer the query, in which
+        case the nodes need to be checked one by one.
+        """
+        if cond == 'eq' and attrn in self.values:
+            try:
+                return set(self.values[attrn].get(attrv, []))
+            except TypeError:
+                return None
+        if cond in ['lg', 'lt'] and attrn in self.ranges \
+                and is_number(attrv):
+            values, nodes = self.ranges[attrn]
+            i = bisect.bisect_right(values, attrv)
+            if cond == 'lg':
+                return set(nodes[i:])
+            return set(nodes[:i])
+        return None
+
+    def column(self, attrn):
+        """
+        Return the values of a numeric attribute as an array - one entry per
+        node (in the order of self.all) - and a validity mask which is False
+        for the nodes without the attribute. Returns None if the attribute is
+        not numeric for all nodes having it.
+        """
+        if attrn not in self._columns:
+            res = None
+            if attrn in self.ranges:
+                valid = np.zeros(len(self.all), dtype=bool)
+                tmp = [0] * len(self.all)
+                for node in self.ranges[attrn][1]:
+                    valid[self.ids[node]] = True
+                    tmp[self.ids[node]] = self.container.nodes[node][attrn]
+                values = np.array(tmp)
+                if values.dtype != object:
+                    res = values, valid
+            self._columns[attrn] = res
+        return self._columns[attrn]
+
+    def codes(self, attrn):
+        """
+        Number the values of an attribute - nodes with equal values get equal
+        codes, nodes without the attribute get -1. Returns the array of codes
+        (in the order of self.all) and the code of the value '' (-2 if no node
+        has that value).
+        """
+        if attrn not in self._codes:
+            codes = np.full(len(self.all), -1, dtype=np.int64)
+            seen = {}
+            unhashable = []
+            for i, node in enumerate(self.all):
+                attrs = self.container.nodes[node]
+                if attrn not in attrs:
+                    continue
+                attrv = attrs[attrn]
+                try:
+                    codes[i] = seen.setdefault(attrv,
+                                               len(seen) + len(unhashable))
+                except TypeError:
+                    for code, value in unhashable:
+                        if value == attrv:
+                            codes[i] = code
+                            break
+                    else:
+                        codes[i] = len(seen) + len(unhashable)
+                        unhashable.append((codes[i], attrv))
+            self._codes[attrn] = codes, seen.get('', -2)
+        return self._codes[attrn]
@@ -2,14 +2,22 @@
 Module using an iterative repair approach.
 """
 
+import collections
 import logging
+import multiprocessing
 import random
-import re
+import time
 
-import networkx as nx
+from concurrent import futures
 
 import stitcher
 
+from stitcher import compiler
+from stitcher import indexing
+from stitcher import profiling
+
+LOG = logging.getLogger(__name__)
+
 
 def convert_conditions(conditions):
     """
@@ -17,6 +25,8 @@ def convert_conditions(conditions):
     """
     if conditions is None:
         return {}
+    if isinstance(conditions, compiler.Plan):
+        conditions = conditions.conditions
     res = {}
     if 'attributes' in conditions:
         for condition in conditions['attributes']:
@@ -45,61 +55,479 @@ def convert_conditions(conditions):
                     attr = condition[1][0]
                     if node in res:
                         res[node].append((cond, (attr, [item for item in
-                                                        condition[1]
+                                                        condition[1][1]
                                                         if item != node])))
                     else:
                         res[node] = [(cond, (attr, [item for item in
-                                                    condition[1]
+                                                    condition[1][1]
                                                     if item != node]))]
     return res
 
 
+class CompiledConditions(dict):
+    """
+    Converted conditions where each condition is paired with a prebound
+    check: nodename->list of (condition, check). The check is called with the
+    container & the mapping and returns True in case of a conflict.
+    """
+
+
+def compile_node_conditions(conditions):
+    """
+    Compile converted conditions (see convert_conditions) - compiled ones are
+    returned as they are.
+    """
+    if isinstance(conditions, CompiledConditions):
+        return conditions
+    res = CompiledConditions()
+    for node in conditions:
+        res[node] = [(condy, _compile_check(node, condy))
+                     for condy in conditions[node]]
+    return res
+
+
+def _compile_check(node, condy):
+    cond = condy[0]
+    attrs = condy[1]
+    if cond in compiler.ATTRIBUTE_CONDITIONS:
+        test = compiler.attribute_test(cond, attrs[0], attrs[1])
+        return lambda container, mapping: \
+            test(container.nodes[mapping[node]]) != compiler.OK
+    if cond == 'same':
+        return lambda container, mapping: mapping[node] != mapping[attrs]
+    if cond == 'diff':
+        return lambda container, mapping: mapping[node] == mapping[attrs]
+    if cond in ['share', 'nshare']:
+        test = compiler.share_test(cond, attrs[0],
+                                   frozenset([node] + list(attrs[1])))
+        return lambda container, mapping: test(
+            [(src, container.nodes[trg]) for src, trg in mapping.items()]) \
+            != compiler.OK
+    return lambda container, mapping: False
+
+
+def _partners(condy, request):
+    """
+    The other request nodes a converted condition depends on.
+    """
+    if condy[0] in ['same', 'diff']:
+        return [condy[1]]
+    if condy[0] in ['share', 'nshare']:
+        # all stitched targets need to have the attribute.
+        return list(request)
+    return []
+
+
+def _own(sticher, name):
+    """
+    Tell if a routine of the stitcher is not overwritten by a subclass.
+    """
+    return getattr(type(sticher), name) is \
+        getattr(IterativeRepairStitcher, name)
+
+
+class TrackedMapping(dict):
+    """
+    Mapping of request to container nodes which remembers the request nodes
+    whose target changed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(TrackedMapping, self).__init__(*args, **kwargs)
+        self.changed = set()
+
+    def __setitem__(self, key, value):
+        self.changed.add(key)
+        super(TrackedMapping, self).__setitem__(key, value)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+
+class ConflictTracker:
+    """
+    Keeps track of the conflicts of a mapping. After a request node got a new
+    target only the conditions involving it - its own & those of the
+    partner nodes of same/diff/share/nshare conditions - are re-evaluated.
+
+    Also remembers the targets request nodes were recently moved away from
+    (tabu) - see IterativeRepairStitcher.fix_conflict.
+    """
+
+    def __init__(self, container, request, conditions, mapping, index=None,
+                 tabu=0):
+        """
+        Initiate the tracker - all conditions are evaluated once.
+
+        :param container: A graph describing the existing container.
+        :param request: A graph describing the request.
+        :param conditions: Converted conditions (see convert_conditions).
+        :param mapping: The mapping.
+        :param index: Optional ContainerIndex of the container - used to
+            score the targets of attribute conditions.
+        :param tabu: Number of (node, target) pairs to remember as tabu.
+        """
+        conditions = compile_node_conditions(conditions)
+        self.container = container
+        self.mapping = mapping
+        self.index = index
+        self.tabu = collections.deque(maxlen=tabu)
+        # entry -> targets satisfying an attribute condition (or a dict of
+        # the outcomes for the targets seen so far).
+        self._allowed = {}
+        # (node, condition, check) - in the order of find_conflicts.
+        self.entries = []
+        # request node -> indices of the entries depending on its target.
+        self.watches = {}
+        for node in request.nodes():
+            for condy, check in conditions.get(node, []):
+                i = len(self.entries)
+                self.entries.append((node, condy, check))
+                for item in dict.fromkeys([node] + _partners(condy, request)):
+                    self.watches.setdefault(item, []).append(i)
+        self.active = set(i for i, (_, _, check) in enumerate(self.entries)
+                          if check(container, mapping))
+
+    def update(self, node):
+        """
+        Re-evaluate the conditions depending on the target of a node.
+
+        :param node: The request node which got a new target.
+        :return: Number of conditions evaluated.
+        """
+        indices = self.watches.get(node, [])
+        for i in indices:
+            if self.entries[i][2](self.container, self.mapping):
+                self.active.add(i)
+            else:
+                self.active.discard(i)
+        return len(indices)
+
+    def conflicts(self):
+        """
+        Return the conflicts - same as find_conflicts would.
+        """
+        return [self.entries[i][:2] for i in sorted(self.active)]
+
+    def _violates(self, i, node, trg):
+        """
+        Check if a condition would be violated with the node stitched to trg.
+        """
+        src, condy, check = self.entries[i]
+        if src != node or condy[0] not in compiler.ATTRIBUTE_CONDITIONS:
+            return check(self.container, self.mapping)
+        # attribute conditions only depend on the target - so use the index.
+        if i not in self._allowed:
+            allowed = None
+            if self.index is not None:
+                allowed = self.index.select(condy[0], condy[1][0],
+                                            condy[1][1])
+            self._allowed[i] = {} if allowed is None else allowed
+        allowed = self._allowed[i]
+        if isinstance(allowed, dict):
+            if trg not in allowed:
+                allowed[trg] = not check(self.container, self.mapping)
+            return not allowed[trg]
+        return trg not in allowed
+
+    def score(self, node, trg):
+        """
+        Number of conditions which would be violated if the node would be
+        stitched to the given target - the mapping is not changed.
+
+        :param node: The request node.
+        :param trg: The container node.
+        :return: Number of conflicts involving the node.
+        """
+        old = self.mapping[node]
+        # bypass the tracking of changes.
+        dict.__setitem__(self.mapping, node, trg)
+        try:
+            return sum(1 for i in self.watches.get(node, [])
+                       if self._violates(i, node, trg))
+        finally:
+            dict.__setitem__(self.mapping, node, old)
+
+    def __len__(self):
+        return len(self.active)
+
+
+STRATEGIES = ['min_conflicts', 'random']
+
+RESTART_POLICIES = ['luby', 'geometric']
+
+# growth of the number of steps per restart for the geometric policy.
+GEOMETRIC_FACTOR = 1.5
+
+
+def luby(i):
+    """
+    The i-th (starting at 1) element of the Luby sequence: 1, 1, 2, 1, 1, 2,
+    4, 1, 1, 2, 1, 1, 2, 4, 8, ...
+    """
+    k = 1
+    while (1 << k) - 1 < i:
+        k += 1
+    if (1 << k) - 1 == i:
+        return 1 << (k - 1)
+    return luby(i - (1 << (k - 1)) + 1)
+
+
+_WORKER = {}
+
+
+def _init_worker(sticher, container, request, conditions, index, stop):
+    """
+    Initialize a worker process of the portfolio - the stop event is set as
+    soon as one search found a solution.
+    """
+    _WORKER['sticher'] = sticher
+    _WORKER['container'] = container
+    _WORKER['request'] = request
+    _WORKER['conditions'] = conditions
+    _WORKER['index'] = index
+    _WORKER['stop'] = stop
+
+
+def _portfolio_search(seed, budget):
+    """
+    Run one independently seeded search (with restarts) - runs in a worker
+    process. Returns the mapping or None.
+    """
+    random.seed(seed)
+    stop = _WORKER['stop']
+    if stop.is_set():
+        return None
+    deadline = None if budget is None else time.monotonic() + budget
+    return _WORKER['sticher']._search(_WORKER['container'],
+                                      _WORKER['request'],
+                                      _WORKER['conditions'],
+                                      _WORKER['index'], deadline=deadline,
+                                      stop=stop)
+
+
 class IterativeRepairStitcher(stitcher.Stitcher):
     """
     Stitcher using a iterative repair approach to solve the constraints.
     """
 
-    def __init__(self, rels, max_steps=30):
-        super(IterativeRepairStitcher, self).__init__(rels)
+    def __init__(self, rels, max_steps=30, view=False,
+                 strategy='min_conflicts', tabu=5, restarts=0,
+                 restart_policy='luby', processes=None, time_budget=None):
+        """
+        Initiate the stitcher.
+
+        :param rels: A dictionary defining what type of nodes in the request
+            must be stitched to what type of nodes in the container.
+        :param max_steps: Maximum number of repair steps (default 30).
+        :param view: If True the resulting graphs are read-only views which
+            reference the container & request instead of copies of them.
+        :param strategy: How a conflicting node gets a new target - one of
+            STRATEGIES: 'min_conflicts' (the target violating the fewest
+            conditions) or 'random'.
+        :param tabu: Number of recent (node, target) pairs a node can not
+            return to with the min conflicts strategy - avoids cycling.
+        :param restarts: Number of times the search starts over from a new
+            random stitch if no solution was found (default 0).
+        :param restart_policy: Number of steps of the runs - one of
+            RESTART_POLICIES: 'luby' (max_steps times the Luby sequence) or
+            'geometric' (growing by GEOMETRIC_FACTOR per restart).
+        :param processes: If set a portfolio of this number of independently
+            seeded searches runs in worker processes - the first solution
+            found is returned. The conditions need to be picklable then.
+        :param time_budget: Optional number of seconds after which the
+            search (or portfolio) gives up.
+        """
+        super(IterativeRepairStitcher, self).__init__(rels, view=view)
+        if strategy not in STRATEGIES:
+            raise ValueError('Unknown strategy: %s' % strategy)
+        if restart_policy not in RESTART_POLICIES:
+            raise ValueError('Unknown restart policy: %s' % restart_policy)
         self.steps = max_steps
+        self.strategy = strategy
+        self.tabu = tabu
+        self.restarts = restarts
+        self.restart_policy = restart_policy
+        self.processes = processes
+        self.time_budget = time_budget
+
+    def stitch(self, container, request, conditions=None, index=None,
+               stats=None):
+        """
+        Stitch a request graph into an existing graph container. Returns a
+        list with one solution or an empty list.
 
-    def stitch(self, container, request, conditions=None):
-        conditions = convert_conditions(conditions)
-        mapping = {}
-
-        # initial (random mapping)
-        for node, attr in request.nodes(data=True):
-            mapping[node] = self._pick_random(container,
-                                              attr[stitcher.TYPE_ATTR])
-        logging.info('Initial random stitching: %s.', mapping)
-
-        # start the solving process.
-        res = self._solve(container, request, conditions, mapping)
-        if res >= 0:
-            logging.info('Found solution in %s iterations: %s.', res, mapping)
-            tmp_graph = nx.union(container, request)
-            for item in mapping:
-                tmp_graph.add_edge(item, mapping[item])
-            return [tmp_graph]
-        logging.error('Could not find a solution in %s steps.', self.steps)
+        :param container: A graph describing the existing container with
+            ranks.
+        :param request: A graph describing the request.
+        :param conditions: Dictionary with conditions - e.g. node a & b need
+            to be related to node c.
+        :param index: Optional ContainerIndex of the container - build it
+            once & reuse it when stitching many requests into one container.
+        :param stats: Optional profiling.Stats recording the time spend per
+            phase & the number of repair steps - the searches of a portfolio
+            are only timed as a whole.
+        :return: List of resulting graphs(s).
+        """
+        stats = profiling.get(stats)
+        if index is None:
+            index = indexing.ContainerIndex(container)
+        if self.processes:
+            with stats.timer('portfolio'):
+                mapping = self._portfolio(container, request, conditions,
+                                          index)
+        else:
+            deadline = None
+            if self.time_budget is not None:
+                deadline = time.monotonic() + self.time_budget
+            mapping = self._search(container, request, conditions, index,
+                                   stats, deadline=deadline)
+        if mapping is not None:
+            LOG.debug('Solution: %s.', mapping)
+            return [self._result(container, request, mapping.items())]
+        LOG.error('Could not find a solution in %s run(s).',
+                  self.restarts + 1)
         return []
 
-    def _solve(self, container, request, conditions, mapping):
+    def _budget(self, run):
+        """
+        Number of repair steps of a run (starting at 0).
+        """
+        if self.restart_policy == 'geometric':
+            return int(self.steps * GEOMETRIC_FACTOR ** run)
+        return self.steps * luby(run + 1)
+
+    def _search(self, container, request, conditions, index,
+                stats=profiling.DISABLED, deadline=None, stop=None):
+        """
+        Search for a solution - starting over from a new random stitch if a
+        run did not find one.
+
+        :param deadline: Optional time.monotonic() value to give up at.
+        :param stop: Optional event - the search gives up once it is set.
+        :return: The mapping or None.
+        """
+        conditions = compile_node_conditions(convert_conditions(conditions))
+
+        def expired():
+            return (deadline is not None and time.monotonic() > deadline) \
+                or (stop is not None and stop.is_set())
+        check = None if deadline is None and stop is None else expired
+
+        # overwritten routines are called with the documented arguments.
+        extra = {}
+        if _own(self, '_pick_random'):
+            extra['index'] = index
+        for run in range(self.restarts + 1):
+            if run:
+                stats.count('restarts')
+            with stats.timer('initial'):
+                mapping = {}
+                # initial (random mapping)
+                for node, attr in request.nodes(data=True):
+                    mapping[node] = self._pick_random(
+                        container, attr[stitcher.TYPE_ATTR], **extra)
+            LOG.debug('Initial random stitching: %s.', mapping)
+
+            # start the solving process.
+            with stats.timer('repair'):
+                res = self._solve(container, request, conditions, mapping,
+                                  index, stats, steps=self._budget(run),
+                                  stop=check)
+            if res >= 0:
+                LOG.info('Found solution in run %s after %s iterations.',
+                         run, res)
+                return mapping
+            if check is not None and check():
+                LOG.info('Search stopped in run %s.', run)
+                break
+        return None
+
+    def _portfolio(self, container, request, conditions, index):
+        """
+        Run independently seeded searches in worker processes - returns the
+        mapping found first (or None).
+        """
+        if isinstance(conditions, compiler.Plan):
+            # compiled plans can not be pickled.
+            conditions = conditions.conditions
+        stop = multiprocessing.Event()
+        executor = futures.ProcessPoolExecutor(
+            self.processes, initializer=_init_worker,
+            initargs=(self, container, request, conditions, index, stop))
+        try:
+            jobs = [executor.submit(_portfolio_search,
+                                    random.getrandbits(32), self.time_budget)
+                    for _ in range(self.processes)]
+            for job in futures.as_completed(jobs, timeout=self.time_budget):
+                mapping = job.result()
+                if mapping is not None:
+                    return mapping
+        except futures.TimeoutError:
+            LOG.info('Portfolio ran out of time.')
+        finally:
+            stop.set()
+            executor.shutdown(cancel_futures=True)
+        return None
+
+    def _solve(self, container, request, conditions, mapping, index=None,
+               stats=profiling.DISABLED, steps=None, stop=None):
         """
-        The actual iterative repair algorithm.
+        The actual iterative repair algorithm. The conflicts are tracked
+        incrementally - unless find_conflicts is overwritten: it is asked for
+        the conflicts in every step then & fix_conflict has no ConflictTracker
+        to score the targets with.
+
+        :param index: Optional ContainerIndex of the container.
+        :param steps: Number of steps (default max_steps).
+        :param stop: Optional function - the repair gives up once it
+            returns True.
         """
-        for i in range(self.steps):
-            logging.debug('Iteration: %s.', i)
-            conflicts = self.find_conflicts(container, request, conditions,
-                                            mapping)
-            if not conflicts:
-                return i
-            logging.debug('Found %s conflict(s) in current stitch %s - %s',
-                          len(conflicts), mapping, conflicts)
-            conflict = self.next_conflict(conflicts)
-            logging.debug('Will try to fix conflict: %s.', conflict)
-            self.fix_conflict(conflict, container, request, mapping)
-        return -1
+        if index is None:
+            index = indexing.ContainerIndex(container)
+        conditions = compile_node_conditions(conditions)
+        tracker = None
+        if _own(self, 'find_conflicts'):
+            tracked = TrackedMapping(mapping)
+            tracker = ConflictTracker(container, request, conditions,
+                                      tracked, index=index, tabu=self.tabu)
+            stats.count('checks', len(tracker.entries))
+        else:
+            tracked = mapping
+            # overwritten routines get the converted conditions only.
+            conditions = dict((node, [condy for condy, _ in items])
+                              for node, items in conditions.items())
+        # overwritten routines are called with the documented arguments.
+        extra = {}
+        if _own(self, 'fix_conflict'):
+            extra = {'index': index, 'tracker': tracker}
+        try:
+            for i in range(self.steps if steps is None else steps):
+                if stop is not None and stop():
+                    break
+                if tracker is not None:
+                    for node in tracked.changed:
+                        stats.count('checks', tracker.update(node))
+                    tracked.changed.clear()
+                    conflicts = tracker.conflicts()
+                else:
+                    conflicts = self.find_conflicts(container, request,
+                                                    conditions, tracked)
+                stats.peak('conflicts', len(conflicts))
+                if not conflicts:
+                    return i
+                stats.count('steps')
+                LOG.debug('Iteration %s: %s conflict(s).', i, len(conflicts))
+                conflict = self.next_conflict(conflicts)
+                stitcher.trace(LOG, 'repair', iteration=i, mapping=tracked,
+                               conflicts=conflicts, conflict=conflict)
+                self.fix_conflict(conflict, container, request, tracked,
+                                  **extra)
+            return -1
+        finally:
+            if tracked is not mapping:
+                mapping.update(tracked)
 
     def find_conflicts(self, container, request, conditions, mapping):
         """
@@ -111,13 +539,13 @@ class IterativeRepairStitcher(stitcher.Stitcher):
         mechanism - a sub optimal mapping (e.g. based on the rank) could also
         be seen as a conflict.
         """
+        conditions = compile_node_conditions(conditions)
         res = []
         for node in request.nodes():
             if node in conditions:
-                for condy in conditions[node]:
-                    tmp = _check_condition(node, condy, container, mapping)
-                    if tmp:
-                        res.append(tmp)
+                for condy, check in conditions[node]:
+                    if check(container, mapping):
+                        res.append((node, condy))
         return res
 
     def next_conflict(self, conflicts):
@@ -129,92 +557,61 @@ class IterativeRepairStitcher(stitcher.Stitcher):
         """
         return random.choice(conflicts)
 
-    def fix_conflict(self, conflict, container, request, mapping):
+    def fix_conflict(self, conflict, container, request, mapping,
+                     index=None, tracker=None):
         """
         Fix a given conflict.
 
-        Overwrite this routine with your own optimized fixer if needed.
+        With the min conflicts strategy the node is stitched to the target of
+        the right type which violates the fewest conditions - ties are broken
+        randomly, targets the node recently left are tabu. Without a
+        ConflictTracker (or with the random strategy) a random target of the
+        right type is picked.
+
+        Overwrite this routine with your own optimized fixer if needed - it
+        is called with the conflict, container, request & mapping only.
+
+        :param index: Optional ContainerIndex of the container.
+        :param tracker: Optional ConflictTracker of the mapping.
         """
-        # TODO: write solving routines for conditions that are available.
-        tmp = self._pick_random(container,
-                                request.nodes[conflict[0]][stitcher.TYPE_ATTR])
-        mapping[conflict[0]] = tmp
+        if index is None:
+            index = indexing.ContainerIndex(container)
+        node = conflict[0]
+        if self.strategy == 'random' or tracker is None:
+            extra = {'index': index} if _own(self, '_pick_random') else {}
+            mapping[node] = self._pick_random(
+                container, request.nodes[node][stitcher.TYPE_ATTR], **extra)
+            return
+        current = mapping[node]
+        tzpe = self.rels[request.nodes[node][stitcher.TYPE_ATTR]]
+        targets = [trg for trg in index.nodes(tzpe) if trg != current]
+        options = [trg for trg in targets
+                   if (node, trg) not in tracker.tabu] or targets
+        if not options:
+            # no other target available.
+            return
+        best = []
+        least = None
+        for trg in options:
+            tmp = tracker.score(node, trg)
+            if least is None or tmp < least:
+                best = [trg]
+                least = tmp
+            elif tmp == least:
+                best.append(trg)
+        tracker.tabu.append((node, current))
+        mapping[node] = random.choice(best)
 
-    def _pick_random(self, container, req_node_type):
+    def _pick_random(self, container, req_node_type, index=None):
         """
         Randomly pick a node in container for a node in req.
-        """
-        i = 30
-        while i >= 0:
-            cand_name, attrs = random.choice(list(container.nodes(data=True)))
-            if attrs[stitcher.TYPE_ATTR] == self.rels[req_node_type]:
-                return cand_name
-            i -= 1
-        logging.warning('Checking if there is a node that matches...')
-        for node, attr in container.nodes(data=True):
-            if attr[stitcher.TYPE_ATTR] == self.rels[req_node_type]:
-                return node
-        raise Exception('No node in the container has the required type '
-                        '%s.' % self.rels[req_node_type])
-
-
-def _check_condition(node, condy, container, mapping):
-    res = _check_attributes(node, condy, container, mapping)
-    if not res:
-        res = _check_compositions(node, condy, container, mapping)
-    return res
-
 
-def _check_attributes(node, condy, container, mapping):
-    cond = condy[0]
-    attrs = condy[1]
-    # attributes
-    if cond == 'eq':
-        if attrs[0] not in container.nodes[mapping[node]] or \
-                container.nodes[mapping[node]][attrs[0]] != attrs[1]:
-            return node, condy
-    elif cond == 'neq':
-        if attrs[0] in container.nodes[mapping[node]] and \
-                container.nodes[mapping[node]][attrs[0]] == attrs[1]:
-            return node, condy
-    elif cond == 'lt':
-        if attrs[0] not in container.nodes[mapping[node]] or \
-                container.nodes[mapping[node]][attrs[0]] > attrs[1]:
-            return node, condy
-    elif cond == 'gt':
-        if attrs[0] not in container.nodes[mapping[node]] or \
-                container.nodes[mapping[node]][attrs[0]] < attrs[1]:
-            return node, condy
-    elif cond == 'regex':
-        if attrs[0] not in container.nodes[mapping[node]] or \
-                not re.search(attrs[1],
-                              container.nodes[mapping[node]][attrs[0]]):
-            return node, condy
-    return None
-
-
-def _check_compositions(node, condy, container, mapping):
-    cond = condy[0]
-    attrs = condy[1]
-    # compositions
-    if cond == 'same':
-        if mapping[node] != mapping[attrs]:
-            return node, condy
-    elif cond == 'diff':
-        if mapping[node] == mapping[attrs]:
-            return node, condy
-    elif cond == 'share':
-        attr_name = attrs[0]
-        for ngbh in attrs[1]:
-            if attr_name not in container.nodes[mapping[ngbh]] or \
-                    container.nodes[mapping[ngbh]][attr_name] != \
-                    container.nodes[mapping[node]][attr_name]:
-                return node, condy
-    elif cond == 'nshare':
-        attr_name = attrs[0]
-        for ngbh in attrs[1]:
-            if attr_name not in container.nodes[mapping[ngbh]] or \
-                    container.nodes[mapping[ngbh]][attr_name] == \
-                    container.nodes[mapping[node]][attr_name]:
-                return node, condy
-    return None
+        :param index: Optional ContainerIndex of the container.
+        """
+        if index is None:
+            index = indexing.ContainerIndex(container)
+        node = index.random_node(self.rels[req_node_type])
+        if node is None:
+            raise Exception('No node in the container has the required type '
+                            '%s.' % self.rels[req_node_type])
+        return node
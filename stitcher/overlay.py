@@ -0,0 +1,134 @@
+"""
+Read-only overlay graph of a container, a request & the stitches in between.
+"""
+
+import itertools
+
+from collections.abc import Mapping
+
+import networkx as nx
+
+
+class _UnionAtlas(Mapping):
+    """
+    Read-only union of two mappings with disjoint keys.
+    """
+
+    def __init__(self, first, second):
+        self._first = first
+        self._second = second
+
+    def __getitem__(self, key):
+        if key in self._first:
+            return self._first[key]
+        return self._second[key]
+
+    def __contains__(self, key):
+        return key in self._first or key in self._second
+
+    def __iter__(self):
+        return itertools.chain(self._first, self._second)
+
+    def __len__(self):
+        return len(self._first) + len(self._second)
+
+    def __repr__(self):
+        return '%s(%r, %r)' % (self.__class__.__name__, self._first,
+                               self._second)
+
+
+class _StitchAdjacency(Mapping):
+    """
+    Read-only adjacency of the container & request - extended by the
+    neighbours introduced through the stitches.
+    """
+
+    def __init__(self, container_adj, request_adj, stitches):
+        self._nodes = _UnionAtlas(container_adj, request_adj)
+        self._stitches = stitches
+
+    def __getitem__(self, node):
+        nbrs = self._nodes[node]
+        if node in self._stitches:
+            return _UnionAtlas(nbrs, self._stitches[node])
+        return nbrs
+
+    def __contains__(self, node):
+        return node in self._nodes
+
+    def __iter__(self):
+        return iter(self._nodes)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __repr__(self):
+        return '%s(%r, %r)' % (self.__class__.__name__, self._nodes,
+                               self._stitches)
+
+
+class StitchView(nx.DiGraph):
+    """
+    A frozen graph which looks like the union of the container and the request
+    plus the stitches. Only the stitches are stored - the container & request
+    are referenced, so they must not be changed while the view is in use.
+
+    Use copy() to get a graph which can be modified.
+    """
+
+    def __init__(self, container=None, request=None, stitches=None):
+        """
+        Initiate the view.
+
+        :param container: A graph describing the existing container.
+        :param request: A graph describing the request.
+        :param stitches: List of (source, target) tuples - the new edges.
+        """
+        super(StitchView, self).__init__()
+        if container is None:
+            # networkx creates empty instances for its own views.
+            return
+        if request is None:
+            request = nx.DiGraph()
+        if any(node in container for node in request):
+            raise nx.NetworkXError('The node sets of the graphs are not '
+                                   'disjoint.')
+        self.container = container
+        self.request = request
+        self.stitches = []
+        succ = {}
+        pred = {}
+        for src, trg in stitches or []:
+            if src not in container and src not in request or \
+                    trg not in container and trg not in request:
+                raise nx.NetworkXError('Stitch %s -> %s refers to an unknown'
+                                       ' node.' % (src, trg))
+            if trg in succ.get(src, {}) or \
+                    trg in container._succ.get(src, request._succ.get(src)):
+                continue
+            succ.setdefault(src, {})[trg] = {}
+            pred.setdefault(trg, {})[src] = {}
+            self.stitches.append((src, trg))
+
+        self.graph.update(container.graph)
+        self.graph.update(request.graph)
+        self._node = _UnionAtlas(container._node, request._node)
+        self._succ = _StitchAdjacency(container._succ, request._succ, succ)
+        self._pred = _StitchAdjacency(container._pred, request._pred, pred)
+        self._adj = self._succ
+        nx.freeze(self)
+
+    def copy(self, as_view=False):
+        """
+        Return a modifiable copy (a networkx DiGraph) of this view.
+        """
+        if as_view:
+            return nx.graphviews.generic_graph_view(self)
+        graph = nx.DiGraph()
+        graph.graph.update(self.graph)
+        graph.add_nodes_from((node, attr.copy())
+                             for node, attr in self._node.items())
+        graph.add_edges_from((src, trg, attr.copy())
+                             for src, nbrs in self._succ.items()
+                             for trg, attr in nbrs.items())
+        return graph
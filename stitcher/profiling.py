@@ -0,0 +1,130 @@
+"""
+Instrumentation of the stitchers - per phase wall time, counts & peak sizes.
+"""
+
+import contextlib
+import time
+
+
+class Stats:
+    """
+    Records what happens during a stitch() call. Pass an instance as the
+    stats parameter of stitch():
+
+        stats = Stats()
+        sticher.stitch(container, request, stats=stats)
+        print(stats.as_dict())
+
+    The optional callback is called with (kind, name, value) for each record
+    - kind being 'time', 'count' or 'peak' - e.g. to export metrics.
+    """
+
+    def __init__(self, callback=None):
+        """
+        Initiate the stats.
+
+        :param callback: Optional function called for each record.
+        """
+        self.callback = callback
+        self.times = {}
+        self.counts = {}
+        self.peaks = {}
+
+    def add_time(self, phase, seconds):
+        """
+        Add the wall time spend in a phase.
+        """
+        self.times[phase] = self.times.get(phase, 0.0) + seconds
+        if self.callback is not None:
+            self.callback('time', phase, seconds)
+
+    def count(self, name, value=1):
+        """
+        Increase a counter - e.g. the number of candidates generated.
+        """
+        self.counts[name] = self.counts.get(name, 0) + value
+        if self.callback is not None:
+            self.callback('count', name, value)
+
+    def peak(self, name, value):
+        """
+        Remember the largest value seen - e.g. of the size of a queue.
+        """
+        if value > self.peaks.get(name, value - 1):
+            self.peaks[name] = value
+        if self.callback is not None:
+            self.callback('peak', name, value)
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+        """
+        Context manager measuring the wall time of a phase.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def iterate(self, phase, iterable, name=None):
+        """
+        Wrap a (lazy) iterable - the time spend producing the items is
+        added to the phase and the items are counted as name.
+        """
+        items = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            finally:
+                self.add_time(phase, time.perf_counter() - start)
+            if name is not None:
+                self.count(name)
+            yield item
+
+    def as_dict(self):
+        """
+        Return the records as a dictionary (e.g. to dump it as JSON).
+        """
+        return {'times': dict(self.times),
+                'counts': dict(self.counts),
+                'peaks': dict(self.peaks)}
+
+    def __repr__(self):
+        return 'Stats(%s)' % self.as_dict()
+
+
+class _Disabled(Stats):
+    """
+    Stats which records nothing - used if no stats are passed.
+    """
+
+    def add_time(self, phase, seconds):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+    def peak(self, name, value):
+        pass
+
+    def timer(self, phase):
+        return contextlib.nullcontext()
+
+    def iterate(self, phase, iterable, name=None):
+        return iterable
+
+    def __bool__(self):
+        return False
+
+
+DISABLED = _Disabled()
+
+
+def get(stats):
+    """
+    Return the stats to record to - the disabled ones if None.
+    """
+    return DISABLED if stats is None else stats
@@ -2,24 +2,21 @@
 Implements stitching, validation and filtering functions.
 """
 
+import bisect
 import copy
 import itertools
-import re
+
+from concurrent import futures
 
 import networkx as nx
 
 import stitcher
 
-
-def _find_nodes(graph, tzpe):
-    """
-    Find nodes of a certain type in a graph.
-    """
-    res = []
-    for node, values in graph.nodes(data=True):
-        if values[stitcher.TYPE_ATTR] == tzpe:
-            res.append(node)
-    return res
+from stitcher import compiler
+from stitcher import indexing
+from stitcher import profiling
+from stitcher import validators
+from stitcher import vector
 
 
 def my_filter(container, edge_list, conditions):
@@ -33,206 +30,330 @@ def my_filter(container, edge_list, conditions):
         for the target nodes.
 
     :param edge_list: the candidate edge list as created by stitch().
-    :param conditions: dictionary containing the conditions.
+    :param conditions: dictionary containing the conditions (or a compiled
+        plan of the same).
     :return: The filtered dict with possible edges.
     """
     if conditions is None:
         return edge_list
-    if 'attributes' in conditions:
-        for condition in conditions['attributes']:
-            cond = condition[0]
-            para1 = condition[1][0]
-            para2 = condition[1][1]
-            if cond == 'eq':
-                _eq_attr_filter(container, para1, para2, edge_list)
-            elif cond == 'neq':
-                _neq_attr_filter(container, para1, para2, edge_list)
-            elif cond == 'lg':
-                _lg_attr_filter(container, para1, para2, edge_list)
-            elif cond == 'lt':
-                _lt_attr_filter(container, para1, para2, edge_list)
-            elif cond == 'regex':
-                _regex_attr_filter(container, para1, para2, edge_list)
-    if 'compositions' in conditions:
-        for condition in conditions['compositions']:
-            cond = condition[0]
-            para1 = condition[1][0]
-            para2 = condition[1][1]
-            if cond == 'same':
-                _same_filter(para1, para2, edge_list)
-            elif cond == 'diff':
-                _diff_filter(para1, para2, edge_list)
-            elif cond == 'share':
-                _share_attr(container, para1, para2, edge_list)
-            elif cond == 'nshare':
-                _nshare_attr(container, para1, para2, edge_list)
+    checks = compiler.compile_conditions(conditions).bind(_FILTERS)
+    if not checks:
+        return edge_list
+    for candidate in list(edge_list.keys()):
+        edges = edge_list[candidate]
+        targets = dict(edges)
+        for check, func in checks:
+            if not func(check, container, edges, targets):
+                edge_list.pop(candidate)
+                break
     return edge_list
 
 
-def _eq_attr_filter(container, node, condition, candidate_list):
+def _attr_filter(check, container, _, targets):
     """
     Filter on attributes needed on target node.
     """
-    for candidate in list(candidate_list.keys()):
-        attrn = condition[0]
-        attrv = condition[1]
-        for src, trg in candidate_list[candidate]:
-            if src == node and attrn not in container.nodes[trg]:
-                candidate_list.pop(candidate)
-                break
-            if src == node and attrn in container.nodes[trg] \
-                    and attrv != container.nodes[trg][attrn]:
-                candidate_list.pop(candidate)
-                break
+    if check.node not in targets:
+        return True
+    return check.test(container.nodes[targets[check.node]]) == compiler.OK
 
 
-def _neq_attr_filter(container, node, condition, candidate_list):
+def _same_filter(check, _, __, targets):
     """
-    Filter on attributes unequal to requested value.
+    Filter out candidates which do not adhere the same target composition
+    request.
     """
-    for candidate in list(candidate_list.keys()):
-        attrn = condition[0]
-        attrv = condition[1]
-        for src, trg in candidate_list[candidate]:
-            if src == node and attrn in container.nodes[trg] \
-                    and attrv == container.nodes[trg][attrn]:
-                candidate_list.pop(candidate)
-                break
+    node1, node2 = check.nodes[:2]
+    return node1 not in targets or node2 not in targets or \
+        targets[node1] == targets[node2]
 
 
-def _lg_attr_filter(container, node, condition, candidate_list):
+def _diff_filter(check, _, __, targets):
     """
-    Filter on attributes larger than requested value.
+    Filter out candidates which do not adhere the different target composition
+    request.
     """
-    for candidate in list(candidate_list.keys()):
-        attrn = condition[0]
-        attrv = condition[1]
-        for src, trg in candidate_list[candidate]:
-            if src == node and attrn not in container.nodes[trg]:
-                candidate_list.pop(candidate)
-                break
-            if src == node and attrn in container.nodes[trg] \
-                    and container.nodes[trg][attrn] <= attrv:
-                candidate_list.pop(candidate)
-                break
+    node1, node2 = check.nodes[:2]
+    return node1 == node2 or node1 not in targets or \
+        node2 not in targets or targets[node1] != targets[node2]
 
 
-def _lt_attr_filter(container, node, condition, candidate_list):
+def _share_filter(check, container, edges, _):
     """
-    Filter on attributes less than requested value.
+    Filter out candidates which do not adhere the request that all target
+    nodes stitched to in the nlist (do not) share the same attribute value
+    for a given attribute name - see compiler.share_test.
     """
-    for candidate in list(candidate_list.keys()):
-        attrn = condition[0]
-        attrv = condition[1]
-        for src, trg in candidate_list[candidate]:
-            if src == node and attrn not in container.nodes[trg]:
-                candidate_list.pop(candidate)
-                break
-            if src == node and attrn in container.nodes[trg] \
-                    and attrv < container.nodes[trg][attrn]:
-                candidate_list.pop(candidate)
-                break
+    return check.test([(src, container.nodes[trg])
+                       for src, trg in edges]) == compiler.OK
 
 
-def _regex_attr_filter(container, node, condition, candidate_list):
+_FILTERS = compiler.evaluators(_attr_filter, _same_filter, _diff_filter,
+                               _share_filter, _share_filter)
+
+
+def _prune_domains(container, keys, domains, plan, index=None):
     """
-    Filter on attributes which match an regex.
+    Forward check the conditions which only involve a single request node -
+    removes all targets from the domains which can never be part of a
+    candidate surviving my_filter.
     """
-    for candidate in list(candidate_list.keys()):
-        attrn = condition[0]
-        regex = condition[1]
-        for src, trg in candidate_list[candidate]:
-            if src == node and attrn not in container.nodes[trg]:
-                candidate_list.pop(candidate)
-                break
-            if src == node and attrn in container.nodes[trg] \
-                    and not re.search(regex, container.nodes[trg][attrn]):
-                candidate_list.pop(candidate)
-                break
+    for check in plan.attributes:
+        if check.node not in keys:
+            continue
+        i = keys.index(check.node)
+        allowed = None
+        if index is not None:
+            allowed = index.select(check.operator, check.attrn, check.attrv)
+        if allowed is not None:
+            domains[i] = [trg for trg in domains[i] if trg in allowed]
+        else:
+            domains[i] = [trg for trg in domains[i]
+                          if check.test(container.nodes[trg]) == compiler.OK]
+    for check in plan.shares:
+        # all stitched targets need to carry the attribute.
+        for i, domain in enumerate(domains):
+            domains[i] = [trg for trg in domain
+                          if check.attrn in container.nodes[trg]]
+    return domains
+
+
+def _constraints(keys, plan):
+    """
+    Determine the conditions which relate two or more request nodes. Returns
+    per position in the keys the list of constraints to propagate when that
+    request node gets assigned.
+    """
+    res = [[] for _ in keys]
+    for check in plan.compositions:
+        cond = check.operator
+        if cond in ['same', 'diff']:
+            node1, node2 = check.nodes[:2]
+            if node1 == node2 or node1 not in keys or node2 not in keys:
+                continue
+            first, second = sorted([keys.index(node1), keys.index(node2)])
+            res[first].append((cond, [second], [], None))
+        else:
+            members = [i for i, key in enumerate(keys)
+                       if key in check.members]
+            for j, i in enumerate(members):
+                res[i].append((cond, members[j + 1:], members[:j],
+                               check.attrn))
+    return res
 
 
-def _same_filter(node1, node2, candidate_list):
+def _propagate(container, domains, assigned, trg, constraints):
     """
-    Filter out candidates which do not adhere the same target composition
-    request.
+    Restrict the domains of the not yet assigned request nodes given the
+    newly assigned target. Returns None if a domain runs empty.
     """
-    for candidate in list(candidate_list.keys()):
-        n1_trg = ''
-        n2_trg = ''
-        for src, trg in candidate_list[candidate]:
-            if n1_trg == '' and src == node1:
-                n1_trg = trg
-            elif n1_trg != '' and src == node2:
-                if trg != n1_trg:
-                    candidate_list.pop(candidate)
-                    break
-            if n2_trg == '' and src == node2:
-                n2_trg = trg
-            elif n2_trg != '' and src == node1:
-                if trg != n2_trg:
-                    candidate_list.pop(candidate)
-                    break
-
-
-def _diff_filter(node1, node2, candidate_list):
+    domains = list(domains)
+    for cond, later, earlier, attrn in constraints:
+        if cond == 'same':
+            domains[later[0]] = [item for item in domains[later[0]]
+                                 if item == trg]
+        elif cond == 'diff':
+            domains[later[0]] = [item for item in domains[later[0]]
+                                 if item != trg]
+        else:
+            attrv = container.nodes[trg][attrn]
+            if attrv == '' or [i for i in earlier if
+                               container.nodes[assigned[i]][attrn] != '']:
+                # value already fixed by an earlier request node.
+                continue
+            for i in later:
+                if cond == 'share':
+                    domains[i] = [item for item in domains[i] if
+                                  container.nodes[item][attrn] == attrv]
+                else:
+                    domains[i] = [item for item in domains[i] if
+                                  container.nodes[item][attrn] != attrv]
+        for i in later:
+            if not domains[i]:
+                return None
+    return domains
+
+
+def _backtrack(container, keys, domains, constraints, assigned, capacity,
+               used):
     """
-    Filter out candidates which do not adhere the different target composition
-    request.
+    Assign the request nodes one by one in the order of the keys and yield
+    all complete assignments - in the same order itertools.product would.
     """
-    for candidate in list(candidate_list.keys()):
-        n1_trg = ''
-        n2_trg = ''
-        for src, trg in candidate_list[candidate]:
-            if n1_trg == '' and src == node1:
-                n1_trg = trg
-            elif n1_trg != '' and src == node2:
-                if trg == n1_trg:
-                    candidate_list.pop(candidate)
-                    break
-            if n2_trg == '' and src == node2:
-                n2_trg = trg
-            elif n2_trg != '' and src == node1:
-                if trg == n2_trg:
-                    candidate_list.pop(candidate)
-                    break
-
-
-def _share_attr(container, attrn, nlist, candidate_list):
-    """
-    Filter out candidates which do not adhere the request that all target nodes
-    stitched to in the nlist share the same attribute value for a given
-    attribute name.
-    """
-    for candidate in list(candidate_list.keys()):
-        attrv = ''
-        for src, trg in candidate_list[candidate]:
-            if attrn not in container.nodes[trg]:
-                candidate_list.pop(candidate)
-                break
-            elif src in nlist and attrv == '':
-                attrv = container.nodes[trg][attrn]
-            elif src in nlist and container.nodes[trg][attrn] != attrv:
-                candidate_list.pop(candidate)
-                break
+    i = len(assigned)
+    if i == len(keys):
+        yield list(zip(keys, assigned))
+        return
+    for trg in domains[i]:
+        if trg in capacity and used.get(trg, 0) >= capacity[trg]:
+            continue
+        pruned = _propagate(container, domains, assigned, trg,
+                            constraints[i])
+        if pruned is None:
+            continue
+        assigned.append(trg)
+        used[trg] = used.get(trg, 0) + 1
+        yield from _backtrack(container, keys, pruned, constraints, assigned,
+                              capacity, used)
+        used[trg] -= 1
+        assigned.pop()
+
+
+def search(container, keys, domains, conditions, index=None, capacity=None):
+    """
+    Backtracking search with forward checking over the possible stitches. The
+    conditions understood by my_filter are checked on partial assignments, so
+    only the surviving search space is explored. Yields the same edge lists
+    as filtering the full product of the domains with my_filter would.
+
+    :param container: The container graph.
+    :param keys: List of request nodes to stitch.
+    :param domains: List of possible target nodes per request node.
+    :param conditions: dictionary containing the conditions (or a compiled
+        plan of the same).
+    :param index: Optional ContainerIndex to look up attribute values.
+    :param capacity: Optional dictionary of container node -> # of stitches
+        it can take (see validators.capacity) - assignments exceeding it are
+        dropped as well.
+    :return: Generator of edge lists.
+    """
+    plan = compiler.compile_conditions(conditions)
+    domains = _prune_domains(container, keys, list(domains), plan, index)
+    capacity = capacity or {}
+    domains = [[trg for trg in domain if capacity.get(trg, 1) > 0]
+               for domain in domains]
+    if not keys or not all(domains):
+        return
+    constraints = _constraints(keys, plan)
+    yield from _backtrack(container, keys, domains, constraints, [],
+                          capacity, {})
+
+
+def rank_cost(container, _, trg):
+    """
+    Default cost of a stitch - the rank of the target node (0 if it has no
+    rank).
+    """
+    return container.nodes[trg].get('rank', 0)
 
 
-def _nshare_attr(container, attrn, nlist, candidate_list):
+def _bound(domains, i, costs):
     """
-    Filter out candidates which do not adhere the request that all target nodes
-    stitched to in the nlist do not share the same attribute value for a given
-    attribute name.
+    Lower bound of the cost to assign the request nodes from position i on -
+    the domains are sorted by cost, so the first target is the cheapest.
     """
-    for candidate in list(candidate_list.keys()):
-        attrv = ''
-        for src, trg in candidate_list[candidate]:
-            if attrn not in container.nodes[trg]:
-                candidate_list.pop(candidate)
-                break
-            elif src in nlist and attrv == '':
-                attrv = container.nodes[trg][attrn]
-            elif src in nlist and container.nodes[trg][attrn] == attrv:
-                candidate_list.pop(candidate)
+    return sum(costs[j, domains[j][0]] for j in range(i, len(domains)))
+
+
+def top_k(container, keys, domains, conditions, k, cost=rank_cost,
+          index=None, capacity=None):
+    """
+    Branch & bound search for the k cheapest stitches. The cost of a stitch
+    is the sum of the costs of its edges; partial stitches which can not
+    become cheaper than the k-th best found so far are not explored further.
+    Otherwise the search is the same as the backtracking search.
+
+    :param container: The container graph.
+    :param keys: List of request nodes to stitch.
+    :param domains: List of possible target nodes per request node.
+    :param conditions: dictionary containing the conditions (or a compiled
+        plan of the same).
+    :param k: Number of stitches to return.
+    :param cost: Function returning the cost of an edge given the container,
+        the request node & the target node.
+    :param index: Optional ContainerIndex to look up attribute values.
+    :param capacity: Optional dictionary of container node -> # of stitches
+        it can take (see validators.capacity).
+    :return: List of (cost, edge list) tuples - cheapest first, ties in the
+        order the backtracking search would return them.
+    """
+    plan = compiler.compile_conditions(conditions)
+    domains = _prune_domains(container, keys, list(domains), plan, index)
+    capacity = capacity or {}
+    domains = [[trg for trg in domain if capacity.get(trg, 1) > 0]
+               for domain in domains]
+    if k < 1 or not keys or not all(domains):
+        return []
+    costs = {}
+    # position of the targets in the domains - to break ties.
+    positions = [dict((trg, j) for j, trg in enumerate(domain))
+                 for domain in domains]
+    for i, domain in enumerate(domains):
+        for trg in domain:
+            costs[i, trg] = cost(container, keys[i], trg)
+        domains[i] = sorted(domain, key=lambda trg, i=i: (costs[i, trg],
+                                                          positions[i][trg]))
+    constraints = _constraints(keys, plan)
+    best = []
+    assigned = []
+    used = {}
+
+    def explore(domains, acc):
+        i = len(assigned)
+        if i == len(keys):
+            key = (acc, [positions[j][trg] for j, trg in enumerate(assigned)])
+            if len(best) < k or key < best[-1][0]:
+                bisect.insort(best, (key, list(zip(keys, assigned))))
+                del best[k:]
+            return
+        rest = _bound(domains, i + 1, costs)
+        for trg in domains[i]:
+            if trg in capacity and used.get(trg, 0) >= capacity[trg]:
+                continue
+            tmp = acc + costs[i, trg]
+            if len(best) == k and tmp + rest > best[-1][0][0]:
+                # domains are sorted - all other targets are more expensive.
                 break
+            pruned = _propagate(container, domains, assigned, trg,
+                                constraints[i])
+            if pruned is None:
+                continue
+            if len(best) == k and \
+                    tmp + _bound(pruned, i + 1, costs) > best[-1][0][0]:
+                continue
+            assigned.append(trg)
+            used[trg] = used.get(trg, 0) + 1
+            explore(pruned, tmp)
+            used[trg] -= 1
+            assigned.pop()
+
+    explore(domains, 0)
+    return [(key[0], edges) for key, edges in best]
+
+
+# state of a worker process - see GlobalStitcher._parallel.
+_WORKER = {}
+
+
+def _init_worker(index, conditions, candidate_filter, backtrack, capacity):
+    """
+    Initialize a worker process - the container (referenced by the index) is
+    passed once per worker instead of once per shard.
+    """
+    _WORKER['index'] = index
+    _WORKER['conditions'] = conditions
+    _WORKER['candidate_filter'] = candidate_filter
+    _WORKER['backtrack'] = backtrack
+    _WORKER['capacity'] = capacity
+
+
+def _stitch_shard(keys, per):
+    """
+    Determine the candidates for a part of the possible combinations - runs in
+    a worker process.
+    """
+    index = _WORKER['index']
+    if _WORKER['backtrack']:
+        res = GlobalStitcher._search(index.container, keys, per,
+                                     _WORKER['conditions'],
+                                     _WORKER['candidate_filter'], index,
+                                     _WORKER['capacity'])
+    else:
+        res = GlobalStitcher._product(index.container, keys, per,
+                                      _WORKER['conditions'],
+                                      _WORKER['candidate_filter'], index,
+                                      _WORKER['capacity'])
+    return list(res)
 
 
 class GlobalStitcher(stitcher.Stitcher):
@@ -240,8 +361,34 @@ class GlobalStitcher(stitcher.Stitcher):
     Base stitcher with the functions which need to be implemented.
     """
 
+    def __init__(self, rels, backtrack=False, view=False, processes=None,
+                 limits=None):
+        """
+        Initiate the stitcher.
+
+        :param rels: A dictionary defining what type of nodes in the request
+            must be stitched to what type of nodes in the container.
+        :param backtrack: If True the candidates are determined using a
+            backtracking search which applies the conditions while assigning
+            request nodes - instead of filtering the full product of all
+            possible stitches.
+        :param view: If True the resulting graphs are read-only views which
+            reference the container & request instead of copies of them.
+        :param processes: If set the combinations are split up & the
+            candidates determined by this number of worker processes. The
+            candidate filter needs to be picklable then.
+        :param limits: List of (validator, param) tuples - e.g.
+            [('incoming_edges', {'b': 5})]. Candidates the validators would
+            determine as bad stitches are dropped while searching (see
+            validators.capacity).
+        """
+        super(GlobalStitcher, self).__init__(rels, view=view)
+        self.backtrack = backtrack
+        self.processes = processes
+        self.limits = limits
+
     def stitch(self, container, request, conditions=None,
-               candidate_filter=my_filter):
+               candidate_filter=my_filter, index=None, stats=None):
         """
         Stitch a request graph into an existing graph container. Returns a set
         of possible options.
@@ -253,48 +400,222 @@ class GlobalStitcher(stitcher.Stitcher):
             to be related to node c.
         :param candidate_filter: Function which allows for filtering useless
             options upfront.
+        :param index: Optional ContainerIndex of the container - build it
+            once & reuse it when stitching many requests into one container.
+        :param stats: Optional profiling.Stats recording the time spend per
+            phase & the number of candidates.
         :return: The resulting graphs(s).
         """
-        res = []
-        # TODO: optimize this using concurrency & parallelism
+        return list(self.iter_stitch(container, request,
+                                     conditions=conditions,
+                                     candidate_filter=candidate_filter,
+                                     index=index, stats=stats))
+
+    def iter_stitch(self, container, request, conditions=None,
+                    candidate_filter=my_filter, index=None, stats=None):
+        """
+        Stitch a request graph into an existing graph container. Yields the
+        possible options one by one, so the caller can stop after the first
+        few. With the backtracking search the candidates are also determined
+        lazily - otherwise only the graphs are.
+
+        :param container: A graph describing the existing container with
+            ranks.
+        :param request: A graph describing the request.
+        :param conditions: Dictionary with conditions - e.g. node a & b need
+            to be related to node c.
+        :param candidate_filter: Function which allows for filtering useless
+            options upfront.
+        :param index: Optional ContainerIndex of the container.
+        :param stats: Optional profiling.Stats.
+        :return: Generator of the resulting graph(s).
+        """
+        stats = profiling.get(stats)
 
         # 1. find possible mappings
+        with stats.timer('mappings'):
+            if index is None:
+                index = indexing.ContainerIndex(container)
+            keys, per = self._mappings(request, index)
+
+            capacity = None
+            if self.limits:
+                capacity = validators.capacity(container, request,
+                                               self.limits)
+                if capacity is None:
+                    # no stitch can pass the validators.
+                    return
+
+        # 2. & 3. find (filtered) candidates
+        if self.processes:
+            candidate_edges = stats.iterate(
+                'search', self._parallel(keys, per, conditions,
+                                         candidate_filter, index, capacity),
+                'candidates')
+        elif self.backtrack:
+            candidate_edges = stats.iterate(
+                'search', self._search(container, keys, per, conditions,
+                                       candidate_filter, index, capacity),
+                'candidates')
+        else:
+            candidate_edges = self._product(container, keys, per, conditions,
+                                            candidate_filter, index, capacity,
+                                            stats)
+
+        # 4. create candidate containers
+        if self.view:
+            for item in candidate_edges:
+                with stats.timer('graphs'):
+                    graph = self._result(container, request, item)
+                stats.count('graphs')
+                yield graph
+            return
+        tmp_graph = nx.union(container, request)
+        for item in candidate_edges:
+            with stats.timer('graphs'):
+                candidate_graph = copy.deepcopy(tmp_graph)  # faster copy
+                # candidate_graph = tmp_graph.copy()
+                for src, trg in item:
+                    candidate_graph.add_edge(src, trg)
+            stats.count('graphs')
+            yield candidate_graph
+
+    def stitch_top_k(self, container, request, conditions=None, k=1,
+                     cost=rank_cost, index=None, stats=None):
+        """
+        Stitch a request graph into an existing graph container. Returns only
+        the k cheapest options - determined using a branch & bound search,
+        so the more expensive ones are mostly never looked at.
+
+        :param container: A graph describing the existing container with
+            ranks.
+        :param request: A graph describing the request.
+        :param conditions: Dictionary with conditions - e.g. node a & b need
+            to be related to node c.
+        :param k: Number of options to return (default 1).
+        :param cost: Function returning the cost of a stitch given the
+            container, the request node & the target node. The cost of an
+            option is the sum over its stitches (default: rank of the
+            targets).
+        :param index: Optional ContainerIndex of the container.
+        :param stats: Optional profiling.Stats.
+        :return: List of the resulting graph(s) - cheapest first.
+        """
+        stats = profiling.get(stats)
+        with stats.timer('mappings'):
+            if index is None:
+                index = indexing.ContainerIndex(container)
+            keys, per = self._mappings(request, index)
+            capacity = None
+            if self.limits:
+                capacity = validators.capacity(container, request,
+                                               self.limits)
+                if capacity is None:
+                    return []
+        with stats.timer('search'):
+            best = top_k(container, keys, per, conditions, k, cost, index,
+                         capacity)
+        stats.count('candidates', len(best))
+        with stats.timer('graphs'):
+            res = [self._result(container, request, edges)
+                   for _, edges in best]
+        stats.count('graphs', len(res))
+        return res
+
+    def _mappings(self, request, index):
+        """
+        Determine the request nodes to stitch & their possible targets.
+        """
         tmp = {}
         for node, attr in request.nodes(data=True):
             if attr[stitcher.TYPE_ATTR] in self.rels:
-                candidates = _find_nodes(container,
-                                         self.rels[attr[stitcher.TYPE_ATTR]])
-                for candidate in candidates:
-                    if node not in tmp:
-                        tmp[node] = [candidate]
-                    else:
-                        tmp[node].append(candidate)
-
-        # 2. find candidates
-        # dictionary so we have hashed keys (--> speed)
-        candidate_edges = {}
+                candidates = index.nodes(self.rels[attr[stitcher.TYPE_ATTR]])
+                if candidates:
+                    tmp[node] = list(candidates)
         keys = list(tmp.keys())
-        per = [tmp[key] for key in keys]
+        return keys, [tmp[key] for key in keys]
 
-        for edge_list in itertools.product(*per):
-            j = 0
-            edges = []
-            for item in edge_list:
-                edges.append((keys[j], item))
-                j += 1
-            if edges:
-                candidate_edges[str(edges)] = edges
-
-        # 3. (optional step): filter
-        candidate_edges = candidate_filter(container, candidate_edges,
-                                           conditions)
+    @staticmethod
+    def _product(container, keys, per, conditions, candidate_filter, index,
+                 capacity=None, stats=profiling.DISABLED):
+        """
+        Determine all combinations and filter them afterwards. The default
+        filter works on integer encoded candidates - see the vector module.
+        """
+        if candidate_filter is my_filter:
+            with stats.timer('product'):
+                matrix = vector.encode(per, index)
+            stats.count('candidates', len(matrix))
+            with stats.timer('filter'):
+                size = len(matrix)
+                matrix = vector.limit_filter(matrix, capacity, index)
+                matrix = vector.matrix_filter(container, keys, matrix,
+                                              conditions, index)
+            stats.count('filtered', size - len(matrix))
+            return vector.decode(keys, matrix, index)
 
-        # 4. create candidate containers
-        tmp_graph = nx.union(container, request)
-        for item in list(candidate_edges.values()):
-            candidate_graph = copy.deepcopy(tmp_graph)  # faster graph copy
-            # candidate_graph = tmp_graph.copy()
-            for src, trg in item:
-                candidate_graph.add_edge(src, trg)
-            res.append(candidate_graph)
+        # dictionary so we have hashed keys (--> speed)
+        with stats.timer('product'):
+            candidate_edges = {}
+            for edge_list in itertools.product(*per):
+                j = 0
+                edges = []
+                for item in edge_list:
+                    edges.append((keys[j], item))
+                    j += 1
+                if edges:
+                    candidate_edges[str(edges)] = edges
+        stats.count('candidates', len(candidate_edges))
+
+        # (optional step): filter
+        with stats.timer('filter'):
+            size = len(candidate_edges)
+            candidate_edges = candidate_filter(container, candidate_edges,
+                                               conditions)
+            res = [edges for edges in candidate_edges.values()
+                   if not capacity or validators.within(edges, capacity)]
+        stats.count('filtered', size - len(res))
         return res
+
+    def _parallel(self, keys, per, conditions, candidate_filter, index,
+                  capacity=None):
+        """
+        Split the combinations by the targets of the first request node and
+        determine the candidates of the shards in worker processes. Results
+        are merged in order of the shards - so they are the same as when
+        running in one process.
+        """
+        if not keys:
+            return
+        if isinstance(conditions, compiler.Plan):
+            # compiled plans can not be pickled.
+            conditions = conditions.conditions
+        size = -(-len(per[0]) // (self.processes * 4))
+        shards = [[per[0][i:i + size]] + per[1:]
+                  for i in range(0, len(per[0]), size)]
+        executor = futures.ProcessPoolExecutor(
+            self.processes, initializer=_init_worker,
+            initargs=(index, conditions, candidate_filter, self.backtrack,
+                      capacity))
+        try:
+            for edges in executor.map(_stitch_shard, itertools.repeat(keys),
+                                      shards):
+                yield from edges
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    @staticmethod
+    def _search(container, keys, per, conditions, candidate_filter, index,
+                capacity=None):
+        """
+        Lazily determine the candidates using the backtracking search. The
+        default filter is applied while searching - a custom one only sees the
+        full candidates, just like it would on the product.
+        """
+        if candidate_filter is my_filter:
+            yield from search(container, keys, per, conditions, index,
+                              capacity)
+            return
+        for edges in search(container, keys, per, None, index, capacity):
+            if candidate_filter(container, {str(edges): edges}, conditions):
+                yield edges
@@ -2,6 +2,11 @@
 contains validation routines.
 """
 
+import math
+
+import networkx as nx
+import numpy as np
+
 import stitcher
 
 
@@ -16,12 +21,13 @@ def validate_incoming_edges(graphs, param=None):
     for candidate in graphs:
         res[i] = 'ok'
         for node, values in candidate.nodes(data=True):
-            if values[stitcher.TYPE_ATTR] not in list(param.keys()):
+            if values[stitcher.TYPE_ATTR] not in param:
                 continue
             tmp = param[values[stitcher.TYPE_ATTR]]
-            if len(candidate.in_edges(node)) >= tmp:
+            degree = candidate.in_degree(node)
+            if degree >= tmp:
                 res[i] = 'node ' + str(node) + ' has to many edges: ' + \
-                         str(len(candidate.in_edges(node)))
+                         str(degree)
         i += 1
     return res
 
@@ -37,13 +43,249 @@ def validate_incoming_rank(graphs, param=None):
     for candidate in graphs:
         res[i] = 'ok'
         for node, values in candidate.nodes(data=True):
-            if values[stitcher.TYPE_ATTR] not in list(param.keys()):
+            if values[stitcher.TYPE_ATTR] not in param:
                 continue
             tmp = param[values[stitcher.TYPE_ATTR]]
-            if len(candidate.in_edges(node)) > tmp[0] \
+            if candidate.in_degree(node) > tmp[0] \
                     and values['rank'] >= tmp[1]:
                 res[i] = 'node ' + str(node) + ' rank is >= ' + \
                          str(tmp[1]) + ' and # incoming edges is > ' \
                          + str(tmp[0])
         i += 1
     return res
+
+
+def _limit(param, attrs, degree):
+    """
+    # of stitches a node can take before validate_incoming_edges fails.
+    """
+    return math.ceil(param[attrs[stitcher.TYPE_ATTR]]) - 1 - degree
+
+
+def _rank_limit(param, attrs, degree):
+    """
+    # of stitches a node can take before validate_incoming_rank fails - nodes
+    without a rank are not limited.
+    """
+    tmp = param[attrs[stitcher.TYPE_ATTR]]
+    if 'rank' not in attrs or attrs['rank'] < tmp[1]:
+        return None
+    return math.floor(tmp[0]) - degree
+
+
+_LIMITS = {'incoming_edges': _limit,
+           'incoming_rank': _rank_limit}
+
+
+def capacity(container, request, limits):
+    """
+    Turn validators into limits for the stitchers: determine how many stitches
+    each container node can take before one of the validators would
+    determine the candidate as a bad stitch.
+
+    :param container: A graph describing the existing container.
+    :param request: A graph describing the request.
+    :param limits: List of (validator, param) tuples - e.g.
+        [('incoming_edges', {'b': 5}), ('incoming_rank', {'a': (0, 3)})].
+    :return: dictionary of container node -> # of stitches it can take (only
+        for the limited nodes) or None if all candidates would fail anyway.
+    """
+    res = {}
+    for name, param in limits or []:
+        func = _LIMITS[name]
+        for graph in [container, request]:
+            for node, attrs in graph.nodes(data=True):
+                if attrs[stitcher.TYPE_ATTR] not in param:
+                    continue
+                tmp = func(param, attrs, graph.in_degree(node))
+                if tmp is None:
+                    continue
+                if tmp < 0:
+                    return None
+                if graph is container:
+                    res[node] = min(tmp, res.get(node, tmp))
+    return res
+
+
+def within(edges, cap):
+    """
+    Check if a list of stitches stays within the capacity of the nodes.
+
+    :param edges: List of stitches.
+    :param cap: Capacity of the nodes as determined by capacity().
+    """
+    used = {}
+    for _, trg in edges:
+        used[trg] = used.get(trg, 0) + 1
+        if trg in cap and used[trg] > cap[trg]:
+            return False
+    return True
+
+
+def stitches_of(candidate, container, request):
+    """
+    Return the stitches of a candidate graph - the edges which are neither in
+    the container nor in the request.
+    """
+    if getattr(candidate, 'stitches', None) is not None:
+        return candidate.stitches
+    return [(src, trg) for src, trg in candidate.edges()
+            if not container.has_edge(src, trg) and
+            not request.has_edge(src, trg)]
+
+
+class BatchValidator:
+    """
+    Validates many candidates in one go. All candidates share the container &
+    request and only differ in the stitches - so the in-degrees and ranks of
+    the nodes are determined once and only the contributions of the stitches
+    are added per candidate.
+
+    Gives the same results as the validate_* functions above.
+    """
+
+    def __init__(self, container, request):
+        """
+        Initiate the validator.
+
+        :param container: A graph describing the existing container.
+        :param request: A graph describing the request.
+        """
+        self.container = container
+        self.request = request
+        # same node order as the candidate graphs.
+        self.all = list(container.nodes()) + list(request.nodes())
+        self.ids = dict((node, i) for i, node in enumerate(self.all))
+        self.degrees = np.array([container.in_degree(node)
+                                 for node in container] +
+                                [request.in_degree(node)
+                                 for node in request], dtype=np.int64)
+        self.types = [attrs[stitcher.TYPE_ATTR]
+                      for _, attrs in container.nodes(data=True)] + \
+                     [attrs[stitcher.TYPE_ATTR]
+                      for _, attrs in request.nodes(data=True)]
+
+    def _encode(self, candidates):
+        """
+        Turn the candidates (graphs or lists of stitches) into a matrix with
+        the ids of the targets of the stitches - rows are padded with -1.
+        """
+        rows = []
+        for candidate in candidates:
+            if isinstance(candidate, nx.Graph):
+                candidate = stitches_of(candidate, self.container,
+                                        self.request)
+            row = []
+            for src, trg in dict.fromkeys(candidate):
+                if self.container.has_edge(src, trg) or \
+                        self.request.has_edge(src, trg):
+                    continue
+                row.append(self.ids[trg])
+            rows.append(row)
+        width = max([len(row) for row in rows] or [0])
+        matrix = np.full((len(rows), width), -1, dtype=np.int64)
+        for i, row in enumerate(rows):
+            matrix[i, :len(row)] = row
+        return matrix
+
+    def _thresholds(self, param, pick):
+        """
+        Array with a threshold per node - NaN for nodes not in param.
+        """
+        return np.array([pick(param[tzpe]) if tzpe in param else np.nan
+                         for tzpe in self.types], dtype=float)
+
+    def _last(self, matrix, bad, bad_degrees):
+        """
+        Determine the last node (in node order) which fails per candidate - -1
+        if there is none - and its in-degree.
+
+        :param matrix: The stitch target matrix.
+        :param bad: Function telling which nodes fail given their ids and
+            in-degrees.
+        :param bad_degrees: Mask of the nodes which fail without stitches.
+        """
+        # in-degree of the targets: own degree + # of stitches on it.
+        same = matrix[:, :, None] == matrix[:, None, :]
+        degrees = self.degrees[matrix] + same.sum(axis=2)
+        failed = (matrix >= 0) & bad(matrix, degrees)
+        last = np.where(failed, matrix, -1).max(axis=1, initial=-1)
+        tmp = np.flatnonzero(bad_degrees)
+        if len(tmp):
+            last = np.maximum(last, tmp[-1])
+        degrees = self.degrees[np.maximum(last, 0)] + \
+            (matrix == last[:, None]).sum(axis=1)
+        return last, degrees
+
+    def validate_incoming_edges(self, candidates, param=None):
+        """
+        Batch version of validate_incoming_edges().
+
+        :param candidates: List of candidate graphs or lists of stitches.
+        :param param: dictionary of type -> threshold.
+        :return: dictionary of candidate # -> 'ok' or a message.
+        """
+        param = param or {}
+        matrix = self._encode(candidates)
+        limit = self._thresholds(param, lambda item: item)
+
+        def bad(ids, degrees):
+            with np.errstate(invalid='ignore'):
+                return degrees >= limit[ids]
+
+        with np.errstate(invalid='ignore'):
+            last, degrees = self._last(matrix, bad, self.degrees >= limit)
+        res = {}
+        for i, (node, degree) in enumerate(zip(last.tolist(),
+                                               degrees.tolist())):
+            if node < 0:
+                res[i] = 'ok'
+            else:
+                res[i] = 'node %s has to many edges: %s' % \
+                         (self.all[node], degree)
+        return res
+
+    def validate_incoming_rank(self, candidates, param=None):
+        """
+        Batch version of validate_incoming_rank().
+
+        :param candidates: List of candidate graphs or lists of stitches.
+        :param param: dictionary of type -> (# of incoming edges, rank).
+        :return: dictionary of candidate # -> 'ok' or a message.
+        """
+        param = param or {}
+        matrix = self._encode(candidates)
+        limit = self._thresholds(param, lambda item: item[0])
+        ranked = np.zeros(len(self.all), dtype=bool)
+        missing = np.zeros(len(self.all), dtype=bool)
+        for i, node in enumerate(self.all):
+            if self.types[i] not in param:
+                continue
+            attrs = self.container.nodes[node] if node in self.container \
+                else self.request.nodes[node]
+            if 'rank' in attrs:
+                ranked[i] = attrs['rank'] >= param[self.types[i]][1]
+            else:
+                missing[i] = True
+
+        def bad(ids, degrees):
+            with np.errstate(invalid='ignore'):
+                tmp = degrees > limit[ids]
+            if (tmp & missing[ids]).any():
+                raise KeyError('rank')
+            return tmp & ranked[ids]
+
+        with np.errstate(invalid='ignore'):
+            tmp = self.degrees > limit
+        if len(matrix) and (tmp & missing).any():
+            raise KeyError('rank')
+        last, _ = self._last(matrix, bad, tmp & ranked)
+        res = {}
+        for i, node in enumerate(last.tolist()):
+            if node < 0:
+                res[i] = 'ok'
+            else:
+                tmp = param[self.types[node]]
+                res[i] = 'node %s rank is >= %s and # incoming edges is > ' \
+                         '%s' % (self.all[node], tmp[1], tmp[0])
+        return res
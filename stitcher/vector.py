@@ -0,0 +1,189 @@
+"""
+Integer encoded candidates & vectorized filters for the global stitcher.
+
+A candidate is a row of a matrix with one column per request node - the
+values are the ids the container nodes have in the ContainerIndex. The
+filters work on whole columns instead of one candidate at a time.
+"""
+
+import numpy as np
+
+from stitcher import compiler
+from stitcher import indexing
+
+
+def encode(domains, index):
+    """
+    Encode all combinations of the domains as a matrix of container node ids.
+    The rows are in the same order as itertools.product would create them.
+
+    :param domains: List with the list of possible targets per request node.
+    :param index: ContainerIndex of the container.
+    :return: int32 matrix of shape [n_candidates, n_request_nodes].
+    """
+    if not domains:
+        return np.empty((0, 0), dtype=np.int32)
+    ids = [np.array([index.ids[trg] for trg in domain], dtype=np.int32)
+           for domain in domains]
+    grid = np.indices([len(item) for item in ids], dtype=np.int32)
+    grid = grid.reshape(len(ids), -1)
+    return np.stack([ids[j][grid[j]] for j in range(len(ids))], axis=1)
+
+
+def decode(keys, matrix, index):
+    """
+    Turn the rows of the matrix back into lists of (request node, container
+    node) edges.
+
+    :param keys: The request nodes - one per column.
+    :param matrix: The candidate matrix.
+    :param index: ContainerIndex of the container.
+    :return: Generator of edge lists.
+    """
+    for row in matrix.tolist():
+        yield [(keys[j], index.all[i]) for j, i in enumerate(row)]
+
+
+def matrix_filter(container, keys, matrix, conditions, index):
+    """
+    Vectorized version of stitch.my_filter - removes the rows of the candidate
+    matrix which do not adhere the conditions.
+
+    :param container: A graph describing the existing container.
+    :param keys: The request nodes - one per column.
+    :param matrix: The candidate matrix as created by encode().
+    :param conditions: dictionary containing the conditions (or a compiled
+        plan of the same).
+    :param index: ContainerIndex of the container.
+    :return: The filtered matrix.
+    """
+    if conditions is None or not matrix.shape[0]:
+        return matrix
+    columns = dict((key, j) for j, key in enumerate(keys))
+    mask = np.ones(len(matrix), dtype=bool)
+    for check, func in compiler.compile_conditions(conditions).bind(_FILTERS):
+        tmp = func(check, container, columns, matrix, index)
+        if tmp is not None:
+            mask &= tmp
+    return matrix[mask]
+
+
+def limit_filter(matrix, capacity, index):
+    """
+    Remove the rows of the candidate matrix which stitch more request nodes
+    to a container node than it can take.
+
+    :param matrix: The candidate matrix as created by encode().
+    :param capacity: dictionary of container node -> # of stitches it can
+        take (see validators.capacity).
+    :param index: ContainerIndex of the container.
+    :return: The filtered matrix.
+    """
+    if not capacity or not matrix.shape[0]:
+        return matrix
+    limit = np.full(len(index.all), matrix.shape[1], dtype=np.int64)
+    for node, tmp in capacity.items():
+        limit[index.ids[node]] = tmp
+    used = (matrix[:, :, None] == matrix[:, None, :]).sum(axis=2)
+    return matrix[(used <= limit[matrix]).all(axis=1)]
+
+
+def _numeric_test(check, values, valid):
+    """
+    Evaluate an attribute condition on a numeric column - mirrors the checks
+    in the compiler module (so e.g. NaN behaves the same).
+    """
+    attrv = check.attrv
+    if check.operator == 'eq':
+        return valid & ~(values != attrv)
+    if check.operator == 'neq':
+        return ~(valid & (values == attrv))
+    if check.operator == 'lg':
+        return valid & ~(values <= attrv)
+    if check.operator == 'lt':
+        return valid & ~(values > attrv)
+    if check.operator == 'gt':
+        return valid & ~(values < attrv)
+    return None
+
+
+def _attr_filter(check, container, columns, matrix, index):
+    """
+    Filter on attributes needed on target node. Numeric attributes are
+    compared on the columns of the index - for all others the container nodes
+    in the matrix are checked one by one.
+    """
+    if check.node not in columns:
+        return None
+    col = matrix[:, columns[check.node]]
+    valid = None
+    column = index.column(check.attrn)
+    if column is not None and indexing.is_number(check.attrv):
+        valid = _numeric_test(check, *column)
+    if valid is None:
+        valid = np.zeros(len(index.all), dtype=bool)
+        for i in np.unique(col).tolist():
+            valid[i] = check.test(container.nodes[index.all[i]]) == \
+                compiler.OK
+    return valid[col]
+
+
+def _same_filter(check, _, columns, matrix, __):
+    """
+    Targets of the two request nodes need to be the same.
+    """
+    node1, node2 = check.nodes[:2]
+    if node1 == node2 or node1 not in columns or node2 not in columns:
+        return None
+    return matrix[:, columns[node1]] == matrix[:, columns[node2]]
+
+
+def _diff_filter(check, _, columns, matrix, __):
+    """
+    Targets of the two request nodes need to be different.
+    """
+    node1, node2 = check.nodes[:2]
+    if node1 == node2 or node1 not in columns or node2 not in columns:
+        return None
+    return matrix[:, columns[node1]] != matrix[:, columns[node2]]
+
+
+def _shared_attr(check, columns, matrix, index, share):
+    """
+    All targets need to have the attribute - the targets of the request nodes
+    in the list are compared to the first (non empty) value found.
+    """
+    codes, empty = index.codes(check.attrn)
+    values = codes[matrix]
+    mask = (values >= 0).all(axis=1)
+    attrv = np.full(len(matrix), empty, dtype=np.int64)
+    # columns are in the order of the edges of a candidate.
+    for key, j in sorted(columns.items(), key=lambda item: item[1]):
+        if key not in check.members:
+            continue
+        undecided = attrv == empty
+        if share:
+            mask &= undecided | (values[:, j] == attrv)
+        else:
+            mask &= undecided | (values[:, j] != attrv)
+        attrv = np.where(undecided, values[:, j], attrv)
+    return mask
+
+
+def _share_attr(check, _, columns, matrix, index):
+    """
+    Targets of the request nodes in the list need to share an attribute value.
+    """
+    return _shared_attr(check, columns, matrix, index, True)
+
+
+def _nshare_attr(check, _, columns, matrix, index):
+    """
+    Targets of the request nodes in the list need to differ in an attribute
+    value.
+    """
+    return _shared_attr(check, columns, matrix, index, False)
+
+
+_FILTERS = compiler.evaluators(_attr_filter, _same_filter, _diff_filter,
+                               _share_attr, _nshare_attr)
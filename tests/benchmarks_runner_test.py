@@ -0,0 +1,109 @@
+"""
+Unittest for the benchmarks.
+"""
+
+import unittest
+
+import stitcher
+
+from benchmarks import generators
+from benchmarks import runner
+
+
+class GeneratorsTest(unittest.TestCase):
+    """
+    Testcase for the generators.
+    """
+
+    def test_scenario_for_success(self):
+        """
+        Test scenario generation for success.
+        """
+        scenario = generators.scenario(10, 3, types=2,
+                                       mix={'lt': 1, 'diff': 1,
+                                            'share': 1, 'regex': 1})
+        self.assertEqual(len(scenario['container']), 10)
+        self.assertEqual(len(scenario['request']), 3)
+        self.assertEqual(scenario['name'],
+                         'c10-r3-t2-diff1-lt1-regex1-share1')
+        self.assertEqual(len(scenario['conditions']['attributes']), 2)
+        self.assertEqual(len(scenario['conditions']['compositions']), 2)
+
+    def test_scenario_for_failure(self):
+        """
+        Test scenario generation for failure - unknown distributions.
+        """
+        self.assertRaises(ValueError, generators.container, 5,
+                          attributes={'rank': ('poisson', 1)})
+
+    def test_scenario_for_sanity(self):
+        """
+        Test scenario generation for sanity - same seed, same scenario.
+        """
+        one = generators.scenario(20, 4, mix={'lg': 2}, seed=1)
+        two = generators.scenario(20, 4, mix={'lg': 2}, seed=1)
+        self.assertEqual(list(one['container'].nodes(data=True)),
+                         list(two['container'].nodes(data=True)))
+        self.assertEqual(list(one['container'].edges()),
+                         list(two['container'].edges()))
+        self.assertEqual(one['conditions'], two['conditions'])
+        for _, attrs in one['request'].nodes(data=True):
+            self.assertIn(attrs[stitcher.TYPE_ATTR], one['rels'])
+
+
+class RunnerTest(unittest.TestCase):
+    """
+    Testcase for the runner.
+    """
+
+    def setUp(self):
+        self.scenario = generators.scenario(8, 2, mix={'diff': 1})
+
+    def test_run_for_success(self):
+        """
+        Test run for success.
+        """
+        res = runner.run([self.scenario], ['global', 'exact'])
+        self.assertEqual([item['algorithm'] for item in res],
+                         ['global', 'exact'])
+        for item in res:
+            self.assertEqual(item['search_space'], 9)
+            self.assertEqual(item['valid'], item['results'])
+            self.assertTrue(item['explored'] > 0)
+        # the exact stitcher finds the cheapest stitch.
+        self.assertEqual(res[0]['cost'], res[1]['cost'])
+        self.assertIn('exact', runner.report(res))
+
+    def test_run_for_failure(self):
+        """
+        Test run for failure - exhaustive algorithms are skipped for large
+        search spaces.
+        """
+        res = runner.run([self.scenario], ['global', 'repair'], max_space=5)
+        self.assertTrue(res[0]['skipped'])
+        self.assertNotIn('skipped', res[1])
+
+        # runs taking too long are recorded as errors.
+        res = runner.run([self.scenario], ['repair', 'global'], timeout=0)
+        self.assertTrue(res[0]['error'].startswith('TimeoutError'))
+        self.assertEqual(len(res), 2)
+        res = runner.run([self.scenario], ['repair'], timeout=60)
+        self.assertNotIn('error', res[0])
+        self.assertEqual(res[0]['valid'], res[0]['results'])
+
+    def test_compare_for_sanity(self):
+        """
+        Test compare for sanity - slow downs, fewer valid results, higher
+        costs & errors are regressions.
+        """
+        old = [{'scenario': 'a', 'algorithm': 'x', 'time': 1.0, 'valid': 2,
+                'cost': 3}]
+        new = [{'scenario': 'a', 'algorithm': 'x', 'time': 1.1, 'valid': 2,
+                'cost': 3}]
+        self.assertEqual(runner.compare(old, new), [])
+        new[0].update({'time': 2.0, 'valid': 1, 'cost': 4})
+        self.assertEqual(len(runner.compare(old, new)), 3)
+        self.assertEqual(runner.compare(old, [{'scenario': 'a',
+                                               'algorithm': 'x',
+                                               'error': 'KeyError: 1'}]),
+                         ['x on a: KeyError: 1'])
@@ -2,12 +2,15 @@
 Unittest for the bidding module.
 """
 
+import asyncio
 import logging
+import random
 import unittest
 
 import networkx as nx
 
 from stitcher import bidding
+from stitcher import profiling
 
 FORMAT = "%(asctime)s - %(filename)s - %(lineno)s - " \
          "%(levelname)s - %(message)s"
@@ -211,6 +214,125 @@ class EntityTest(unittest.TestCase):
         self.assertEqual(res['a'][1], 1.0)  # a sits fine on x
         self.assertEqual(res['a'][0], 'x')  # a should be stitched to x
 
+    def test_entity_for_sanity(self):
+        """
+        Test the lookup of entities by name for sanity.
+        """
+        cut = bidding.Entity('x', self.map, self.request, self.container)
+        self.container.add_node(cut, **self.x_attr)
+        self.assertIs(bidding._entity(self.container, 'x'), cut)
+        # map is updated when nodes are added.
+        other = bidding.Entity('y', self.map, self.request, self.container)
+        self.container.add_node(other, **self.y_attr)
+        self.assertIs(bidding._entity(self.container, 'y'), other)
+        self.assertEqual(len(self.container.graph[bidding.ENTITIES]), 2)
+        self.assertRaises(KeyError, bidding._entity, self.container, 'z')
+
+    def test_share_for_sanity(self):
+        """
+        Test the sub stitches of the share condition for sanity - the key of
+        a group's sub stitch is calculated once per bidding round.
+        """
+        condy = {'compositions': [('share', ('group_1', ['a', 'b']))]}
+        stats = profiling.Stats()
+        cut_x = bidding.Entity('x', self.map, self.request, self.container,
+                               condy, stats=stats)
+        cut_y = bidding.Entity('y', self.map, self.request, self.container,
+                               condy, stats=stats)
+        self.container.add_node(cut_x, **self.x_attr)
+        self.container.add_node(cut_y, **self.y_attr)
+        self.container.add_edge(cut_x, cut_y)
+        bidding.CACHE.clear()
+        cut_x.trigger({'assigned': {}, 'bids': []}, 'init')
+        keys = self.container.graph[bidding.SUB_STITCHES]
+        self.assertEqual(sorted(sorted(group[-1]) for group in keys),
+                         [['x'], ['x', 'y']])
+        self.assertEqual(stats.counts['sub_stitches'], 4)
+        self.assertEqual(bidding.CACHE.misses, len(keys))
+
+    def test_coalesce_for_sanity(self):
+        """
+        Test merging pending messages for sanity - the newer bids win.
+        """
+        old = {'changed': {'x': (1, {'a': 1.0}), 'y': (1, {'b': 1.0})},
+               'assigned': {}}
+        new = {'changed': {'x': (2, {'a': 2.0})}, 'assigned': {}}
+        self.assertEqual(bidding._coalesce(old, new)['changed'],
+                         {'x': (2, {'a': 2.0}), 'y': (1, {'b': 1.0})})
+        old = {'bids': {'x': {'a': 1.0}}, 'versions': {'x': 1},
+               'assigned': {}}
+        new = {'bids': {'x': {'a': 2.0}}, 'versions': {'x': 2},
+               'assigned': {}}
+        self.assertIs(bidding._coalesce(old, new), new)
+
+    def test_message_for_sanity(self):
+        """
+        Test the messages in delta mode for sanity.
+        """
+        cut_x = bidding.Entity('x', self.map, self.request, self.container,
+                               delta=True)
+        cut_y = bidding.Entity('y', self.map, self.request, self.container,
+                               delta=True)
+        self.container.add_node(cut_x, **self.x_attr)
+        self.container.add_node(cut_y, **self.y_attr)
+        self.container.add_edge(cut_x, cut_y)
+
+        # first message contains my bids with their version.
+        cut_x._calc_credits({})
+        msg = cut_x._message(cut_y, {})
+        self.assertEqual(msg['changed'], {'x': (1, {'a': 1.0})})
+        # nothing changed - nothing to tell.
+        self.assertEqual(cut_x._message(cut_y, {})['changed'], {})
+
+        # only the bids not known to the receiver are send back.
+        cut_y._receive(msg, 'x')
+        msg = cut_y._message(cut_x, {})
+        self.assertEqual(list(msg['changed']), ['y'])
+
+        # older versions are ignored.
+        self.assertTrue(cut_y._receive({'changed': {'x': (0, {})},
+                                        'assigned': {}}, 'x')[1])
+        self.assertEqual(cut_y.bids['x'], {'a': 1.0})
+
+
+class SubStitchCacheTest(unittest.TestCase):
+    """
+    Testcase for the SubStitchCache class.
+    """
+
+    def setUp(self):
+        self.cut = bidding.SubStitchCache(maxsize=2)
+
+    def test_get_for_success(self):
+        """
+        Test lookups for success.
+        """
+        self.cut.put('a', {'x': 1})
+        self.assertEqual(self.cut.get('a'), {'x': 1})
+
+    def test_get_for_failure(self):
+        """
+        Test lookups for failure - unknown keys.
+        """
+        self.assertIsNone(self.cut.get('a'))
+        self.assertEqual(self.cut.misses, 1)
+
+    def test_get_for_sanity(self):
+        """
+        Test lookups for sanity - least recently used ones are dropped.
+        """
+        self.cut.put('a', 1)
+        self.cut.put('b', 2)
+        self.cut.get('a')
+        self.cut.put('c', 3)
+        self.assertEqual(len(self.cut), 2)
+        self.assertIsNone(self.cut.get('b'))
+        self.assertEqual(self.cut.get('a'), 1)
+        self.assertEqual((self.cut.hits, self.cut.misses), (2, 1))
+        self.cut.clear()
+        self.assertEqual((len(self.cut), self.cut.hits, self.cut.misses),
+                         (0, 0, 0))
+
 
 class BiddingStitcherTest(unittest.TestCase):
     """
@@ -243,6 +365,21 @@ class BiddingStitcherTest(unittest.TestCase):
         """
         self.cut.stitch(self.container, self.request)
 
+    def test_stitch_for_failure(self):
+        """
+        Test stitching for failure - containers too deep to trigger the
+        entities recursively are stitched using a queue.
+        """
+        container = nx.relabel_nodes(
+            nx.path_graph(3000, create_using=nx.DiGraph), str)
+        nx.set_node_attributes(container, 'type_c', 'type')
+        container.nodes['0']['type'] = 'type_a'
+        container.nodes['2999']['type'] = 'type_b'
+        res = self.cut.stitch(container, self.request, start='0')
+        self.assertIn(('X', '0'), res[0].edges())
+        self.assertIn(('Y', '2999'), res[0].edges())
+        self.assertIn(('Z', '2999'), res[0].edges())
+
     def test_stitch_for_sanity(self):
         """
         Test stitching for sanity
@@ -292,3 +429,222 @@ class BiddingStitcherTest(unittest.TestCase):
                                   start=node)
             self.assertIn(('1', 'Y'), res[0].edges())
             self.assertIn(('2', 'X'), res[0].edges())
+
+        # sub stitches are cached by content - not by graph identity.
+        bidding.CACHE.clear()
+        self.cut.stitch(container, request, conditions=condy)
+        misses = bidding.CACHE.misses
+        self.assertTrue(misses > 0)
+        res = self.cut.stitch(container, request, conditions=condy)
+        self.assertEqual(bidding.CACHE.misses, misses)
+        self.assertTrue(bidding.CACHE.hits > 0)
+        self.assertIn(('1', 'Y'), res[0].edges())
+
+    def _livelock(self):
+        """
+        Container, request & conditions on which the bidding used to never
+        settle when the messages were queued.
+        """
+        container = nx.DiGraph()
+        for node, typ, rank, group in [('0', 'type_a', 3, 'g2'),
+                                       ('1', 'type_b', 2, 'g2'),
+                                       ('2', 'type_b', 5, 'g1'),
+                                       ('3', 'type_a', 2, 'g1'),
+                                       ('4', 'type_a', 1, 'g1'),
+                                       ('5', 'type_a', 1, 'g1'),
+                                       ('6', 'type_b', 5, 'g1')]:
+            container.add_node(node, type=typ, rank=rank, group=group)
+        container.add_edges_from([('1', '0'), ('2', '0'), ('3', '1'),
+                                  ('4', '1'), ('5', '1'), ('6', '0')])
+        request = nx.DiGraph()
+        request.add_node('r0', type='type_y')
+        request.add_node('r1', type='type_y')
+        return container, request, {'compositions': [('diff',
+                                                      ('r0', 'r1'))]}
+
+    def test_stitch_queue_for_success(self):
+        """
+        Test stitching with queued messages for success - settles with the
+        same result as the recursive triggering.
+        """
+        container, request, condy = self._livelock()
+        res = self.cut.stitch(container, request, conditions=condy)
+        self.cut = bidding.BiddingStitcher(self.cut.rels, mode='queue',
+                                           max_messages=None)
+        self.assertEqual(list(self.cut.stitch(container, request,
+                                              conditions=condy)[0].edges()),
+                         list(res[0].edges()))
+        self.assertIn(('r0', '1'), res[0].edges())
+        self.assertIn(('r1', '2'), res[0].edges())
+
+    def test_stitch_queue_for_failure(self):
+        """
+        Test stitching with queued messages for failure - the bidding stops
+        when the maximum number of messages is reached & no (incomplete)
+        stitch is returned.
+        """
+        container, request, condy = self._livelock()
+        for mode in bidding.MODES:
+            self.cut = bidding.BiddingStitcher(self.cut.rels, mode=mode,
+                                               max_messages=3)
+            self.assertEqual(self.cut.stitch(container, request,
+                                             conditions=condy), [])
+        # by default the budget depends on the size of the container.
+        self.cut = bidding.BiddingStitcher(self.cut.rels)
+        entity = self.cut._entities(container, request, condy, None, None)
+        self.assertEqual(entity.max_messages,
+                         bidding.MESSAGES_PER_PAIR * 7 ** 2)
+
+    def test_stitch_cache_for_sanity(self):
+        """
+        Test stitching with cached sub stitches for sanity - requests with
+        the same node names but other types do not share sub stitches.
+        """
+        container = nx.DiGraph()
+        for node, typ, rank, group in [('c0', 'type_a', 2, 'z'),
+                                       ('c1', 'type_b', 1, 'y'),
+                                       ('c2', 'type_a', 1, 'y'),
+                                       ('c3', 'type_b', 7, 'y'),
+                                       ('c4', 'type_a', 10, 'y'),
+                                       ('c5', 'type_b', 3, 'x'),
+                                       ('c6', 'type_a', 7, 'x')]:
+            container.add_node(node, type=typ, rank=rank, group=group)
+        container.add_edges_from([('c0', 'c1'), ('c0', 'c4'), ('c0', 'c2'),
+                                  ('c0', 'c5'), ('c1', 'c2'), ('c1', 'c4'),
+                                  ('c1', 'c3'), ('c2', 'c3'), ('c2', 'c6'),
+                                  ('c3', 'c5'), ('c4', 'c0'), ('c5', 'c6')])
+        one = nx.DiGraph()
+        one.add_node('r0', type='type_x')
+        one.add_node('r1', type='type_y')
+        one.add_edge('r0', 'r1')
+        other = one.copy()
+        other.nodes['r1']['type'] = 'type_x'
+        condy = {'compositions': [('share', ('group', ['r0', 'r1']))]}
+
+        bidding.CACHE.clear()
+        res = self.cut.stitch(container, other, conditions=condy)
+        bidding.CACHE.clear()
+        self.cut.stitch(container, one, conditions=condy)
+        self.assertEqual(list(self.cut.stitch(container, other,
+                                              conditions=condy)[0].edges()),
+                         list(res[0].edges()))
+        self.assertIn(('r0', 'c0'), res[0].edges())
+        self.assertIn(('r1', 'c0'), res[0].edges())
+
+    def test_stitch_queue_for_sanity(self):
+        """
+        Test stitching with queued messages for sanity - same results as the
+        recursive triggering, but no limit on the size of the container.
+        """
+        self.cut = bidding.BiddingStitcher(self.cut.rels, mode='queue')
+        self.test_stitch_for_sanity()
+
+        container = nx.relabel_nodes(
+            nx.path_graph(3000, create_using=nx.DiGraph), str)
+        nx.set_node_attributes(container, 'type_c', 'type')
+        container.nodes['0']['type'] = 'type_a'
+        container.nodes['2999']['type'] = 'type_b'
+        res = self.cut.stitch(container, self.request, start='0')
+        self.assertIn(('X', '0'), res[0].edges())
+        self.assertIn(('Y', '2999'), res[0].edges())
+        self.assertIn(('Z', '2999'), res[0].edges())
+
+    def test_init_for_failure(self):
+        """
+        Test initialization for failure - unknown mode.
+        """
+        self.assertRaises(ValueError, bidding.BiddingStitcher,
+                          self.cut.rels, mode='foo')
+
+    def test_stitch_async_for_success(self):
+        """
+        Test stitching with entities running as asyncio tasks for success -
+        the bidding settles with all request nodes stitched.
+        """
+        self.cut = bidding.BiddingStitcher(self.cut.rels, mode='async')
+        condy = {'attributes': [('lg', ('X', ('rank', 1)))]}
+        for seed in range(10):
+            rnd = random.Random(seed)
+            container = nx.relabel_nodes(
+                nx.gnm_random_graph(8 + seed, 12 + seed, seed=seed,
+                                    directed=True), str)
+            for node in container:
+                container.nodes[node]['type'] = ['type_a',
+                                                 'type_b'][int(node) % 2]
+                container.nodes[node]['rank'] = rnd.randint(1, 5)
+            best = max(container.nodes[node]['rank'] for node in container
+                       if container.nodes[node]['type'] == 'type_a')
+            for res in [self.cut.stitch(container, self.request,
+                                        conditions=condy),
+                        asyncio.run(self.cut.stitch_async(
+                            container, self.request, conditions=condy))]:
+                stitches = dict(edge for edge in res[0].edges()
+                                if edge[0] in self.request)
+                self.assertEqual(sorted(stitches), ['X', 'Y', 'Z'])
+                self.assertEqual(container.nodes[stitches['X']]['rank'],
+                                 best)
+                self.assertEqual(container.nodes[stitches['Y']]['type'],
+                                 'type_b')
+
+    def test_stitch_async_for_sanity(self):
+        """
+        Test stitching with entities running as asyncio tasks for sanity.
+        """
+        self.cut = bidding.BiddingStitcher(self.cut.rels, mode='async')
+        self.test_stitch_for_sanity()
+
+        # within a running event loop.
+        res = asyncio.run(self.cut.stitch_async(self.container, self.request,
+                                                start='C'))
+        self.assertIn(('X', 'A'), res[0].edges())
+        self.assertIn(('Y', 'B'), res[0].edges())
+        self.assertIn(('Z', 'B'), res[0].edges())
+
+    def test_stitch_async_for_failure(self):
+        """
+        Test stitching with entities running as asyncio tasks for failure -
+        errors of the entities are raised.
+        """
+        self.cut = bidding.BiddingStitcher(self.cut.rels, mode='async')
+        condy = {'attributes': [('lg', ('X', ('rank', 1)))]}
+        self.assertRaises(KeyError, self.cut.stitch, self.container,
+                          self.request, conditions=condy)
+
+        # stitch() runs the event loop - so not within a running one.
+        async def nested():
+            return self.cut.stitch(self.container, self.request)
+        self.assertRaises(RuntimeError, asyncio.run, nested())
+
+    def test_stitch_delta_for_success(self):
+        """
+        Test stitching with messages containing only changed bids for success
+        - same results as with messages containing all bids.
+        """
+        condy = {'attributes': [('lg', ('X', ('rank', 1)))],
+                 'compositions': [('diff', ('Y', 'Z'))]}
+        for seed in range(20):
+            rnd = random.Random(seed)
+            container = nx.gnm_random_graph(6 + seed % 5, 8 + seed % 5,
+                                            seed=seed, directed=True)
+            for node in container:
+                container.nodes[node]['type'] = rnd.choice(['type_a',
+                                                            'type_b'])
+                container.nodes[node]['rank'] = rnd.randint(1, 5)
+            res = []
+            for delta in [False, True]:
+                self.cut = bidding.BiddingStitcher(self.cut.rels,
+                                                   mode='queue', delta=delta,
+                                                   max_messages=2000)
+                res.append([list(item.edges()) for item in
+                            self.cut.stitch(container, self.request,
+                                            conditions=condy)])
+            self.assertEqual(res[0], res[1])
+
+    def test_stitch_delta_for_sanity(self):
+        """
+        Test stitching with messages containing only changed bids for sanity.
+        """
+        for mode in bidding.MODES:
+            self.cut = bidding.BiddingStitcher(self.cut.rels, mode=mode,
+                                               delta=True)
+            self.test_stitch_for_sanity()
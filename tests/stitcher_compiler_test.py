@@ -0,0 +1,247 @@
+"""
+Unittest for the compiler module.
+"""
+
+import itertools
+import unittest
+
+import networkx as nx
+
+from stitcher import bidding
+from stitcher import compiler
+from stitcher import evolutionary
+from stitcher import exact
+from stitcher import indexing
+from stitcher import iterative_repair
+from stitcher import stitch
+from stitcher import vector
+
+
+def _feasible(model, edges):
+    """
+    Check if a stitch satisfies the constraints of a model.
+    """
+    if any(edge not in model.ids for edge in edges):
+        return False
+    chosen = set(model.ids[edge] for edge in edges)
+    return all(sum(coef for var, coef in coefficients if var in chosen) <=
+               bound for coefficients, bound in model.rows)
+
+
+class AttributeTestTest(unittest.TestCase):
+    """
+    Testcase for the attribute tests.
+    """
+
+    def setUp(self):
+        self.attrs = {'foo': 5, 'bar': 'abc'}
+
+    def test_attribute_test_for_success(self):
+        """
+        Test creating the tests for success.
+        """
+        for cond in compiler.ATTRIBUTE_CONDITIONS:
+            self.assertIsNotNone(compiler.attribute_test(cond, 'bar', 'a'))
+
+    def test_attribute_test_for_failure(self):
+        """
+        Test creating the tests for failure.
+        """
+        self.assertIsNone(compiler.attribute_test('same', 'foo', 1))
+
+    def test_attribute_test_for_sanity(self):
+        """
+        Test the tests for sanity.
+        """
+        res = [(('eq', 'foo', 5), compiler.OK),
+               (('eq', 'foo', 4), compiler.MISMATCH),
+               (('eq', 'xyz', 5), compiler.MISSING),
+               (('neq', 'foo', 5), compiler.MISMATCH),
+               (('neq', 'foo', 4), compiler.OK),
+               (('neq', 'xyz', 5), compiler.OK),
+               (('lg', 'foo', 4), compiler.OK),
+               (('lg', 'foo', 5), compiler.MISMATCH),
+               (('lg', 'xyz', 5), compiler.MISSING),
+               (('lt', 'foo', 5), compiler.OK),
+               (('lt', 'foo', 4), compiler.MISMATCH),
+               (('gt', 'foo', 5), compiler.OK),
+               (('gt', 'foo', 6), compiler.MISMATCH),
+               (('regex', 'bar', '^a'), compiler.OK),
+               (('regex', 'bar', '^b'), compiler.MISMATCH),
+               (('regex', 'xyz', '^b'), compiler.MISSING)]
+        for param, status in res:
+            self.assertEqual(compiler.attribute_test(*param)(self.attrs),
+                             status, param)
+
+
+class PlanTest(unittest.TestCase):
+    """
+    Testcase for the compiled plans.
+    """
+
+    def setUp(self):
+        self.cond = {
+            'attributes': [('eq', ('a', ('foo', 'y'))),
+                           ('regex', ('b', ('foo', '^a'))),
+                           ('foo', ('b', ('foo', 'bar')))],
+            'compositions': [('same', ('1', '2')),
+                             ('share', ('group', ['a', 'b'])),
+                             ('nshare', ('group', ['a', '1']))]
+        }
+
+    def test_compile_for_success(self):
+        """
+        Test compile for success.
+        """
+        compiler.compile_conditions(self.cond)
+        compiler.compile_conditions(None)
+
+    def test_compile_for_sanity(self):
+        """
+        Test compile for sanity.
+        """
+        plan = compiler.compile_conditions(self.cond)
+        # unknown conditions are dropped.
+        self.assertEqual(len(plan.attributes), 2)
+        self.assertEqual(len(plan.compositions), 3)
+        self.assertIs(compiler.compile_conditions(plan), plan)
+        self.assertEqual(plan.compositions[1].members, {'a', 'b'})
+        self.assertEqual(plan.compositions[1].attrn, 'group')
+        self.assertEqual(len(plan.by_node['a']), 3)
+        self.assertEqual(len(plan.by_node['1']), 2)
+        self.assertEqual([check.operator for check in plan.shares],
+                         ['share', 'nshare'])
+        self.assertIsNone(plan.compositions[0].test)
+
+        # binding.
+        evaluators = {'eq': len, 'share': len}
+        res = plan.bind(evaluators)
+        self.assertEqual([item[0].operator for item in res], ['eq', 'share'])
+        self.assertIs(plan.bind(evaluators), res)
+        evaluators = compiler.evaluators(len, min, max, abs, all)
+        self.assertEqual(len(evaluators), 10)
+        self.assertIs(evaluators['regex'], len)
+        self.assertIs(evaluators['nshare'], all)
+
+        # dropping conditions.
+        tmp = plan.without(('share', ('group', ['a', 'b'])))
+        self.assertEqual(len(tmp.compositions), 2)
+        self.assertEqual(len(plan.compositions), 3)
+
+
+class ConditionsTest(unittest.TestCase):
+    """
+    Testcase for the conditions as evaluated by the stitchers - all need to
+    agree on their meaning.
+    """
+
+    def setUp(self):
+        self.container = nx.DiGraph()
+        self.container.add_node('1', **{'type': 'a', 'rank': 1.0})
+        self.container.add_node('2', **{'type': 'a', 'rank': 2.0})
+        self.container.add_node('3', **{'type': 'a', 'rank': 3.0})
+        self.container.add_edge('1', '2')
+        self.container.add_edge('2', '3')
+        self.request = nx.DiGraph()
+        self.request.add_node('x', **{'type': 'y'})
+        self.rels = {'y': 'a'}
+
+    def _targets(self, cut, conditions):
+        res = cut.stitch(self.container, self.request, conditions=conditions)
+        return sorted(trg for item in res for src, trg in item.edges()
+                      if src == 'x')
+
+    def test_gt_for_sanity(self):
+        """
+        Test larger or equal than for sanity - it used to be ignored by all
+        but the iterative repair stitcher.
+        """
+        condy = {'attributes': [('gt', ('x', ('rank', 3.0)))]}
+        cut = stitch.GlobalStitcher(self.rels)
+        self.assertEqual(self._targets(cut, condy), ['3'])
+        cut = bidding.BiddingStitcher(self.rels)
+        self.assertEqual(self._targets(cut, condy), ['3'])
+        cut = iterative_repair.IterativeRepairStitcher(self.rels,
+                                                       max_steps=500)
+        self.assertEqual(self._targets(cut, condy), ['3'])
+        cut = evolutionary.GraphCandidate({'x': '2'}, self.rels, condy, [],
+                                          self.request, self.container)
+        self.assertEqual(cut.fitness(), 10.2)
+
+    def test_lg_for_sanity(self):
+        """
+        Test larger than for sanity - it used to be ignored by the iterative
+        repair stitcher.
+        """
+        condy = {'attributes': [('lg', ('x', ('rank', 2.0)))]}
+        cut = iterative_repair.IterativeRepairStitcher(self.rels)
+        res = cut.find_conflicts(self.container, self.request,
+                                 iterative_repair.convert_conditions(condy),
+                                 {'x': '2'})
+        self.assertEqual(res, [('x', ('lg', ('rank', 2.0)))])
+        cut = stitch.GlobalStitcher(self.rels)
+        self.assertEqual(self._targets(cut, condy), ['3'])
+
+    def test_compositions_for_sanity(self):
+        """
+        Test the compositions for sanity - the evolutionary stitcher used to
+        compare the targets of all genes following the first named node &
+        the iterative repair stitcher failed on share/nshare.
+        """
+        request = nx.DiGraph()
+        for node in ['a', 'b', 'c']:
+            request.add_node(node, **{'type': 'y'})
+        for cond, gen in [('same', {'a': '1', 'b': '1', 'c': '2'}),
+                          ('diff', {'a': '1', 'b': '2', 'c': '1'})]:
+            condy = {'compositions': [(cond, ('a', 'b'))]}
+            cut = evolutionary.GraphCandidate(gen, self.rels, condy, [],
+                                              request, self.container)
+            self.assertEqual(cut.fitness(), 0.0, cond)
+
+        condy = {'compositions': [('share', ('rank', ['a', 'b'])),
+                                  ('nshare', ('rank', ['a', 'c']))]}
+        cut = iterative_repair.IterativeRepairStitcher(self.rels,
+                                                       max_steps=500)
+        res = cut.stitch(self.container, request, conditions=condy)
+        targets = dict(edge for edge in res[0].edges() if edge[0] in request)
+        self.assertEqual(targets['a'], targets['b'])
+        self.assertNotEqual(targets['a'], targets['c'])
+
+    def test_share_for_sanity(self):
+        """
+        Test share & nshare for sanity - all stitched targets need to have
+        the attribute & the targets of the members are compared to the first
+        value other than ''. Iterative repair & the evolutionary stitcher used
+        to only look at the members & nshare was pairwise for the first.
+        """
+        container = nx.DiGraph()
+        for node, group in [('1', 'x'), ('2', 'x'), ('3', 'y'), ('4', ''),
+                            ('5', None)]:
+            container.add_node(node, **{'type': 'a', 'rank': 1.0})
+            if group is not None:
+                container.nodes[node]['group'] = group
+        request = nx.DiGraph()
+        for node in ['a', 'b', 'c', 'd']:
+            request.add_node(node, **{'type': 'y'})
+        keys = list(request)
+        index = indexing.ContainerIndex(container)
+        matrix = vector.encode([list(container)] * len(keys), index)
+        cut = iterative_repair.IterativeRepairStitcher(self.rels)
+        for cond in ['share', 'nshare']:
+            condy = {'compositions': [(cond, ('group', ['a', 'b', 'c']))]}
+            converted = iterative_repair.convert_conditions(condy)
+            model, _ = exact.formulate(container, request, self.rels, condy)
+            rows = set(tuple(trg for _, trg in edges) for edges in
+                       vector.decode(keys, vector.matrix_filter(
+                           container, keys, matrix, condy, index), index))
+            for targets in itertools.product(container, repeat=len(keys)):
+                edges = list(zip(keys, targets))
+                res = bool(stitch.my_filter(container, {'x': edges}, condy))
+                self.assertEqual(targets in rows, res, (cond, targets))
+                self.assertEqual(_feasible(model, edges), res)
+                candidate = evolutionary.GraphCandidate(
+                    dict(edges), self.rels, condy, [], request, container)
+                self.assertEqual(candidate.fitness() == 0.0, res)
+                self.assertEqual(not cut.find_conflicts(container, request,
+                                                        converted,
+                                                        dict(edges)), res)
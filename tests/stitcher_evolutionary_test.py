@@ -11,6 +11,7 @@ import networkx as nx
 from networkx.readwrite import json_graph
 
 from stitcher import evolutionary
+from stitcher import validators
 
 FORMAT = "%(asctime)s - %(filename)s - %(lineno)s - " \
          "%(levelname)s - %(message)s"
@@ -294,6 +295,48 @@ class TestGraphCandidate(unittest.TestCase):
         # involved.
         self.assertDictEqual({'a': '2'}, cut.gen)
 
+        # fitness is updated incrementally.
+        condy = {'attributes': [('eq', ('a', ('foo', 'bar')))],
+                 'compositions': [('share', ('group', ['a', 'b'])),
+                                  ('diff', ('b', 'c'))]}
+        cut = evolutionary.GraphCandidate({'a': '1', 'b': '2', 'c': '2'},
+                                          self.stitch, condy, ['3', '4'],
+                                          self.request, self.container)
+        cut.fitness()
+        for _ in range(10):
+            cut.mutate()
+            tmp = evolutionary.GraphCandidate(dict(cut.gen), self.stitch,
+                                              condy, [], self.request,
+                                              self.container)
+            self.assertEqual(cut.fitness(), tmp.fitness())
+
+        # only the conditions touching the changed gene are re-evaluated.
+        check = cut.conditions.by_node['c'][0]
+        cut._condition_fit[check] = 1.0
+        cut._set_gene('a', '4')
+        self.assertEqual(cut._condition_fit[check], 1.0)
+        cut._set_gene('c', cut.gen['c'])
+        self.assertIn(cut._condition_fit[check], [0.0, 10.0])
+
+    def test_capacity_for_sanity(self):
+        """
+        Test the penalty for exceeding the capacity of a node for sanity.
+        """
+        cut = evolutionary.GraphCandidate({'a': '1', 'b': '1', 'c': '4'},
+                                          self.stitch, {}, ['2', '3'],
+                                          self.request, self.container,
+                                          capacity={'1': 1, '4': 0})
+        self.assertEqual(cut.fitness(), 20.0)
+        for _ in range(10):
+            cut.mutate()
+            tmp = evolutionary.GraphCandidate(dict(cut.gen), self.stitch,
+                                              {}, [], self.request,
+                                              self.container,
+                                              capacity=cut.capacity)
+            self.assertEqual(cut.fitness(), tmp.fitness())
+        cut = cut.crossover(cut)
+        self.assertEqual(cut.capacity, {'1': 1, '4': 0})
+
     def test_crossover_for_sanity(self):
         """
         Test crossover function for sanity.
@@ -382,6 +425,40 @@ class EvolutionaryStitcherTest(unittest.TestCase):
             # changes are high that within one run the algo finds no solution.
             self.cut.stitch(self.container, self.request)
 
+    def test_limits_for_sanity(self):
+        """
+        Test the validators used as limits for sanity.
+        """
+        rels = json.load(open('data/stitch.json'))
+        limits = [('incoming_edges', {'b': 5})]
+        cut = evolutionary.EvolutionarySticher(rels, max_iter=30,
+                                               limits=limits)
+        for _ in range(5):
+            res = cut.stitch(self.container, self.request)
+            res = validators.validate_incoming_edges(res, {'b': 5})
+            self.assertEqual(set(res.values()) - {'ok'}, set())
+
+        cut.limits = [('incoming_edges', {'b': 1})]
+        self.assertEqual(cut.stitch(self.container, self.request), [])
+
+    def test_islands_for_sanity(self):
+        """
+        Test evolving multiple populations in parallel for sanity.
+        """
+        rels = json.load(open('data/stitch.json'))
+        condy = {'compositions': [('diff', ('k', 'l'))]}
+        cut = evolutionary.EvolutionarySticher(rels, max_iter=20, fit_goal=0.0,
+                                               islands=2, migration=3)
+        found = 0
+        for _ in range(5):
+            res = cut.stitch(self.container, self.request, conditions=condy)
+            for item in res:
+                trg1 = set(item.successors('k')) - set(self.request)
+                trg2 = set(item.successors('l')) - set(self.request)
+                self.assertNotEqual(trg1, trg2)
+            found += len(res)
+        self.assertTrue(found > 0)
+
 
 def _get_population(value):
     population = []
@@ -0,0 +1,148 @@
+"""
+Unittest for the exact module.
+"""
+
+import json
+import unittest
+
+import networkx as nx
+
+from networkx.readwrite import json_graph
+
+from stitcher import exact
+from stitcher import stitch
+
+
+class ModelTest(unittest.TestCase):
+    """
+    Testcase for the 0/1 model & the embedded solver.
+    """
+
+    def setUp(self):
+        self.cut = exact.Model()
+        self.vars = [self.cut.add_variable(name, cost)
+                     for name, cost in [('a', 4), ('b', 1), ('c', 2),
+                                        ('d', -1)]]
+
+    def test_solve_for_success(self):
+        """
+        Test solve for success.
+        """
+        self.cut.add_group(self.vars[:3])
+        self.assertEqual(exact.solve(self.cut), [1, 3])
+
+    def test_solve_for_failure(self):
+        """
+        Test solve for failure - infeasible models have no solution.
+        """
+        self.cut.add_group(self.vars[:2])
+        self.cut.add_constraint([(self.vars[0], 1), (self.vars[1], 1)], '>=',
+                                2)
+        self.assertIsNone(exact.solve(self.cut))
+        self.cut = exact.Model()
+        self.cut.add_group([])
+        self.assertIsNone(exact.solve(self.cut))
+
+    def test_solve_for_sanity(self):
+        """
+        Test solve for sanity - constraints are taken into account.
+        """
+        self.cut.add_group(self.vars[:3])
+        self.cut.add_group(self.vars[2:])
+        # b and d can not both be picked.
+        self.cut.add_constraint([(self.vars[1], 1), (self.vars[3], 1)], '<=',
+                                1)
+        self.assertEqual(exact.solve(self.cut), [2])
+        self.cut.add_constraint([(self.vars[2], 1)], '==', 0)
+        self.assertEqual(exact.solve(self.cut), [0, 3])
+
+
+class ExactStitcherTest(unittest.TestCase):
+    """
+    Testcase for the exact stitcher.
+    """
+
+    def setUp(self):
+        self.container = nx.DiGraph()
+        self.container.add_node('1', **{'type': 'a', 'rank': 5, 'grp': 'x'})
+        self.container.add_node('2', **{'type': 'a', 'rank': 1, 'grp': ''})
+        self.container.add_node('3', **{'type': 'a', 'rank': 7, 'grp': 'y'})
+        self.container.add_node('4', **{'type': 'b', 'rank': 2, 'grp': 'y'})
+        self.container.add_node('5', **{'type': 'b', 'rank': 0, 'grp': 'x'})
+        self.container.add_node('6', **{'type': 'b', 'grp': 'x'})
+        self.container.add_edge('1', '4')
+
+        self.request = nx.DiGraph()
+        self.request.add_node('p', **{'type': 'x'})
+        self.request.add_node('q', **{'type': 'x'})
+        self.request.add_node('r', **{'type': 'y'})
+        self.request.add_edge('p', 'r')
+
+        self.rels = {'x': 'a', 'y': 'b'}
+        self.cut = exact.ExactStitcher(self.rels)
+
+    def _compare(self, condy, **kwargs):
+        res1 = stitch.GlobalStitcher(self.rels, **kwargs).stitch(
+            self.container, self.request, conditions=condy)
+        res2 = exact.ExactStitcher(self.rels, **kwargs).stitch(
+            self.container, self.request, conditions=condy)
+        if not res1:
+            self.assertEqual(res2, [])
+            return
+        self.assertEqual(len(res2), 1)
+        costs = [sum(stitch.rank_cost(self.container, src, trg)
+                     for src, trg in item.edges()
+                     if src in self.request and trg in self.container)
+                 for item in res1 + res2]
+        self.assertEqual(min(costs[:-1]), costs[-1])
+        self.assertIn(list(res2[0].edges()),
+                      [list(item.edges()) for item in res1])
+
+    def test_init_for_failure(self):
+        """
+        Test initialization for failure.
+        """
+        self.assertRaises(ValueError, exact.ExactStitcher, self.rels,
+                          solver='foo')
+
+    def test_stitch_for_success(self):
+        """
+        Test stitch for success.
+        """
+        container_tmp = json.load(open('data/container.json'))
+        container = json_graph.node_link_graph(container_tmp, directed=True)
+        request_tmp = json.load(open('data/request.json'))
+        request = json_graph.node_link_graph(request_tmp, directed=True)
+        rels = json.load(open('data/stitch.json'))
+        res = exact.ExactStitcher(rels).stitch(container, request)
+        self.assertEqual(len(res), 1)
+
+    def test_stitch_for_failure(self):
+        """
+        Test stitch for failure - conditions which can not be satisfied.
+        """
+        condy = {'attributes': [('eq', ('p', ('rank', 3)))]}
+        self.assertEqual(self.cut.stitch(self.container, self.request,
+                                         conditions=condy), [])
+        self.assertEqual(self.cut.stitch(self.container, nx.DiGraph()), [])
+        self.cut.limits = [('incoming_edges', {'b': 1})]
+        self.assertEqual(self.cut.stitch(self.container, self.request), [])
+
+    def test_stitch_for_sanity(self):
+        """
+        Test stitch for sanity - needs to be the cheapest of the stitches the
+        global stitcher finds.
+        """
+        self._compare(None)
+        self._compare({'attributes': [('lg', ('p', ('rank', 2))),
+                                      ('neq', ('r', ('grp', 'x')))]})
+        self._compare({'compositions': [('same', ('p', 'q'))]})
+        self._compare({'compositions': [('diff', ('p', 'q'))]})
+        # '' is no value - the next one counts.
+        self._compare({'compositions': [('share', ('grp', ['p', 'q', 'r']))]})
+        self._compare({'compositions': [('nshare', ('grp', ['p', 'q', 'r']))]})
+        self._compare({'compositions': [('nshare', ('grp', ['q', 'r'])),
+                                        ('diff', ('q', 'p'))]})
+        self._compare(None, limits=[('incoming_edges', {'a': 2})])
+        self._compare({'compositions': [('same', ('p', 'q'))]},
+                      limits=[('incoming_edges', {'a': 2})])
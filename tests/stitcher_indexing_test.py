@@ -0,0 +1,140 @@
+"""
+Unittest for the indexing module.
+"""
+
+import json
+import unittest
+
+import networkx as nx
+
+from networkx.readwrite import json_graph
+
+from stitcher import bidding
+from stitcher import evolutionary
+from stitcher import indexing
+from stitcher import iterative_repair
+from stitcher import stitch
+
+
+class ContainerIndexTest(unittest.TestCase):
+    """
+    Testcase for the ContainerIndex class.
+    """
+
+    def setUp(self):
+        self.container = nx.DiGraph()
+        self.container.add_node('1', **{'type': 'a', 'rank': 5, 'foo': 'x'})
+        self.container.add_node('2', **{'type': 'b', 'rank': 1.5})
+        self.container.add_node('3', **{'type': 'a', 'rank': 7, 'foo': 'y'})
+        self.container.add_node('4', **{'type': 'a', 'foo': ['x']})
+        self.cut = indexing.ContainerIndex(self.container)
+
+    def test_init_for_success(self):
+        """
+        Test building the index for success.
+        """
+        indexing.ContainerIndex(nx.DiGraph())
+
+    def test_init_for_failure(self):
+        """
+        Test building the index for failure - nodes need a type.
+        """
+        self.container.add_node('5')
+        self.assertRaises(KeyError, indexing.ContainerIndex, self.container)
+
+    def test_nodes_for_sanity(self):
+        """
+        Test lookup by type for sanity.
+        """
+        self.assertEqual(self.cut.nodes('a'), ['1', '3', '4'])
+        self.assertEqual(self.cut.nodes('b'), ['2'])
+        self.assertEqual(self.cut.nodes('c'), [])
+
+    def test_random_node_for_sanity(self):
+        """
+        Test random picks for sanity.
+        """
+        for _ in range(10):
+            self.assertIn(self.cut.random_node('a'), ['1', '3', '4'])
+            self.assertIn(self.cut.random_node(), ['1', '2', '3', '4'])
+        self.assertEqual(self.cut.random_node('b'), '2')
+        self.assertIsNone(self.cut.random_node('c'))
+
+    def test_select_for_sanity(self):
+        """
+        Test lookup by attribute values for sanity.
+        """
+        self.assertEqual(self.cut.select('eq', 'rank', 5), {'1'})
+        self.assertEqual(self.cut.select('eq', 'rank', 3), set())
+        self.assertEqual(self.cut.select('lg', 'rank', 5), {'3'})
+        self.assertEqual(self.cut.select('lt', 'rank', 5), {'1', '2'})
+        self.assertEqual(self.cut.select('lg', 'type', 1), None)
+        # list values can not be looked up.
+        self.assertEqual(self.cut.select('eq', 'foo', 'x'), None)
+        self.assertEqual(self.cut.select('regex', 'rank', '^1'), None)
+
+    def test_column_for_sanity(self):
+        """
+        Test the attribute columns for sanity.
+        """
+        values, valid = self.cut.column('rank')
+        self.assertEqual(list(valid), [True, True, True, False])
+        self.assertEqual(list(values[valid]), [5, 1.5, 7])
+        self.assertIsNone(self.cut.column('foo'))
+        self.assertIsNone(self.cut.column('bar'))
+
+    def test_codes_for_sanity(self):
+        """
+        Test the attribute value codes for sanity.
+        """
+        self.container.add_node('5', **{'type': 'b', 'foo': ['x']})
+        self.container.add_node('6', **{'type': 'b', 'foo': 'x'})
+        self.container.add_node('7', **{'type': 'b', 'foo': ''})
+        codes, empty = indexing.ContainerIndex(self.container).codes('foo')
+        self.assertEqual(codes[1], -1)
+        self.assertEqual(codes[0], codes[5])
+        self.assertEqual(codes[3], codes[4])
+        self.assertEqual(len(set(codes.tolist())), 5)
+        self.assertEqual(codes[6], empty)
+        self.assertEqual(self.cut.codes('foo')[1], -2)
+
+
+class StitcherIndexTest(unittest.TestCase):
+    """
+    Test the stitchers accept an index.
+    """
+
+    def setUp(self):
+        container_tmp = json.load(open('data/container.json'))
+        self.container = json_graph.node_link_graph(container_tmp,
+                                                    directed=True)
+        request_tmp = json.load(open('data/request.json'))
+        self.request = json_graph.node_link_graph(request_tmp,
+                                                  directed=True)
+        self.rels = json.load(open('data/stitch.json'))
+        self.index = indexing.ContainerIndex(self.container)
+
+    def test_stitch_for_sanity(self):
+        """
+        Test stitching with a prebuilt index for sanity.
+        """
+        condy = {'attributes': [('lt', ('k', ('rank', 4)))]}
+        for cut in [stitch.GlobalStitcher(self.rels),
+                    stitch.GlobalStitcher(self.rels, backtrack=True)]:
+            res = cut.stitch(self.container, self.request, condy,
+                             index=self.index)
+            self.assertEqual(len(res), 4)
+            for item in res:
+                self.assertIn(('k', 'A'), item.edges())
+
+        cut = iterative_repair.IterativeRepairStitcher(self.rels)
+        res = cut.stitch(self.container, self.request, index=self.index)
+        self.assertEqual(len(res), 1)
+
+        cut = bidding.BiddingStitcher(self.rels)
+        res = cut.stitch(self.container, self.request, index=self.index)
+        self.assertEqual(len(res[0].edges()),
+                         self.container.number_of_edges() + 5)
+
+        cut = evolutionary.EvolutionarySticher(self.rels, mutate=0.5)
+        cut.stitch(self.container, self.request, index=self.index)
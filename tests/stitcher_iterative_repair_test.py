@@ -3,13 +3,16 @@ Unittests for iterative_repair module.
 """
 
 import json
+import time
 import unittest
 
 import networkx as nx
 
 from networkx.readwrite import json_graph
 
+from stitcher import indexing
 from stitcher import iterative_repair
+from stitcher import profiling
 
 
 def _sample_data():
@@ -77,6 +80,17 @@ class IterativeRepairStitcherTest(unittest.TestCase):
 
     # Test for failure.
 
+    def test_init_for_failure(self):
+        """
+        Test for failure - unknown strategies.
+        """
+        self.assertRaises(ValueError,
+                          iterative_repair.IterativeRepairStitcher, {},
+                          strategy='foo')
+        self.assertRaises(ValueError,
+                          iterative_repair.IterativeRepairStitcher, {},
+                          restart_policy='foo')
+
     def test_stitch_for_failure(self):
         """
         Test for failure.
@@ -97,6 +111,39 @@ class IterativeRepairStitcherTest(unittest.TestCase):
         })
         self.assertTrue(len(res) == 0)
 
+    def test_find_conflicts_for_failure(self):
+        """
+        Test for failure - overwritten routines get the converted conditions.
+        """
+        seen = []
+
+        class Stitcher(iterative_repair.IterativeRepairStitcher):
+            """
+            Treats every mapping to a node of rank 1.0 as a conflict.
+            """
+
+            def find_conflicts(self, container, request, conditions,
+                               mapping):
+                res = []
+                for node in conditions:
+                    for cond, attrs in conditions[node]:
+                        seen.append((node, cond, attrs))
+                    if container.nodes[mapping[node]]['rank'] == 1.0:
+                        res.append((node, conditions[node][0]))
+                return res
+
+        cont, req = _sample_data()
+        cut = Stitcher({'x': 'a', 'y': 'b'}, max_steps=500)
+        stats = profiling.Stats()
+        res = cut.stitch(cont, req, {
+            'attributes': [('eq', ('a', ('group', 'bar'))),
+                           ('eq', ('b', ('group', 'bar')))]}, stats=stats)
+        self.assertIn(('a', '4'), res[0].edges())
+        self.assertIn(('b', '3'), res[0].edges())
+        self.assertIn(('a', 'eq', ('group', 'bar')), seen)
+        # no conflicts are tracked next to the overwritten routine.
+        self.assertNotIn('checks', stats.counts)
+
     # Test for sanity.
 
     def test_stitch_for_sanity(self):
@@ -112,6 +159,16 @@ class IterativeRepairStitcherTest(unittest.TestCase):
         self.assertIsInstance(res, list)
         self.assertIsInstance(res[0], nx.DiGraph)
 
+        # compositions
+        cont, req = _sample_data()
+        condy = {'compositions': [('share', ('group', ['a', 'b']))],
+                 'attributes': [('eq', ('b', ('rank', 2.0)))]}
+        cut = iterative_repair.IterativeRepairStitcher({'x': 'a', 'y': 'b'},
+                                                       max_steps=500)
+        res = cut.stitch(cont, req, conditions=condy)
+        self.assertIn(('a', '4'), res[0].edges())
+        self.assertIn(('b', '3'), res[0].edges())
+
     def test_find_conflicts_for_sanity(self):
         """
         Test for sanity.
@@ -174,6 +231,191 @@ class IterativeRepairStitcherTest(unittest.TestCase):
                               mapping)
         self.assertIn('a', mapping)
 
+        # overrides using the documented signature keep working.
+        fixed = []
+
+        class Stitcher(iterative_repair.IterativeRepairStitcher):
+            """
+            Fixes conflicts by picking a random target.
+            """
+
+            def fix_conflict(self, conflict, container, request, mapping):
+                fixed.append(conflict)
+                mapping[conflict[0]] = self._pick_random(
+                    container, request.nodes[conflict[0]]['type'])
+
+        cut = Stitcher({'x': 'a', 'y': 'b'}, max_steps=500)
+        condy = {'attributes': [('eq', ('b', ('rank', 2.0)))]}
+        while not fixed:
+            # initial picks are random - repeat until one conflicts.
+            res = cut.stitch(cont, req, conditions=condy)
+            self.assertIn(('b', '3'), res[0].edges())
+        self.assertIn(cut._pick_random(cont, 'x'), ['1', '4'])
+
+        # ... as do overrides of the random pick.
+        picked = []
+
+        class Picker(iterative_repair.IterativeRepairStitcher):
+            """
+            Picks the first node of the right type.
+            """
+
+            def _pick_random(self, container, req_node_type):
+                picked.append(req_node_type)
+                return sorted(node for node, attrs in container.nodes(
+                    data=True) if attrs['type'] == self.rels[req_node_type])[0]
+
+        cut = Picker({'x': 'a', 'y': 'b'}, strategy='random')
+        mapping = {'a': '1', 'b': '2'}
+        self.assertEqual(cut._solve(cont, req, {}, mapping), 0)
+        res = cut.stitch(cont, req)
+        self.assertIn(('a', '1'), res[0].edges())
+        self.assertEqual(sorted(picked), ['x', 'y'])
+
+    def test_restarts_for_sanity(self):
+        """
+        Test for sanity - number of steps per run follows the policy.
+        """
+        self.assertEqual([iterative_repair.luby(i) for i in range(1, 16)],
+                         [1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8])
+        cont, req = _sample_data()
+        condy = {'attributes': [('eq', ('a', ('rank', 9.0)))]}
+        for policy, steps in [('luby', 10 * 12), ('geometric', 10 + 15 + 22 +
+                                                  33 + 50 + 75 + 113)]:
+            cut = iterative_repair.IterativeRepairStitcher(
+                {'x': 'a', 'y': 'b'}, max_steps=10, restarts=6,
+                restart_policy=policy)
+            stats = profiling.Stats()
+            self.assertEqual(cut.stitch(cont, req, condy, stats=stats), [])
+            self.assertEqual(stats.counts['restarts'], 6)
+            self.assertEqual(stats.counts['steps'], steps)
+
+        # the time budget is the limit.
+        cut = iterative_repair.IterativeRepairStitcher(
+            {'x': 'a', 'y': 'b'}, max_steps=10 ** 9, time_budget=0.1)
+        start = time.monotonic()
+        self.assertEqual(cut.stitch(cont, req, condy), [])
+        self.assertTrue(time.monotonic() - start < 5)
+
+    def test_portfolio_for_sanity(self):
+        """
+        Test for sanity - the first solution of the searches is returned.
+        """
+        cont, req = _sample_data()
+        condy = {'compositions': [('share', ('group', ['a', 'b']))],
+                 'attributes': [('eq', ('b', ('rank', 2.0)))]}
+        cut = iterative_repair.IterativeRepairStitcher(
+            {'x': 'a', 'y': 'b'}, processes=2, restarts=3)
+        res = cut.stitch(cont, req, conditions=condy)
+        self.assertIn(('a', '4'), res[0].edges())
+        self.assertIn(('b', '3'), res[0].edges())
+
+        # unsolvable - the workers give up after the time budget.
+        cut = iterative_repair.IterativeRepairStitcher(
+            {'x': 'a', 'y': 'b'}, max_steps=10 ** 9, processes=2,
+            time_budget=0.2)
+        condy = {'attributes': [('eq', ('a', ('rank', 9.0)))]}
+        self.assertEqual(cut.stitch(cont, req, conditions=condy), [])
+
+    def test_min_conflicts_for_sanity(self):
+        """
+        Test for sanity - the target violating the fewest conditions is
+        picked; recently left targets are tabu.
+        """
+        cont, req = _sample_data()
+        cont.add_node('5', **{'type': 'b', 'group': 'bar', 'rank': 3.0})
+        cut = iterative_repair.IterativeRepairStitcher({'x': 'a', 'y': 'b'})
+        index = indexing.ContainerIndex(cont)
+
+        condy = iterative_repair.convert_conditions(
+            {'attributes': [('eq', ('b', ('rank', 2.0)))]})
+        mapping = {'a': '1', 'b': '2'}
+        tracker = iterative_repair.ConflictTracker(cont, req, condy, mapping,
+                                                   index=index, tabu=5)
+        cut.fix_conflict(tracker.conflicts()[0], cont, req, mapping,
+                         index=index, tracker=tracker)
+        self.assertEqual(mapping['b'], '3')
+
+        # all targets violate - but b does not return to where it was.
+        condy = iterative_repair.convert_conditions(
+            {'attributes': [('eq', ('b', ('rank', 9.0)))]})
+        mapping = {'a': '1', 'b': '2'}
+        tracker = iterative_repair.ConflictTracker(cont, req, condy, mapping,
+                                                   index=index, tabu=5)
+        visited = []
+        for _ in range(2):
+            cut.fix_conflict(tracker.conflicts()[0], cont, req, mapping,
+                             index=index, tracker=tracker)
+            visited.append(mapping['b'])
+        self.assertEqual(sorted(visited), ['3', '5'])
+
+
+class TestConflictTracker(unittest.TestCase):
+    """
+    Test the incremental conflict tracking.
+    """
+
+    def setUp(self) -> None:
+        self.cont, self.req = _sample_data()
+        self.req.add_node('c', **{'type': 'y'})
+        self.condy = iterative_repair.convert_conditions(
+            {'attributes': [('eq', ('a', ('group', 'foo')))],
+             'compositions': [('diff', ('b', 'c')),
+                              ('share', ('group', ['a', 'b']))]})
+        self.mapping = iterative_repair.TrackedMapping(
+            {'a': '1', 'b': '2', 'c': '2'})
+        self.cut = iterative_repair.ConflictTracker(self.cont, self.req,
+                                                    self.condy, self.mapping)
+
+    def test_update_for_success(self):
+        """
+        Test for success.
+        """
+        self.assertEqual(len(self.cut), 2)
+        self.mapping['c'] = '3'
+        self.assertEqual(self.mapping.changed, {'c'})
+        # only the diff conditions of b & c are evaluated - and the share
+        # conditions as all targets need to have the attribute.
+        self.assertEqual(self.cut.update('c'), 4)
+        self.assertEqual(self.cut.conflicts(), [])
+
+    def test_update_for_failure(self):
+        """
+        Test for failure - unknown or unconstrained nodes.
+        """
+        self.assertEqual(self.cut.update('x'), 0)
+        self.req.add_node('d', **{'type': 'x'})
+        cut = iterative_repair.ConflictTracker(self.cont, self.req,
+                                               self.condy, self.mapping)
+        # only the share conditions depend on all targets.
+        self.assertEqual(cut.update('d'), 2)
+
+    def test_score_for_success(self):
+        """
+        Test for success - scoring does not change the mapping.
+        """
+        # a in group bar violates eq & the share conditions of a & b.
+        self.assertEqual(self.cut.score('a', '4'), 3)
+        self.assertEqual(self.cut.score('b', '3'), 2)
+        self.assertEqual(self.cut.score('c', '3'), 0)
+        self.assertEqual(self.mapping, {'a': '1', 'b': '2', 'c': '2'})
+        self.assertEqual(self.mapping.changed, set())
+
+    def test_update_for_sanity(self):
+        """
+        Test for sanity - same conflicts as find_conflicts.
+        """
+        sticher = iterative_repair.IterativeRepairStitcher({'x': 'a',
+                                                            'y': 'b'})
+        for node, trg in [('a', '4'), ('b', '3'), ('c', '3'), ('a', '1'),
+                          ('c', '2'), ('b', '2'), ('a', '4')]:
+            self.mapping[node] = trg
+            self.cut.update(node)
+            self.assertEqual(self.cut.conflicts(),
+                             sticher.find_conflicts(self.cont, self.req,
+                                                    self.condy,
+                                                    self.mapping))
+
 
 class TestConvertConditions(unittest.TestCase):
     """
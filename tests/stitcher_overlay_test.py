@@ -0,0 +1,116 @@
+"""
+Unittest for the overlay module.
+"""
+
+import json
+import unittest
+
+import networkx as nx
+
+from networkx.readwrite import json_graph
+
+from stitcher import bidding
+from stitcher import evolutionary
+from stitcher import iterative_repair
+from stitcher import overlay
+from stitcher import stitch
+from stitcher import validators
+
+
+class StitchViewTest(unittest.TestCase):
+    """
+    Testcase for the StitchView class.
+    """
+
+    def setUp(self):
+        container_tmp = json.load(open('data/container.json'))
+        self.container = json_graph.node_link_graph(container_tmp,
+                                                    directed=True)
+        request_tmp = json.load(open('data/request.json'))
+        self.request = json_graph.node_link_graph(request_tmp,
+                                                  directed=True)
+        self.rels = json.load(open('data/stitch.json'))
+        self.stitches = [('k', 'A'), ('l', 'C'), ('m', 'E')]
+
+        self.graph = nx.union(self.container, self.request)
+        self.graph.add_edges_from(self.stitches)
+
+    def test_init_for_success(self):
+        """
+        Test view creation for success.
+        """
+        overlay.StitchView(self.container, self.request, self.stitches)
+        overlay.StitchView()
+
+    def test_init_for_failure(self):
+        """
+        Test view creation for failure.
+        """
+        # not disjoint.
+        self.assertRaises(nx.NetworkXError, overlay.StitchView,
+                          self.container, self.container)
+        # unknown node.
+        self.assertRaises(nx.NetworkXError, overlay.StitchView,
+                          self.container, self.request, [('k', 'foo')])
+
+    def test_modify_for_failure(self):
+        """
+        Test view is read-only.
+        """
+        cut = overlay.StitchView(self.container, self.request, self.stitches)
+        self.assertRaises(nx.NetworkXError, cut.add_edge, 'k', 'B')
+        self.assertRaises(nx.NetworkXError, cut.remove_node, 'k')
+
+    def test_view_for_sanity(self):
+        """
+        Test the view behaves like the union graph.
+        """
+        cut = overlay.StitchView(self.container, self.request, self.stitches)
+        self.assertEqual(list(self.graph.nodes(data=True)),
+                         list(cut.nodes(data=True)))
+        self.assertEqual(list(self.graph.edges()), list(cut.edges()))
+        self.assertEqual(self.graph.number_of_edges(), cut.number_of_edges())
+        self.assertEqual(len(self.graph), len(cut))
+        for node in self.graph:
+            self.assertEqual(list(self.graph.in_edges(node)),
+                             list(cut.in_edges(node)))
+            self.assertEqual(list(self.graph.neighbors(node)),
+                             list(cut.neighbors(node)))
+            self.assertEqual(self.graph.degree(node), cut.degree(node))
+        self.assertEqual(validators.validate_incoming_edges([self.graph],
+                                                            {'b': 1}),
+                         validators.validate_incoming_edges([cut], {'b': 1}))
+
+        # copies can be modified & do not touch the container.
+        tmp = cut.copy()
+        self.assertIsInstance(tmp, nx.DiGraph)
+        self.assertNotIsInstance(tmp, overlay.StitchView)
+        tmp.remove_node('k')
+        self.assertIn('k', cut)
+        self.assertTrue(nx.is_isomorphic(cut.subgraph(['k', 'A', 'l']),
+                                         self.graph.subgraph(['k', 'A', 'l'])))
+
+        # only the stitches are stored.
+        self.assertIs(cut.container, self.container)
+        self.assertEqual(cut.stitches, self.stitches)
+
+    def test_stitchers_for_sanity(self):
+        """
+        Test the stitchers can return views.
+        """
+        res = stitch.GlobalStitcher(self.rels, view=True).stitch(
+            self.container, self.request)
+        self.assertEqual(len(res), 8)
+        for item in res:
+            self.assertIsInstance(item, overlay.StitchView)
+        res = iterative_repair.IterativeRepairStitcher(
+            self.rels, view=True).stitch(self.container, self.request)
+        self.assertIsInstance(res[0], overlay.StitchView)
+        res = bidding.BiddingStitcher(self.rels, view=True).stitch(
+            self.container, self.request)
+        self.assertIsInstance(res[0], overlay.StitchView)
+        res = evolutionary.EvolutionarySticher(
+            self.rels, view=True, candidates=50).stitch(self.container,
+                                                        self.request)
+        for item in res:
+            self.assertIsInstance(item, overlay.StitchView)
@@ -0,0 +1,149 @@
+"""
+Unittest for the profiling module.
+"""
+
+import json
+import unittest
+
+from networkx.readwrite import json_graph
+
+from stitcher import bidding
+from stitcher import evolutionary
+from stitcher import exact
+from stitcher import iterative_repair
+from stitcher import profiling
+from stitcher import stitch
+
+
+class StatsTest(unittest.TestCase):
+    """
+    Testcase for the Stats class.
+    """
+
+    def setUp(self):
+        self.records = []
+        self.cut = profiling.Stats(
+            callback=lambda *args: self.records.append(args))
+
+    def test_stats_for_success(self):
+        """
+        Test recording for success.
+        """
+        with self.cut.timer('a'):
+            self.cut.count('x')
+        self.cut.count('x', 2)
+        self.cut.peak('y', 3)
+        self.cut.peak('y', 1)
+        self.assertEqual(list(self.cut.iterate('b', [1, 2], 'z')), [1, 2])
+        res = self.cut.as_dict()
+        self.assertEqual(sorted(res['times']), ['a', 'b'])
+        self.assertEqual(res['counts'], {'x': 3, 'z': 2})
+        self.assertEqual(res['peaks'], {'y': 3})
+        self.assertEqual([item[:2] for item in self.records[:3]],
+                         [('count', 'x'), ('time', 'a'), ('count', 'x')])
+
+    def test_stats_for_failure(self):
+        """
+        Test recording for failure - time is recorded if a phase fails.
+        """
+        with self.assertRaises(KeyError):
+            with self.cut.timer('a'):
+                raise KeyError('foo')
+        self.assertIn('a', self.cut.times)
+
+        def items():
+            yield 1
+            raise KeyError('bar')
+        with self.assertRaises(KeyError):
+            list(self.cut.iterate('b', items(), 'c'))
+        self.assertEqual(self.cut.counts, {'c': 1})
+        self.assertIn('b', self.cut.times)
+
+    def test_stats_for_sanity(self):
+        """
+        Test recording for sanity - disabled stats record nothing.
+        """
+        cut = profiling.get(None)
+        self.assertIs(cut, profiling.DISABLED)
+        self.assertIs(profiling.get(self.cut), self.cut)
+        with cut.timer('a'):
+            cut.count('b')
+            cut.peak('c', 1)
+        items = [1, 2]
+        self.assertIs(cut.iterate('d', items, 'e'), items)
+        self.assertFalse(cut)
+        self.assertEqual(cut.as_dict(), {'times': {}, 'counts': {},
+                                         'peaks': {}})
+
+
+class StitchersTest(unittest.TestCase):
+    """
+    Testcase for the stats recorded by the stitchers.
+    """
+
+    def setUp(self):
+        container_tmp = json.load(open('data/container.json'))
+        self.container = json_graph.node_link_graph(container_tmp,
+                                                    directed=True)
+        request_tmp = json.load(open('data/request.json'))
+        self.request = json_graph.node_link_graph(request_tmp,
+                                                  directed=True)
+        self.rels = json.load(open('data/stitch.json'))
+        self.conditions = {'compositions': [('diff', ('k', 'l'))]}
+
+    def _stitch(self, cut, **kwargs):
+        stats = profiling.Stats()
+        res = cut.stitch(self.container, self.request,
+                         conditions=self.conditions, stats=stats, **kwargs)
+        return res, stats
+
+    def test_global_for_sanity(self):
+        """
+        Test the stats of the global stitcher for sanity.
+        """
+        res, stats = self._stitch(stitch.GlobalStitcher(self.rels))
+        self.assertEqual(sorted(stats.times),
+                         ['filter', 'graphs', 'mappings', 'product'])
+        self.assertEqual(stats.counts['candidates'] -
+                         stats.counts['filtered'], len(res))
+        self.assertEqual(stats.counts['graphs'], len(res))
+
+        res, stats = self._stitch(stitch.GlobalStitcher(self.rels,
+                                                        backtrack=True))
+        self.assertEqual(sorted(stats.times), ['graphs', 'mappings',
+                                               'search'])
+        self.assertEqual(stats.counts['candidates'], len(res))
+
+        cut = stitch.GlobalStitcher(self.rels)
+        stats = profiling.Stats()
+        res = cut.stitch_top_k(self.container, self.request, k=2,
+                               stats=stats)
+        self.assertEqual(stats.counts, {'candidates': 2, 'graphs': 2})
+
+    def test_heuristics_for_sanity(self):
+        """
+        Test the stats of the heuristics for sanity.
+        """
+        cut = iterative_repair.IterativeRepairStitcher(self.rels)
+        _, stats = self._stitch(cut)
+        self.assertEqual(sorted(stats.times), ['initial', 'repair'])
+        self.assertIn('conflicts', stats.peaks)
+
+        cut = evolutionary.EvolutionarySticher(self.rels, max_iter=3)
+        _, stats = self._stitch(cut)
+        self.assertEqual(sorted(stats.times), ['evolution', 'initial'])
+        self.assertEqual(stats.counts['generations'], 4)
+        self.assertEqual(stats.peaks['population'], 10)
+        self.assertTrue(stats.counts['fitness'] >= 10)
+
+        for mode in bidding.MODES:
+            cut = bidding.BiddingStitcher(self.rels, mode=mode)
+            _, stats = self._stitch(cut)
+            self.assertEqual(sorted(stats.times), ['bidding', 'entities'])
+            self.assertTrue(stats.counts['messages'] >=
+                            self.container.number_of_nodes())
+
+        _, stats = self._stitch(exact.ExactStitcher(self.rels))
+        self.assertEqual(sorted(stats.times), ['formulate', 'solve'])
+        self.assertEqual(sorted(stats.peaks), ['constraints', 'variables'])
+        self.assertTrue(stats.counts['nodes'] >= 1)
@@ -11,6 +11,16 @@ import networkx as nx
 from networkx.readwrite import json_graph
 
 from stitcher import stitch
+from stitcher import validators
+
+
+def _accept_all(_, edge_list, __):
+    return edge_list
+
+
+def _first_target(_, edge_list, __):
+    return dict((key, edges) for key, edges in edge_list.items()
+                if edges[0][1] == '1')
 
 
 class TestFilteringConditions(unittest.TestCase):
@@ -282,3 +292,203 @@ class TestGlobalStitcher(unittest.TestCase):
                          self.container.number_of_edges() + 5)
         self.assertEqual(res1[0].number_of_nodes(),
                          self.container.number_of_nodes() + 3)
+
+    def test_limits_for_sanity(self):
+        """
+        Test the validators used as limits for sanity - the stitches need to
+        be the ones the validators consider ok.
+        """
+        res1 = self.cut.stitch(self.container, self.request)
+        for limits in [[('incoming_edges', {'b': 5})],
+                       [('incoming_rank', {'a': (0, 3)})],
+                       [('incoming_edges', {'a': 2, 'b': 5}),
+                        ('incoming_rank', {'b': (2, 0)})]]:
+            res2 = [item for item in res1 if all(
+                getattr(validators, 'validate_' + name)([item], param)[0] ==
+                'ok' for name, param in limits)]
+            for backtrack in [False, True]:
+                cut = stitch.GlobalStitcher(self.cut.rels, backtrack=backtrack,
+                                            limits=limits)
+                res3 = cut.stitch(self.container, self.request)
+                self.assertEqual([list(item.edges()) for item in res2],
+                                 [list(item.edges()) for item in res3])
+
+        # no stitch can pass.
+        cut = stitch.GlobalStitcher(self.cut.rels,
+                                    limits=[('incoming_edges', {'b': 1})])
+        self.assertEqual(cut.stitch(self.container, self.request), [])
+
+
+class TestBacktrackingSearch(unittest.TestCase):
+    """
+    Test the backtracking search returns the same stitches as filtering the
+    full product.
+    """
+
+    def setUp(self):
+        self.container = nx.DiGraph()
+        self.container.add_node('1', **{'type': 'a', 'group': 'x', 'bar': 5})
+        self.container.add_node('2', **{'type': 'a', 'group': 'y', 'bar': 7})
+        self.container.add_node('3', **{'type': 'b', 'group': 'x', 'bar': 1})
+        self.container.add_node('4', **{'type': 'b', 'group': 'y'})
+        self.container.add_node('5', **{'type': 'b', 'group': 'x', 'bar': 3})
+
+        self.request = nx.DiGraph()
+        self.request.add_node('a', **{'type': 'x'})
+        self.request.add_node('b', **{'type': 'y'})
+        self.request.add_node('c', **{'type': 'y'})
+        self.request.add_edge('a', 'b')
+
+        self.product = stitch.GlobalStitcher({'x': 'a', 'y': 'b'})
+        self.cut = stitch.GlobalStitcher({'x': 'a', 'y': 'b'},
+                                         backtrack=True)
+
+    def _compare(self, condy, candidate_filter=stitch.my_filter):
+        res1 = self.product.stitch(self.container, self.request,
+                                   conditions=condy,
+                                   candidate_filter=candidate_filter)
+        res2 = self.cut.stitch(self.container, self.request,
+                               conditions=condy,
+                               candidate_filter=candidate_filter)
+        self.assertEqual([list(item.edges()) for item in res1],
+                         [list(item.edges()) for item in res2])
+        return res2
+
+    def test_stitch_for_success(self):
+        """
+        Test stitch for success.
+        """
+        self.cut.stitch(self.container, self.request)
+
+    def test_search_for_failure(self):
+        """
+        Test search for failure - nothing to assign.
+        """
+        self.assertEqual(list(stitch.search(self.container, [], [], None)),
+                         [])
+        self.assertEqual(list(stitch.search(self.container, ['a'], [[]],
+                                            None)), [])
+
+    def test_stitch_for_sanity(self):
+        """
+        Test stitch for sanity.
+        """
+        self.assertEqual(len(self._compare(None)), 18)
+        self._compare({'attributes': [('eq', ('a', ('group', 'x'))),
+                                      ('lt', ('b', ('bar', 2)))]})
+        self._compare({'attributes': [('lg', ('c', ('bar', 2))),
+                                      ('neq', ('a', ('bar', 5))),
+                                      ('regex', ('b', ('group', '^y')))]})
+        self._compare({'compositions': [('same', ('b', 'c'))]})
+        self._compare({'compositions': [('diff', ('c', 'b'))]})
+        self._compare({'compositions': [('share', ('group', ['a', 'b'])),
+                                        ('diff', ('b', 'c'))]})
+        self._compare({'compositions': [('nshare', ('group',
+                                                    ['a', 'b', 'c']))]})
+        res = self._compare({'compositions': [('share', ('group',
+                                                         ['a', 'b', 'c'])),
+                                              ('diff', ('b', 'c'))],
+                             'attributes': [('eq', ('a', ('bar', 7)))]})
+        self.assertEqual(len(res), 0)
+
+    def test_filter_for_sanity(self):
+        """
+        Test custom filters for sanity - they replace the default filter.
+        """
+        condy = {'compositions': [('diff', ('b', 'c'))]}
+        self.assertEqual(len(self._compare(condy, _accept_all)), 18)
+        self.assertEqual(len(self._compare(condy, _first_target)), 9)
+
+    def test_stitch_top_k_for_failure(self):
+        """
+        Test the top k stitches for failure - nothing to return.
+        """
+        self.assertEqual(self.cut.stitch_top_k(self.container, self.request,
+                                               k=0), [])
+        condy = {'attributes': [('eq', ('a', ('bar', 8)))]}
+        self.assertEqual(self.cut.stitch_top_k(self.container, self.request,
+                                               condy, 3), [])
+
+    def test_stitch_top_k_for_sanity(self):
+        """
+        Test the top k stitches for sanity - need to be the cheapest of all
+        stitches.
+        """
+        def cost(container, src, trg):
+            return container.nodes[trg].get('bar', 10) - len(src)
+
+        for condy in [None,
+                      {'compositions': [('diff', ('b', 'c'))]},
+                      {'compositions': [('nshare', ('group', ['a', 'b']))],
+                       'attributes': [('lg', ('c', ('bar', 1)))]}]:
+            res1 = self.product.stitch(self.container, self.request,
+                                       conditions=condy)
+            res1.sort(key=lambda item: sum(cost(self.container, src, trg)
+                                           for src, trg in item.edges()
+                                           if src in self.request and
+                                           trg in self.container))
+            for k in [1, 4, 100]:
+                res2 = self.cut.stitch_top_k(self.container, self.request,
+                                             condy, k, cost=cost)
+                self.assertEqual([list(item.edges()) for item in res1[:k]],
+                                 [list(item.edges()) for item in res2])
+        # default cost is the rank.
+        self.container.nodes['1']['rank'] = 2
+        res = self.cut.stitch_top_k(self.container, self.request, k=1)
+        self.assertIn(('a', '2'), res[0].edges())
+
+    def test_iter_stitch_for_sanity(self):
+        """
+        Test lazy stitching for sanity.
+        """
+        condy = {'compositions': [('diff', ('b', 'c'))]}
+        res1 = self.cut.stitch(self.container, self.request, conditions=condy)
+        res2 = self.cut.iter_stitch(self.container, self.request,
+                                    conditions=condy)
+        self.assertNotIsInstance(res2, list)
+        # stop early.
+        first = next(res2)
+        self.assertEqual(list(res1[0].edges()), list(first.edges()))
+        self.assertEqual(len(list(res2)), len(res1) - 1)
+
+        res2 = self.product.iter_stitch(self.container, self.request,
+                                        conditions=condy)
+        self.assertEqual(len(list(res2)), len(res1))
+
+        # custom filters are applied on the fly.
+        res2 = self.cut.iter_stitch(self.container, self.request,
+                                    conditions=condy,
+                                    candidate_filter=lambda c, e, f: {})
+        self.assertEqual(list(res2), [])
+
+
+class TestParallelStitcher(TestBacktrackingSearch):
+    """
+    Test the stitcher using worker processes returns the same stitches as
+    when running in one process.
+    """
+
+    def setUp(self):
+        super(TestParallelStitcher, self).setUp()
+        self.cut = stitch.GlobalStitcher({'x': 'a', 'y': 'b'}, processes=2)
+
+    def test_backtrack_for_sanity(self):
+        """
+        Test the backtracking search in worker processes for sanity.
+        """
+        self.cut = stitch.GlobalStitcher({'x': 'a', 'y': 'b'},
+                                         backtrack=True, processes=2)
+        self.assertEqual(len(self._compare(None)), 18)
+        self._compare({'compositions': [('share', ('group', ['a', 'b'])),
+                                        ('diff', ('b', 'c'))],
+                       'attributes': [('lt', ('b', ('bar', 5)))]})
+
+    def test_iter_stitch_for_sanity(self):
+        """
+        Test lazy stitching for sanity - workers are stopped early.
+        """
+        res = self.cut.iter_stitch(self.container, self.request,
+                                   conditions={'compositions': [
+                                       ('diff', ('b', 'c'))]})
+        self.assertEqual(len(list(next(res).edges())), 4)
+        res.close()
@@ -2,6 +2,7 @@
 unittest for the module level stuff.
 """
 
+import logging
 import unittest
 
 import stitcher
@@ -20,3 +21,60 @@ class StitcherTest(unittest.TestCase):
         Test stitch for failure.
         """
         self.assertRaises(NotImplementedError, self.cut.stitch, None, None)
+
+
+class TraceTest(unittest.TestCase):
+    """
+    Testcase for the structured trace.
+    """
+
+    def setUp(self):
+        self.logger = logging.getLogger('stitcher.test')
+        self.records = []
+        handler = logging.Handler()
+        handler.emit = self.records.append
+        self.logger.addHandler(handler)
+        self.addCleanup(self.logger.removeHandler, handler)
+        self.addCleanup(self.logger.setLevel, logging.NOTSET)
+
+    def test_trace_for_success(self):
+        """
+        Test trace for success.
+        """
+        self.logger.setLevel(stitcher.TRACE)
+        stitcher.trace(self.logger, 'foo', a=1)
+        self.assertEqual(len(self.records), 1)
+        self.assertEqual(self.records[0].levelname, 'TRACE')
+        self.assertEqual(self.records[0].event, 'foo')
+        self.assertEqual(self.records[0].fields, {'a': 1})
+
+    def test_trace_for_failure(self):
+        """
+        Test trace for failure - disabled by default.
+        """
+        self.logger.setLevel(logging.DEBUG)
+        stitcher.trace(self.logger, 'foo', a=1)
+        self.assertEqual(self.records, [])
+
+    def test_trace_for_sanity(self):
+        """
+        Test trace for sanity - fields are only formatted if the record is
+        emitted.
+        """
+        calls = []
+
+        class Field:
+            """
+            Field counting how often it is formatted.
+            """
+
+            def __repr__(self):
+                calls.append(1)
+                return 'field'
+
+        self.logger.setLevel(logging.DEBUG)
+        stitcher.trace(self.logger, 'foo', a=Field())
+        self.assertEqual(calls, [])
+        self.logger.setLevel(stitcher.TRACE)
+        stitcher.trace(self.logger, 'foo', a=Field())
+        self.assertEqual(self.records[0].getMessage(), "foo: {'a': field}")
@@ -81,3 +81,75 @@ class TestNodeRankSticher(unittest.TestCase):
         self.assertTrue(len(res2) == 8)
         self.assertEqual(res2[4],
                          'node B rank is >= 3 and # incoming edges is > 0')
+
+
+class TestBatchValidator(unittest.TestCase):
+    """
+    Test the batch validator.
+    """
+
+    def setUp(self):
+        container_tmp = json.load(open('data/container.json'))
+        self.container = json_graph.node_link_graph(container_tmp,
+                                                    directed=True)
+        request_tmp = json.load(open('data/request.json'))
+        self.request = json_graph.node_link_graph(request_tmp,
+                                                  directed=True)
+        rels = json.load(open('data/stitch.json'))
+        self.stitcher = stitch.GlobalStitcher(rels)
+        self.cut = validators.BatchValidator(self.container, self.request)
+
+    def test_validate_for_success(self):
+        """
+        Test validate for success - graphs & lists of stitches work.
+        """
+        res1 = self.stitcher.stitch(self.container, self.request)
+        stitches = [validators.stitches_of(item, self.container,
+                                           self.request) for item in res1]
+        self.assertEqual(self.cut.validate_incoming_edges(res1, {'b': 5}),
+                         self.cut.validate_incoming_edges(stitches,
+                                                          {'b': 5}))
+        self.assertEqual(self.cut.validate_incoming_edges([]), {})
+
+    def test_validate_for_failure(self):
+        """
+        Test validate for failure - like the validate_* functions ranks are
+        needed.
+        """
+        self.container.add_node('X', **{'type': 'a'})
+        self.container.add_edge('A', 'X')
+        self.cut = validators.BatchValidator(self.container, self.request)
+        self.assertRaises(KeyError, self.cut.validate_incoming_rank, [[]],
+                          {'a': (0, 3)})
+
+    def test_validate_for_sanity(self):
+        """
+        Test validate for sanity - needs to match the validate_* functions.
+        """
+        res1 = self.stitcher.stitch(self.container, self.request)
+        for param in [{'b': 5}, {'b': 4}, {'a': 1, 'b': 2}]:
+            self.assertEqual(validators.validate_incoming_edges(res1, param),
+                             self.cut.validate_incoming_edges(res1, param))
+        for param in [{'a': (0, 3)}, {'b': (1, 0)}, {'a': (2, 1)}]:
+            self.assertEqual(validators.validate_incoming_rank(res1, param),
+                             self.cut.validate_incoming_rank(res1, param))
+
+    def test_capacity_for_sanity(self):
+        """
+        Test the capacity derived from the validators for sanity.
+        """
+        res = validators.capacity(self.container, self.request,
+                                  [('incoming_edges', {'b': 5})])
+        self.assertEqual(set(res.keys()),
+                         set(node for node, attrs in
+                             self.container.nodes(data=True)
+                             if attrs['type'] == 'b'))
+        for node, tmp in res.items():
+            self.assertEqual(tmp, 4 - self.container.in_degree(node))
+        self.assertEqual(validators.capacity(self.container, self.request,
+                                             None), {})
+        self.assertIsNone(validators.capacity(self.container, self.request,
+                                              [('incoming_edges', {'b': 1})]))
+        self.assertTrue(validators.within([('k', 'A'), ('l', 'A')], {}))
+        self.assertFalse(validators.within([('k', 'A'), ('l', 'A')],
+                                           {'A': 1}))
@@ -0,0 +1,113 @@
+"""
+Unittest for the vector module.
+"""
+
+import itertools
+import unittest
+
+import networkx as nx
+
+from stitcher import indexing
+from stitcher import stitch
+from stitcher import vector
+
+
+class VectorTest(unittest.TestCase):
+    """
+    Testcase for the integer encoded candidates & vectorized filters.
+    """
+
+    def setUp(self):
+        self.container = nx.DiGraph()
+        self.container.add_node('1', **{'type': 'a', 'rank': 5, 'grp': 'x'})
+        self.container.add_node('2', **{'type': 'a', 'rank': 1, 'grp': ''})
+        self.container.add_node('3', **{'type': 'a', 'rank': 7, 'grp': 'x'})
+        self.container.add_node('4', **{'type': 'a', 'grp': 'y'})
+        self.container.add_node('5', **{'type': 'a', 'rank': 2})
+        self.index = indexing.ContainerIndex(self.container)
+        self.keys = ['p', 'q', 'r']
+        self.domains = [['1', '2', '3', '4', '5']] * 3
+
+    def _compare(self, conditions):
+        edge_list = {}
+        for item in itertools.product(*self.domains):
+            edges = list(zip(self.keys, item))
+            edge_list[str(edges)] = edges
+        res1 = list(stitch.my_filter(self.container, edge_list,
+                                     conditions).values())
+
+        matrix = vector.encode(self.domains, self.index)
+        matrix = vector.matrix_filter(self.container, self.keys, matrix,
+                                      conditions, self.index)
+        res2 = list(vector.decode(self.keys, matrix, self.index))
+        self.assertEqual(res1, res2)
+
+    def test_encode_for_success(self):
+        """
+        Test encoding for success.
+        """
+        matrix = vector.encode(self.domains, self.index)
+        self.assertEqual(matrix.shape, (125, 3))
+        self.assertEqual(vector.encode([], self.index).shape, (0, 0))
+
+    def test_encode_for_failure(self):
+        """
+        Test encoding for failure - targets need to be in the index.
+        """
+        self.assertRaises(KeyError, vector.encode, [['1', 'x']], self.index)
+
+    def test_encode_for_sanity(self):
+        """
+        Test encoding for sanity - rows are in the order of the product.
+        """
+        domains = [['2', '1'], ['3', '4', '5']]
+        matrix = vector.encode(domains, self.index)
+        self.assertEqual(list(vector.decode(['p', 'q'], matrix, self.index)),
+                         [list(zip(['p', 'q'], item))
+                          for item in itertools.product(*domains)])
+
+    def test_matrix_filter_for_sanity(self):
+        """
+        Test the vectorized filter for sanity - needs to match my_filter.
+        """
+        self._compare(None)
+        self._compare({'attributes': [('eq', ('p', ('rank', 5))),
+                                      ('neq', ('q', ('rank', 5)))]})
+        self._compare({'attributes': [('lg', ('p', ('rank', 2))),
+                                      ('lt', ('q', ('rank', 5))),
+                                      ('gt', ('r', ('rank', 5)))]})
+        self._compare({'attributes': [('regex', ('r', ('grp', '^x')))]})
+        self._compare({'compositions': [('same', ('p', 'q')),
+                                        ('diff', ('q', 'r'))]})
+        self._compare({'compositions': [('diff', ('p', 'p')),
+                                        ('same', ('p', 'z'))]})
+        # '' is no value - the next one counts.
+        self._compare({'compositions': [('share', ('grp', ['p', 'r']))]})
+        self._compare({'compositions': [('nshare', ('grp', ['q', 'r']))]})
+
+    def test_matrix_filter_for_success(self):
+        """
+        Test the vectorized filter for success - odd attribute values.
+        """
+        self.container.add_node('6', **{'type': 'a', 'rank': float('nan')})
+        self.container.add_node('7', **{'type': 'a', 'rank': 2.5,
+                                        'grp': ['x']})
+        self.index = indexing.ContainerIndex(self.container)
+        self.domains = [['1', '2', '3', '4', '5', '6', '7']] * 3
+        for cond in ['eq', 'neq', 'lg', 'lt', 'gt']:
+            self._compare({'attributes': [(cond, ('p', ('rank', 2)))]})
+            self._compare({'attributes': [(cond, ('q', ('rank', 2.5)))]})
+        self._compare({'attributes': [('eq', ('p', ('grp', ['x'])))]})
+        self._compare({'compositions': [('share', ('grp', ['p', 'r']))]})
+        self._compare({'compositions': [('nshare', ('grp', ['q', 'r']))]})
+
+    def test_matrix_filter_for_failure(self):
+        """
+        Test the vectorized filter for failure - like my_filter it can not
+        compare strings to numbers.
+        """
+        matrix = vector.encode(self.domains, self.index)
+        self.assertRaises(TypeError, vector.matrix_filter, self.container,
+                          self.keys, matrix,
+                          {'attributes': [('lg', ('p', ('grp', 1)))]},
+                          self.index)